@@ -7,7 +7,7 @@ from alembic import context
 from sqlmodel import SQLModel
 
 # 导入所有模型类以便Alembic检测所有表
-from app.models.project import Project, InputDocument, OutputDocument
+from app.models.project import Project, InputDocument, OutputDocument, GenerationJob
 from app.models.user import User
 # 导入其他模型...
 
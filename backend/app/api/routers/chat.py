@@ -9,12 +9,17 @@ from app.core.db import get_db
 from app.libs.prompt.prompt import PROMPT_GEN_HTML
 from app.models.schemas import ChatRequest, MonthSummaryRequest, DocStreamRequest, Document2HTMLRequest
 from app.services.document_service import DocumentService
-from app.utils.stream_handler import ai_stream_endpoint
+from app.services.job_service import JobService, get_job_pool
+from app.utils.stream_handler import ai_stream_endpoint, watch_stream_endpoint
 from app.libs.utils.ai_chat_client import (
     ai_chat_stream, 
     ai_chat_stream_async,
-    ai_chat_async
+    ai_chat_async,
+    ai_chat_routed_async,
+    ai_chat_stream_routed_async
 )
+from app.libs.utils.model_registry import STAGE_CHAT, STAGE_QUICK, get_model_registry
+from app.libs.utils.cancellation import CancellationToken
 from app.libs.core.worker import (
     generate_recent_month_summary, 
     generate_doc_async
@@ -52,13 +57,14 @@ async def stream_chat(
             model = chat_request.model
 
         if not model:
-            model = 'deepseek/deepseek-r1-distill-llama-70b'
+            model = get_model_registry().route(STAGE_CHAT)[0]
         
         return await ai_stream_endpoint(
             request=request,
-            stream_generator=ai_chat_stream_async,
+            stream_generator=ai_chat_stream_routed_async,
             stream_params={
                 "message": message,
+                "stage": STAGE_CHAT,
                 "model": model
             },
             model=model
@@ -82,17 +88,24 @@ async def stream_month_summary(
 ):
     """Stream monthly summary document generation"""
     try:
-        # Get project chat content
-        chat_content = document_service.get_project_chat_content(db, project_id)
+        # Get project chat records index
+        chat_content = document_service.get_project_message_table(db, project_id)
+        model = get_model_registry().route(STAGE_CHAT)[0]
+        
+        # 客户端断开且没有其他订阅者时，用令牌停止进行中的分段总结调用
+        cancel_token = CancellationToken()
         
         return await ai_stream_endpoint(
             request=request,
             stream_generator=generate_recent_month_summary,
             stream_params={
                 "chat_content": chat_content,
-                "model": "deepseek/deepseek-r1-distill-llama-70b"
+                "model": model,
+                "cancel_token": cancel_token
             },
-            model="deepseek/deepseek-r1-distill-llama-70b"
+            model=model,
+            share_key=("month_summary", project_id, model, chat_content.digest()),
+            cancel_token=cancel_token
         )
 
     except HTTPException:
@@ -130,13 +143,16 @@ async def stream_doc(
             doc_type = doc_request.doc_type
             model = doc_request.model
         
-        # 获取项目聊天内容
-        chat_content = document_service.get_project_chat_content(db, project_id)
-        if not chat_content:
+        # 获取项目聊天记录索引
+        chat_content = document_service.get_project_message_table(db, project_id)
+        if not chat_content.size:
             raise ValueError("No chat records found")
         
         logger.info(f"处理项目 {project_id} 的文档生成请求，类型: {doc_type}, 模型: {model}")
         
+        # 客户端断开且没有其他订阅者时，用令牌停止进行中的 map / 汇总调用
+        cancel_token = CancellationToken()
+        
         # 使用统一流式端点处理函数
         return await ai_stream_endpoint(
             request=request,
@@ -144,9 +160,12 @@ async def stream_doc(
             stream_params={
                 "chat_records": chat_content,
                 "doc_type": doc_type,
-                "model": model
+                "model": model,
+                "cancel_token": cancel_token
             },
-            model=model
+            model=model,
+            share_key=("doc", project_id, doc_type, model, chat_content.digest()),
+            cancel_token=cancel_token
         )
         
     except ValueError as e:
@@ -156,6 +175,54 @@ async def stream_doc(
         logger.exception(f"处理流式文档请求时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{project_id}/doc_stream/watch")
+async def watch_doc_stream(
+    project_id: str,
+    request: Request,
+    doc_type: str,
+    model: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """旁观正在进行的文档生成（先回放已生成的内容），不会发起新的生成"""
+    chat_content = document_service.get_project_message_table(db, project_id)
+    return await watch_stream_endpoint(
+        request=request,
+        share_key=("doc", project_id, doc_type, model, chat_content.digest()),
+        model=model
+    )
+
+@router.post("/{project_id}/doc_jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_doc_job(
+    project_id: str,
+    doc_request: DocStreamRequest,
+    db: Session = Depends(get_db)
+):
+    """提交后台文档生成任务，立即返回任务 ID；生成不依赖客户端保持连接"""
+    try:
+        job = JobService.submit_job(db, project_id, doc_request.doc_type, doc_request.model)
+        get_job_pool().notify()
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"提交文档生成任务时出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{project_id}/doc_jobs/{job_id}")
+async def get_doc_job(project_id: str, job_id: str, db: Session = Depends(get_db)):
+    """查询任务状态与进度（0-100）"""
+    return JobService.get_job_status(db, project_id, job_id)
+
+@router.get("/{project_id}/doc_jobs/{job_id}/result")
+async def get_doc_job_result(project_id: str, job_id: str, db: Session = Depends(get_db)):
+    """获取已完成任务生成的文档"""
+    return JobService.get_job_result(db, project_id, job_id)
+
+@router.post("/{project_id}/doc_jobs/{job_id}/cancel")
+async def cancel_doc_job(project_id: str, job_id: str, db: Session = Depends(get_db)):
+    """取消排队中或执行中的任务"""
+    return JobService.cancel_job(db, project_id, job_id)
+
 @router.post("/")
 @router.get("/")
 async def chat(
@@ -185,13 +252,14 @@ async def chat(
 
         # 使用默认模型
         if not model or model == 'undefined':
-            model = 'google/gemini-2.0-flash-001'
+            model = get_model_registry().route(STAGE_QUICK)[0]
         
         logger.info(f"处理聊天请求，消息: '{message[:30]}...'，模型: {model}")
         
  
-        response = await ai_chat_async(
+        response = await ai_chat_routed_async(
             message=message,
+            stage=STAGE_QUICK,
             model=model
         )
         
@@ -221,14 +289,15 @@ async def process_document(
         model = request.model
         
         if not model or model == 'undefined':
-            model = 'google/gemini-2.0-flash-001'
+            model = get_model_registry().route(STAGE_QUICK)[0]
         
         logger.info(f"处理文档请求，文档长度: {len(document)}，模型: {model}")
         
         full_prompt = PROMPT_GEN_HTML.format(text=document)
         
-        response = await ai_chat_async(
+        response = await ai_chat_routed_async(
             message=full_prompt,
+            stage=STAGE_QUICK,
             model=model
         )
         
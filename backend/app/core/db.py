@@ -3,7 +3,7 @@ from ..core.config import settings
 import logging
 import os
 from ..models.user import User
-from ..models.project import Project, InputDocument, OutputDocument
+from ..models.project import Project, InputDocument, OutputDocument, GenerationJob
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +40,7 @@ def create_db_and_tables():
         User.__table__,
         Project.__table__,
         InputDocument.__table__,
-        OutputDocument.__table__
+        OutputDocument.__table__,
+        GenerationJob.__table__
     ]
     SQLModel.metadata.create_all(engine, tables=tables) 
\ No newline at end of file
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from ..utils.token_counter import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# merge(docs, depth, index) -> 汇总结果；depth 为输出所在的层（叶子为第 0 层），失败时返回 None
+MergeFn = Callable[[List[str], int, int], Awaitable[Optional[str]]]
+
+
+def _pack(tokens: List[int], budget: int) -> List[List[int]]:
+    """按与 ReduceTree 相同的规则把相邻文档装箱，每组至少两篇（最后一组可以只有一篇）"""
+    groups = []
+    group: List[int] = []
+    for count in tokens:
+        if len(group) >= 2 and sum(group) + count > budget:
+            groups.append(group)
+            group = []
+        group.append(count)
+        if len(group) >= 2 and sum(group) > budget:
+            groups.append(group)
+            group = []
+    if group:
+        groups.append(group)
+    return groups
+
+
+def plan_reduce_tree(doc_tokens: List[int], budget: int, merge_output_tokens: int) -> List[int]:
+    """
+    根据 token 数预先规划汇总树
+
+    Args:
+        doc_tokens: 每篇 map 输出的 token 数（上限估计，例如 min(片段 token 数, 模型输出上限)）
+        budget: 每次汇总的输入 token 上限
+        merge_output_tokens: 每次汇总输出的 token 数上限
+
+    Returns:
+        List[int]: 从叶子开始每层的文档数；最后一层由最终汇总一次完成，层数减一即中间汇总的层数
+    """
+    levels = [len(doc_tokens)]
+    tokens = list(doc_tokens)
+    # 每组至少两篇，每层文档数至少减半，循环一定结束
+    while len(tokens) > 1 and sum(tokens) > budget:
+        tokens = [min(merge_output_tokens, sum(group)) if len(group) > 1 else group[0]
+                  for group in _pack(tokens, budget)]
+        levels.append(len(tokens))
+    return levels
+
+
+class _Level:
+    """汇总树的一层：按序号顺序接收文档，相邻文档装满预算即交给 merge"""
+
+    def __init__(self, tree: "ReduceTree", depth: int):
+        self.tree = tree
+        self.depth = depth
+        self.pending: Dict[int, Optional[str]] = {}
+        self.next_index = 0
+        self.expected: Optional[int] = None
+        self.group: List[str] = []
+        self.group_tokens = 0
+        self.emitted = 0
+        self.finished = False
+
+    @property
+    def is_top(self) -> bool:
+        return self.depth >= self.tree.max_depth
+
+    def add(self, index: int, doc: Optional[str]) -> None:
+        self.pending[index] = doc
+        self._advance()
+
+    def close(self, expected: int) -> None:
+        """本层一共会收到 expected 篇文档（序号 0 到 expected - 1）"""
+        self.expected = expected
+        self._advance()
+
+    def _advance(self) -> None:
+        # 分组只由相邻文档决定，前面的文档未到时后面的先等待
+        while self.next_index in self.pending:
+            doc = self.pending.pop(self.next_index)
+            self.next_index += 1
+            if doc:
+                self._push(doc)
+        if not self.finished and self.expected is not None and self.next_index >= self.expected:
+            self.finished = True
+            self._finish()
+
+    def _push(self, doc: str) -> None:
+        tokens = get_token_counter().count(doc)
+        budget = self.tree.budget
+        # 分组只在装满时提交：提交说明本层总量超过预算，上面一定还需要一层
+        if not self.is_top and len(self.group) >= 2 and self.group_tokens + tokens > budget:
+            self._emit()
+        self.group.append(doc)
+        self.group_tokens += tokens
+        if not self.is_top and len(self.group) >= 2 and self.group_tokens > budget:
+            self._emit()
+
+    def _emit(self) -> None:
+        index = self.emitted
+        self.emitted += 1
+        docs, self.group, self.group_tokens = self.group, [], 0
+        parent = self.tree.level(self.depth + 1)
+        if len(docs) == 1:
+            parent.add(index, docs[0])
+        else:
+            self.tree.spawn_merge(docs, self.depth + 1, index, parent)
+
+    def _finish(self) -> None:
+        if self.emitted == 0:
+            # 没有提交过分组：本层的全部文档不超过预算（或已到规划的最高层），交给最终汇总
+            self.tree.set_root(self.group)
+            return
+        if self.group:
+            self._emit()
+        self.tree.level(self.depth + 1).close(self.emitted)
+
+
+class ReduceTree:
+    """
+    流水线式汇总树
+
+    map 输出按片段序号陆续到达（顺序不定），每层按序号顺序把相邻文档装箱：
+    一组装满 budget 立即开始汇总，汇总结果作为上一层的文档继续装箱，因此汇总与 map 阶段重叠进行。
+    某一层全部到齐且从未装满过分组时，这一层的文档就是最终汇总的输入。
+
+    终止性：每组至少两篇，每层文档数至少减半；层数另外受规划的 max_depth 限制，
+    到达该层时不再分组，全部交给最终汇总（超出预算时按比例截断每篇文档）。
+    """
+
+    def __init__(self, merge: MergeFn, budget: int, max_depth: int):
+        self.merge = merge
+        self.budget = budget
+        self.max_depth = max_depth
+        self.merges = 0
+        self._levels: List[_Level] = [_Level(self, 0)]
+        self._tasks: Set[asyncio.Task] = set()
+        self._seen: Set[int] = set()
+        self._root: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def level(self, depth: int) -> _Level:
+        while len(self._levels) <= depth:
+            self._levels.append(_Level(self, len(self._levels)))
+        return self._levels[depth]
+
+    @property
+    def depth(self) -> int:
+        """目前用到的层数（含叶子层）"""
+        return len(self._levels)
+
+    def add(self, index: int, doc: Optional[str]) -> None:
+        """提交第 index 个 map 片段的输出；失败的片段传 None"""
+        self._seen.add(index)
+        self._guard(self._levels[0].add, index, doc)
+
+    def close(self, count: int) -> None:
+        """map 阶段结束，一共 count 个片段；没有提交过的片段按失败处理"""
+        for index in range(count):
+            if index not in self._seen:
+                self.add(index, None)
+        self._guard(self._levels[0].close, count)
+
+    def _guard(self, fn, *args) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            if not self._root.done():
+                self._root.set_exception(e)
+
+    def fit(self, docs: List[str]) -> List[str]:
+        """总量超出预算时按比例截断每篇文档，保证一次汇总的输入不超过预算"""
+        counter = get_token_counter()
+        if sum(counter.count_batch(docs)) <= self.budget:
+            return docs
+        share = max(1, self.budget // len(docs))
+        logger.warning(f"{len(docs)} documents exceed the reduce budget of {self.budget} tokens, "
+                       f"truncating each to {share} tokens")
+        return [counter.truncate(doc, share) for doc in docs]
+
+    def spawn_merge(self, docs: List[str], depth: int, index: int, parent: _Level) -> None:
+        async def run():
+            try:
+                result = await self.merge(self.fit(docs), depth, index)
+            except Exception as e:
+                logger.error(f"Merging group {index} at level {depth} failed: {str(e)}")
+                result = None
+            self._guard(parent.add, index, result)
+
+        self.merges += 1
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def set_root(self, docs: List[str]) -> None:
+        if not self._root.done():
+            self._root.set_result(self.fit(docs) if docs else [])
+
+    async def result(self) -> List[str]:
+        """等待汇总树完成，返回最终汇总的输入文档"""
+        return await self._root
+
+    def cancel(self) -> None:
+        """取消仍在进行的汇总（例如 map 阶段失败或调用方被取消）"""
+        for task in list(self._tasks):
+            task.cancel()
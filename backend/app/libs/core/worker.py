@@ -1,12 +1,25 @@
-from ..utils.ai_chat_client import ai_chat, ai_chat_stream, ai_chat_async, num_tokens_from_string, ai_chat_stream_async
+from ..utils.ai_chat_client import (
+    ai_chat,
+    ai_chat_stream,
+    ai_chat_async,
+    num_tokens_from_string,
+    ai_chat_stream_async,
+    ai_chat_routed_async,
+    ai_chat_stream_routed_async,
+)
 from datetime import datetime
+import hashlib
 import re
 from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
 from tqdm import tqdm
 import os 
-from ..preprocessing.reader import read_file
-from ..preprocessing.split import split_chat_records, split_by_time_period, split_by_tokens
+from ..preprocessing.split import split_chat_records, split_by_time_period, split_by_tokens, limit_text_length
+from ..preprocessing.message_table import MessageTable, as_message_table
+from ..preprocessing.prefilter import PrefilterConfig, prefilter_messages
+from ..preprocessing.dedup import DedupConfig, dedup_messages
+from ..preprocessing.partition import anchored_split_by_tokens, balanced_split_by_tokens
+from ..preprocessing.timeline import period_groups
 from ..prompt.prompt import (
     PROMPT_GEN_OVERVIEW,
     PROMPT_MERGE_SUMMARY,
@@ -18,103 +31,71 @@ from ..prompt.prompt import (
 )
 from dataclasses import dataclass
 from typing import List, Optional, Callable
-from tiktoken import get_encoding
+from ..utils.token_counter import get_token_counter
+from ..utils.rate_limiter import get_rate_limiter
+from ..utils.hedging import HedgeConfig, get_hedger
+from ..utils.model_registry import STAGE_CHAT, STAGE_MAP, STAGE_REDUCE, get_model_registry
+from ..utils.circuit_breaker import CircuitOpenError
+from ..utils.job_store import STAGE_FINAL, JobCheckpoint, get_job_store, job_id_for
+from ..utils.cancellation import CancellationToken
+from ..utils.chunk_cache import ChunkCache, chunk_key, get_chunk_cache
+from .reduce_tree import ReduceTree, plan_reduce_tree
 import asyncio
+from contextlib import nullcontext
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def limit_text_length(text: str, max_tokens: int = 10000) -> List[str]:
-    """
-    将文本按照token限制分割成多个部分
-    
-    Args:
-        text: 原始文本
-        max_tokens: 每个部分的最大token数量（默认10000）
-    
-    Returns:
-        List[str]: 分割后的文本列表
-    """
-    # 粗略估计：平均每个token约4个字符
-    CHARS_PER_TOKEN = 4
-    max_chars = max_tokens * CHARS_PER_TOKEN
-    
-    if not text:
-        return []
-        
-    if len(text) <= max_chars:
-        return [text]
-        
-    # 按消息分割
-    messages = text.split('\n')
-    
-    # 初始化结果列表和当前块
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for message in messages:
-        message_length = len(message) + 1  # +1 for newline
-        
-        # 如果当前消息加入后超过限制，保存当前块并开始新块
-        if current_length + message_length > max_chars and current_chunk:
-            chunks.append('\n'.join(current_chunk))
-            current_chunk = []
-            current_length = 0
-            
-        # 处理单条消息超过限制的情况
-        if message_length > max_chars:
-            # 如果当前块非空，先保存
-            if current_chunk:
-                chunks.append('\n'.join(current_chunk))
-                current_chunk = []
-                current_length = 0
-            # 将长消息单独作为一块（可能需要进一步处理）
-            chunks.append(message)
-            continue
-            
-        # 将消息添加到当前块
-        current_chunk.append(message)
-        current_length += message_length
-    
-    # 处理最后一个块
-    if current_chunk:
-        chunks.append('\n'.join(current_chunk))
-    
-    return chunks
-
-
 async def process_chunk_parallel_async(
     chunks: List[str], 
-    model: str = "deepseek-reasoner",
+    model: Optional[str] = None,
     doc_type: str = "recent_month_summary",
-    concurrency_limit: int = 10,
+    concurrency_limit: Optional[int] = None,
     retry_count: int = 1,
-    timeout: float = 200.0  
+    timeout: float = 200.0,
+    hedge: Optional[HedgeConfig] = None,
+    stage: str = STAGE_MAP,
+    checkpoint: Optional[JobCheckpoint] = None,
+    on_result: Optional[Callable[[int, Optional[str]], None]] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    chunk_cache: Optional[ChunkCache] = None
 ) -> List[str]:
     """
     并行处理文本块生成摘要
     
     Args:
         chunks: 文本块列表
-        model: 使用的AI模型
+        model: 优先使用的AI模型；为空时由路由器按阶段选择，不可用时自动切换到其他候选模型
         doc_type: 文档类型
-        concurrency_limit: 同时处理的最大文本块数量
+        concurrency_limit: 同时处理的最大文本块数量；默认不额外限制，由各服务商/模型的限流器按实际配额控制并发
         retry_count: 处理失败时的重试次数
-        timeout: 每个块处理的最大等待时间(秒)
+        timeout: 每个候选模型处理一个块的最大等待时间(秒)；超时后切换到下一个候选模型，
+            每个块的总等待时间为 timeout 乘以候选模型数
+        hedge: 对冲配置；设置后，耗时超过近期延迟分位数的请求会再发一个副本，先返回的胜出
+        stage: 路由阶段
+        checkpoint: 任务检查点；已完成的块直接取回结果，新完成的块立即保存
+        on_result: 每个块完成时以 (块序号, 结果) 调用，失败的块结果为 None；用于让下游边到边处理
+        cancel_token: 取消令牌；取消时排队和进行中的块立即停止，并抛出 asyncio.CancelledError
+        chunk_cache: map 结果缓存；按 (块内容, 文档类型, 模型, 提示词版本) 跨任务、跨项目复用结果
     
     Returns:
         List[str]: 生成的摘要列表
     """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    candidates = get_model_registry().route(stage, preferred=model)
+    model = model or candidates[0]
+    # 外层超时必须覆盖所有候选模型，否则第一个模型超时后来不及切换
+    budget = timeout * len(candidates)
     print(f"\nStarting parallel processing with model: {model}")
     print(f"Number of chunks: {len(chunks)}")
     print(f"Document type: {doc_type}")
-    print(f"Concurrency limit: {concurrency_limit}")
-    print(f"Timeout: {timeout} seconds")
+    print(f"Concurrency limit: {concurrency_limit or 'adaptive (per-provider rate limiter)'}")
+    print(f"Timeout: {timeout} seconds per model, {budget} seconds per chunk")
     
-    # 创建信号量限制并发
-    semaphore = asyncio.Semaphore(concurrency_limit)
+    # 指定了并发数时用信号量限制，否则交给限流器
+    semaphore = asyncio.Semaphore(concurrency_limit) if concurrency_limit else nullcontext()
     
     async def process_single_chunk(chunk: str, chunk_index: int) -> tuple[int, Optional[str]]:
         # 使用信号量控制并发
@@ -130,17 +111,44 @@ async def process_chunk_parallel_async(
                         prompt = PROMPT_DRY_CONTENT.format(chat_records=chunk)
                     else:
                         prompt = PROMPT_GEN_PART_DOC.format(chat_records=chunk, doc_type=doc_type)
+
+                    if checkpoint is not None and attempt == 0:
+                        saved = await checkpoint.aget(prompt)
+                        if saved is not None:
+                            return chunk_index, saved
+
+                    if chunk_cache is not None and attempt == 0:
+                        cached = await chunk_cache.aget(chunk_key(chunk, doc_type, model))
+                        if cached is not None:
+                            if checkpoint is not None:
+                                await checkpoint.aput(chunk_index, prompt, cached)
+                            return chunk_index, cached
                     
+                    async def answer(request_model: str, coalesce: bool = True) -> tuple[str, str]:
+                        # 同时返回实际给出回复的模型：故障切换或对冲胜出时与 model 不同
+                        answered = []
+                        result = await ai_chat_routed_async(
+                            message=prompt,
+                            stage=stage,
+                            model=request_model,
+                            coalesce=coalesce,
+                            timeout=timeout,
+                            on_model=answered.append
+                        )
+                        return result, answered[0]
+
                     # 带超时的AI调用
                     try:
                         # 将AI调用包装在wait_for中以增加超时
-                        summary = await asyncio.wait_for(
-                            ai_chat_async(
-                                message=prompt,
-                                model=model
-                            ),
-                            timeout=timeout
-                        )
+                        if hedge is not None:
+                            request = get_hedger(model).run(
+                                # 对冲请求不能与原请求合并，否则副本只会等待同一个慢请求
+                                lambda request_model: answer(request_model, coalesce=False),
+                                hedge
+                            )
+                        else:
+                            request = answer(model)
+                        summary, answered_model = await asyncio.wait_for(request, timeout=budget)
                         
                         # 验证响应
                         if not summary or len(summary.strip()) == 0:
@@ -150,14 +158,24 @@ async def process_chunk_parallel_async(
                                 continue
                             print(f"Warning: Empty response from model for chunk {chunk_index} after all attempts")
                             return chunk_index, None
-                        
+
+                        if checkpoint is not None:
+                            await checkpoint.aput(chunk_index, prompt, summary)
+                        if chunk_cache is not None:
+                            # 按实际回复的模型保存，不会把备用模型的结果当作首选模型的结果复用
+                            await chunk_cache.aput(chunk_key(chunk, doc_type, answered_model), doc_type,
+                                                   answered_model, summary)
                         return chunk_index, summary
                         
+                    except CircuitOpenError as e:
+                        # 所有候选模型都已熔断，重试也会被立即拒绝，直接放弃该块
+                        print(f"Circuit open for chunk {chunk_index}, skipping: {str(e)}")
+                        return chunk_index, None
                     except asyncio.TimeoutError:
                         if attempt < retry_count:
-                            print(f"Timeout ({timeout}s) for chunk {chunk_index}, attempt {attempt+1}/{retry_count+1}")
+                            print(f"Timeout ({budget}s) for chunk {chunk_index}, attempt {attempt+1}/{retry_count+1}")
                             continue
-                        print(f"Timeout ({timeout}s) for chunk {chunk_index} after all attempts")
+                        print(f"Timeout ({budget}s) for chunk {chunk_index} after all attempts")
                         return chunk_index, None
                     except Exception as e:
                         if attempt < retry_count:
@@ -178,11 +196,15 @@ async def process_chunk_parallel_async(
             # 如果执行到这里，说明所有尝试都失败了
             return chunk_index, None
 
-    # 创建任务列表
+    # 按序号顺序创建任务，限流器按到达顺序放行，靠前的块先完成，下游汇总可以尽早开始
+    # （直接把协程交给 as_completed 时启动顺序是随机的）
     tasks = [
-        process_single_chunk(chunk, i) 
+        asyncio.ensure_future(process_single_chunk(chunk, i))
         for i, chunk in enumerate(chunks)
     ]
+    if cancel_token is not None:
+        for task in tasks:
+            cancel_token.track(task)
     
     # 使用tqdm创建进度条
     pbar = tqdm(total=len(tasks), desc="Processing chunks")
@@ -201,6 +223,8 @@ async def process_chunk_parallel_async(
                 else:
                     failed_chunks.append(index)
                 pbar.update(1)
+                if on_result is not None:
+                    on_result(index, result)
             except asyncio.TimeoutError:
                 # 记录顶层任务超时
                 print(f"Task timed out at top level")
@@ -213,6 +237,10 @@ async def process_chunk_parallel_async(
         print("\nProcess interrupted by user. Saving completed results...")
         # 让已完成的任务保持完成状态
     finally:
+        # 被取消或提前退出时不留下后台任务，释放它们占用的并发名额
+        for task in tasks:
+            if not task.done():
+                task.cancel()
         pbar.close()
     
     # 打印处理统计
@@ -236,35 +264,82 @@ async def process_chunk_parallel_async(
     return [result for _, result in results if result is not None]
 
 
-async def generate_recent_month_summary(chat_content: str, 
+def preprocess_chat_records(chat_records: "str | MessageTable",
+                            prefilter: bool = False,
+                            prefilter_config: Optional[PrefilterConfig] = None,
+                            dedup: bool = False,
+                            dedup_config: Optional[DedupConfig] = None) -> "str | MessageTable":
+    """
+    发送给模型之前的消息级预处理：低信息量消息预过滤、近似重复消息合并
+
+    两者都会改变发给模型的内容，默认关闭，由调用方显式开启。非聊天记录格式的文本原样返回。
+
+    Raises:
+        ValueError: 预处理后没有剩下任何消息
+    """
+    if not (prefilter or dedup):
+        return chat_records
+    table = as_message_table(chat_records)
+    if not len(table):
+        return chat_records
+    if prefilter:
+        table, report = prefilter_messages(table, prefilter_config)
+        logger.info(report.summary())
+    if dedup:
+        table, report = dedup_messages(table, dedup_config)
+        logger.info(report.summary())
+    if not len(table):
+        raise ValueError("No chat records left after filtering")
+    return table
+
+
+async def generate_recent_month_summary(chat_content: "str | MessageTable", 
                                 output_file: Optional[str] = None,
-                                model: str = "deepseek-reasoner",
-                                max_tokens: int = 10000) -> str:
+                                model: Optional[str] = None,
+                                max_tokens: int = 10000,
+                                prefilter: bool = False,
+                                prefilter_config: Optional[PrefilterConfig] = None,
+                                dedup: bool = False,
+                                dedup_config: Optional[DedupConfig] = None,
+                                cancel_token: Optional[CancellationToken] = None) -> str:
     """
     生成最近一个月的月度总结
     
     Args:
-        input_file: 输入文件路径
+        chat_content: 聊天记录文本或已构建的 MessageTable
         output_file: 输出文件路径（可选）
-        model: 使用的AI模型
+        model: 优先使用的AI模型，为空时按聊天阶段路由
         max_tokens: 每个块的最大token数量
+        prefilter: 是否先丢弃低信息量消息（默认关闭，与 dedup 一样需要显式开启）
+        prefilter_config: 预过滤配置，默认使用 PrefilterConfig()
+        dedup: 是否合并近似重复的消息（转发、复制粘贴的公告等）
+        dedup_config: 去重配置，默认使用 DedupConfig()
+        cancel_token: 取消令牌；被取消时（例如客户端断开且没有其他订阅者）排队和进行中的调用立即停止，
+            并抛出 asyncio.CancelledError
     
     Returns:
         sream流
     """
-    segments = split_by_time_period(chat_content, 'month')
-    
-    if not segments:
+    cancel_token = cancel_token or CancellationToken()
+    table = as_message_table(chat_content)
+    if not len(table):
         raise ValueError("No chat segments found")
-    
-    recent_month_records = segments[-1]
+
+    # 先取出最近一个月，再做预处理，避免更早的副本吞掉本月的消息
+    recent_month = table.take(period_groups(table.timestamp_array(), 'month')[-1])
+    recent_month = await asyncio.to_thread(preprocess_chat_records, recent_month, prefilter, prefilter_config,
+                                           dedup, dedup_config)
+    recent_month_records = recent_month.join()
     if not recent_month_records:
         raise ValueError("No chat records found in the most recent month")
     
-    chunks = limit_text_length(recent_month_records, max_tokens=max_tokens)
-    summaries = await process_chunk_parallel_async(chunks, model=model, doc_type="recent_month_summary")
-    return ai_chat_stream_async(
+    chunks = await asyncio.to_thread(limit_text_length, recent_month_records, max_tokens=max_tokens)
+    summaries = await process_chunk_parallel_async(chunks, model=model, doc_type="recent_month_summary", stage=STAGE_CHAT,
+                                                   cancel_token=cancel_token)
+    cancel_token.raise_if_cancelled()
+    return ai_chat_stream_routed_async(
         message=PROMPT_MERGE_SUMMARY.format(summaries='\n'.join(summaries)), 
+        stage=STAGE_CHAT,
         model=model
     )
 
@@ -282,14 +357,14 @@ def resum_part_docs(part_docs: list, max_tokens: int = 100000) -> list:
     if not part_docs:
         return []
         
-    enc = get_encoding("cl100k_base")
+    # 计数结果按内容缓存，多轮汇总时未变化的文档不会重复编码
+    doc_token_counts = get_token_counter().count_batch(part_docs)
     
     grouped_docs = []
     current_group = []
     current_tokens = 0
     
-    for doc in part_docs:
-        doc_tokens = len(enc.encode(doc))
+    for doc, doc_tokens in zip(part_docs, doc_token_counts):
         
         if doc_tokens > max_tokens:
             if current_group:
@@ -312,12 +387,32 @@ def resum_part_docs(part_docs: list, max_tokens: int = 100000) -> list:
     
     return grouped_docs
 
+async def reduce_prompt_async(prompt: str,
+                              model: Optional[str] = None,
+                              checkpoint: Optional[JobCheckpoint] = None,
+                              index: int = 0) -> str:
+    """执行一次汇总调用；有检查点时先取回已保存的结果，新结果立即保存"""
+    if checkpoint is not None:
+        saved = await checkpoint.aget(prompt)
+        if saved is not None:
+            return saved
+    result = await ai_chat_routed_async(
+        message=prompt,
+        stage=STAGE_REDUCE,
+        model=model
+    )
+    if checkpoint is not None:
+        await checkpoint.aput(index, prompt, result)
+    return result
+
 async def process_grouped_docs_parallel(
     grouped_docs: List[str],
     prompt_template: str,
-    model: str = "deepseek-reasoner",
+    model: Optional[str] = None,
     progress_callback: Optional[Callable] = None,
-    concurrency_limit: int = 10  
+    concurrency_limit: int = 10,
+    checkpoint: Optional[JobCheckpoint] = None,
+    cancel_token: Optional[CancellationToken] = None
 ) -> List[str]:
     """
     并行处理分组后的文档
@@ -325,19 +420,21 @@ async def process_grouped_docs_parallel(
     Args:
         grouped_docs: 分组后的文档列表
         prompt_template: 提示模板字符串
-        model: 使用的AI模型
+        model: 优先使用的AI模型，为空时按汇总阶段路由
         progress_callback: 进度回调函数
         concurrency_limit: 同时处理的最大文档数量
+        checkpoint: 任务检查点；已完成的分组直接取回结果，新完成的分组立即保存
+        cancel_token: 取消令牌；取消时排队和进行中的分组立即停止，并抛出 asyncio.CancelledError
     
     Returns:
         List[str]: 处理结果列表，保持原始顺序
     """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
     async def process_single_doc(doc: str, index: int) -> tuple[int, str]:
         try:
-            result = await ai_chat_async(
-                message=prompt_template.format(part_docs=doc),
-                model=model
-            )
+            result = await reduce_prompt_async(prompt_template.format(part_docs=doc), model, checkpoint, index)
             return index, result
         except Exception as e:
             print(f"Error processing group {index}: {str(e)}")
@@ -352,114 +449,226 @@ async def process_grouped_docs_parallel(
     
     # 创建任务列表
     tasks = [
-        bounded_process(doc, i) 
+        asyncio.ensure_future(bounded_process(doc, i))
         for i, doc in enumerate(grouped_docs)
     ]
+    if cancel_token is not None:
+        for task in tasks:
+            cancel_token.track(task)
     
     # 使用tqdm创建进度条
     pbar = tqdm(total=len(tasks), desc="Processing document groups")
     results = []
     
     # 并行执行任务
-    for completed_task in asyncio.as_completed(tasks):
-        try:
-            index, result = await completed_task
-            if result is not None:
-                results.append((index, result))
-            
-            # 更新进度
-            pbar.update(1)
-            if progress_callback:
-                try:
-                    progress = (pbar.n / len(tasks)) * 100  
-                    progress_callback(progress)
-                except Exception as e:
-                    print(f"Progress callback failed: {str(e)}")
-                    
-        except Exception as e:
-            print(f"Task failed: {str(e)}")
-    
-    pbar.close()
+    try:
+        for completed_task in asyncio.as_completed(tasks):
+            try:
+                index, result = await completed_task
+                if result is not None:
+                    results.append((index, result))
+                
+                # 更新进度
+                pbar.update(1)
+                if progress_callback:
+                    try:
+                        progress = (pbar.n / len(tasks)) * 100  
+                        progress_callback(progress)
+                    except Exception as e:
+                        print(f"Progress callback failed: {str(e)}")
+                        
+            except Exception as e:
+                print(f"Task failed: {str(e)}")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        pbar.close()
     
     results.sort(key=lambda x: x[0])
     return [result for _, result in results if result is not None]
 
-def generate_doc_single_chunk(chat_records: str, doc_type: str, model: str = "deepseek-reasoner"):
-    """直接生成单个文档"""
+def single_chunk_prompt(chat_records: str, doc_type: str) -> str:
+    """只有一个段落时直接生成文档的提示"""
     if doc_type == "summary":
-        prompt = PROMPT_SUMMARY_CONTENT.format(chat_records=chat_records)
+        return PROMPT_SUMMARY_CONTENT.format(chat_records=chat_records)
     elif doc_type == "QA":
-        prompt = PROMPT_GEN_QA.format(chat_records=chat_records)
+        return PROMPT_GEN_QA.format(chat_records=chat_records)
     elif doc_type == "knowledge":
-        prompt = PROMPT_DRY_CONTENT.format(chat_records=chat_records)
-    else:
-        prompt = PROMPT_MERGE_DOC.format(part_docs=chat_records)
-    
-    return ai_chat_stream_async(
-        message=prompt, 
+        return PROMPT_DRY_CONTENT.format(chat_records=chat_records)
+    return PROMPT_MERGE_DOC.format(part_docs=chat_records)
+
+def generate_doc_single_chunk(chat_records: str, doc_type: str, model: Optional[str] = None):
+    """直接生成单个文档"""
+    return ai_chat_stream_routed_async(
+        message=single_chunk_prompt(chat_records, doc_type), 
+        stage=STAGE_REDUCE,
         model=model
     )
 
+def stream_final_doc(prompt: str, model: Optional[str] = None, checkpoint: Optional[JobCheckpoint] = None):
+    """流式生成最终文档；有检查点时已完成的任务直接回放结果，新生成的结果完整结束后保存"""
+    def factory():
+        return ai_chat_stream_routed_async(message=prompt, stage=STAGE_REDUCE, model=model)
+    if checkpoint is None:
+        return factory()
+    return checkpoint.for_stage(STAGE_FINAL).stream(prompt, factory)
+
+
+async def generate_doc_async(chat_records: "str | MessageTable",
+                             doc_type: str,
+                             model: Optional[str] = None,
+                             max_tokens: int = 50000,
+                             prefilter: bool = False,
+                             prefilter_config: Optional[PrefilterConfig] = None,
+                             dedup: bool = False,
+                             dedup_config: Optional[DedupConfig] = None,
+                             hedge: Optional[HedgeConfig] = None,
+                             job_id: Optional[str] = None,
+                             progress_callback: Optional[Callable[[float], None]] = None,
+                             cancel_token: Optional[CancellationToken] = None):
+    """
+    生成文档（异步版本）；model 为空时各阶段由路由器选择模型，hedge 不为空时 map 阶段对慢请求发出对冲请求。
+    hedge 为空时读取 HedgeConfig.from_env()，LLM_HEDGE_ENABLED 打开时启用
+
+    启用任务检查点（LLM_JOB_STORE_ENABLED）时，每个完成的片段、汇总分组和最终文档都按 job_id 保存；
+    任务中断后以相同 job_id 重新运行会跳过已完成的部分。job_id 为空时由聊天记录内容和参数计算，
+    因此重复提交相同的任务会自动恢复。
+
+    progress_callback 以 0-100 的进度调用：map 阶段按完成的片段数占 80%，汇总树完成时为 90%，
+    最终文档由调用方在流式输出结束后记为完成。
+
+    启用 map 结果缓存（LLM_CHUNK_CACHE_ENABLED，默认关闭）时，片段只在天边界处按内容定义的锚点切分，
+    新导出中未变化的历史片段逐字不变，直接复用缓存的 map 结果（不同项目上传的相同群聊同样适用）。
+
+    cancel_token 被取消时（例如客户端断开且没有其他订阅者），排队和进行中的 map、汇总调用立即停止，
+    已完成的单元仍保留在检查点中，并抛出 asyncio.CancelledError。
+    """
+    cancel_token = cancel_token or CancellationToken()
+    if hedge is None:
+        # 调用方显式传入的配置总是生效；enabled 只控制环境变量里的默认配置
+        env_hedge = HedgeConfig.from_env()
+        hedge = env_hedge if env_hedge.enabled else None
+    def report(progress: float):
+        if progress_callback:
+            try:
+                progress_callback(progress)
+            except Exception as e:
+                print(f"Progress callback failed: {str(e)}")
 
-async def generate_doc_async(chat_records: str, doc_type: str, model: str = "deepseek-reasoner", max_tokens: int = 50000):
-    """生成文档（异步版本）"""
     logger.info(f"=== 开始文档生成 ===")
-    logger.info(f"聊天记录长度: {len(chat_records)} 字符")
+    if isinstance(chat_records, MessageTable):
+        logger.info(f"聊天记录长度: {chat_records.size} 字符/字节, {len(chat_records)} 条消息")
+    else:
+        logger.info(f"聊天记录长度: {len(chat_records)} 字符")
     logger.info(f"文档类型: {doc_type}")
-    logger.info(f"使用模型: {model}")
+    logger.info(f"使用模型: {model or '按阶段自动路由'}")
     
+    # map 阶段选当前最快的健康模型；汇总阶段优先使用调用方指定的模型
+    registry = get_model_registry()
+    map_model = registry.route(STAGE_MAP)[0]
+    reduce_model = model or registry.route(STAGE_REDUCE)[0]
+
+    checkpoint = None
+    store = get_job_store()
+    if store.config.enabled:
+        if job_id is None:
+            if isinstance(chat_records, MessageTable):
+                content_digest = await asyncio.to_thread(chat_records.digest)
+            else:
+                content_digest = await asyncio.to_thread(lambda: hashlib.sha256(chat_records.encode('utf-8')).hexdigest())
+            # 检查点的输入哈希与模型无关，模型和预处理配置必须体现在任务 ID 中，换模型时不会取回其他模型的结果。
+            # 用配置的阶段路由而不是 route() 当前选中的模型：后者取决于实时延迟和熔断状态，
+            # 同一个任务重启后可能换了模型，ID 变化就无法恢复
+            job_id = job_id_for(content_digest, doc_type, max_tokens, model,
+                                registry.routes.get(STAGE_MAP), registry.routes.get(STAGE_REDUCE),
+                                prefilter, prefilter_config or PrefilterConfig(),
+                                dedup, dedup_config or DedupConfig())
+        resumed = await asyncio.to_thread(store.start, job_id, doc_type)
+        if resumed:
+            logger.info(f"恢复任务 {job_id}: 已有 {resumed} 个检查点")
+        checkpoint = JobCheckpoint(store, job_id, STAGE_MAP)
+
+    if prefilter or dedup:
+        logger.info("0. 预过滤低信息量消息、合并重复消息...")
+        chat_records = await asyncio.to_thread(preprocess_chat_records, chat_records, prefilter, prefilter_config,
+                                               dedup, dedup_config)
+
+    # 片段数按 map 模型配置的并发数（LLM_LIMIT_<PROVIDER>_CONCURRENCY）取整；
+    # 不用限流器自适应调整后的当前值，否则每次运行的切分不同，检查点无法命中
+    map_concurrency = get_rate_limiter(map_model).config.initial_concurrency
+
+    # 切分和计数要对整个导出的消息计算 token 数，放到线程中执行，不阻塞事件循环上的其他请求
     logger.info(f"1. 将聊天记录分割为段落...")
-    segments = split_by_tokens(chat_records, max_tokens=max_tokens)
+    chunk_cache = get_chunk_cache()
+    if chunk_cache.config.enabled:
+        # 切分点只取决于各天自身，未变化的历史片段保持不变，可以命中缓存
+        segments = await asyncio.to_thread(anchored_split_by_tokens, chat_records, max_tokens=max_tokens)
+    else:
+        chunk_cache = None
+        segments = await asyncio.to_thread(balanced_split_by_tokens, chat_records, max_tokens=max_tokens,
+                                           concurrency=map_concurrency)
     logger.info(f"创建了 {len(segments)} 个段落")
     
-    total_tokens = sum(num_tokens_from_string(s) for s in segments)
+    segment_tokens = await asyncio.to_thread(get_token_counter().count_batch, segments)
+    total_tokens = sum(segment_tokens)
     avg_tokens = total_tokens / len(segments) if segments else 0
     logger.info(f"平均段落token数: {avg_tokens:.0f}")
     logger.info(f"总token数: {total_tokens}")
     
+    cancel_token.raise_if_cancelled()
     if len(segments) == 1:
-        return generate_doc_single_chunk(segments[0], doc_type, model)
+        return stream_final_doc(single_chunk_prompt(segments[0], doc_type), model, checkpoint)
 
-    logger.info("\n2. 并行处理段落...")
-    default_model = "google/gemini-2.0-flash-001"
-    part_docs = await process_chunk_parallel_async(segments, model=default_model, doc_type=doc_type)
-    logger.info(f"生成了 {len(part_docs)} 个部分文档")
-    
-    # 合并文档并检查token数量
-    logger.info("\n3. 合并并检查token数量...")
-    combined_docs = '\n'.join(part_docs)
-    current_tokens = num_tokens_from_string(combined_docs, encoding_name="cl100k_base")
-    logger.info(f"初始合并文档token数: {current_tokens}")
-    
-    iteration = 1
-    while current_tokens > max_tokens:
-        logger.info("3.1 汇总部分文档...")
-        part_docs = resum_part_docs(part_docs)
-        logger.info(f"汇总为 {len(part_docs)} 组")
-        
-        logger.info("3.2 处理汇总的组...")
-        # 直接使用异步版本
-        part_docs = await process_grouped_docs_parallel(
-            grouped_docs=part_docs,
-            prompt_template=PROMPT_MERGE_DOC,
-            model=model
+    # 按 token 数预先规划汇总树：每篇 map 输出不超过片段本身和模型的输出上限，汇总输出不超过汇总模型的输出上限
+    map_output_limit = registry.spec(map_model).max_output_tokens
+    plan = plan_reduce_tree([min(tokens, map_output_limit) for tokens in segment_tokens],
+                            budget=max_tokens,
+                            merge_output_tokens=registry.spec(reduce_model).max_output_tokens)
+    logger.info(f"汇总树规划: 各层文档数 {plan}，最多 {len(plan) - 1} 层中间汇总")
+
+    async def merge(docs: List[str], depth: int, index: int) -> Optional[str]:
+        return await reduce_prompt_async(
+            PROMPT_MERGE_DOC.format(part_docs='\n'.join(docs)),
+            model,
+            checkpoint.for_stage(f"reduce:{depth}") if checkpoint else None,
+            index
         )
-        logger.info(f"处理了 {len(part_docs)} 组")
-        
-        combined_docs = '\n'.join(part_docs)
-        current_tokens = num_tokens_from_string(combined_docs, encoding_name="cl100k_base")
-        logger.info(f"处理后token数: {current_tokens}")
-        
-        iteration += 1
-    
+
+    logger.info("\n2. 并行处理段落，相邻输出装满预算后立即开始汇总...")
+    tree = ReduceTree(merge, budget=max_tokens, max_depth=len(plan) - 1)
+    mapped = 0
+
+    def on_map_result(index: int, result: Optional[str]):
+        nonlocal mapped
+        mapped += 1
+        tree.add(index, result)
+        report(80 * mapped / len(segments))
+
+    try:
+        part_docs = await process_chunk_parallel_async(segments, model=map_model, doc_type=doc_type, hedge=hedge,
+                                                       checkpoint=checkpoint, on_result=on_map_result,
+                                                       cancel_token=cancel_token, chunk_cache=chunk_cache)
+        logger.info(f"生成了 {len(part_docs)} 个部分文档")
+        tree.close(len(segments))
+        # 汇总任务不在令牌的任务树中，等待根结果本身也要能被令牌取消
+        final_docs = await cancel_token.track(asyncio.ensure_future(tree.result()))
+    finally:
+        tree.cancel()
+    if not final_docs:
+        raise ValueError("No valid documents left after reducing")
+    report(90)
+    logger.info(f"\n3. 汇总完成: {tree.merges} 次中间汇总，共 {tree.depth} 层")
+    cancel_token.raise_if_cancelled()
+
+    combined_docs = '\n'.join(final_docs)
+    current_tokens = num_tokens_from_string(combined_docs, encoding_name="cl100k_base")
+
     logger.info("\n4. 生成最终文档...")
     logger.info(f"最终文档token数: {current_tokens}")
     logger.info("流式返回最终结果...\n")
     
-    return ai_chat_stream_async(
-        message=PROMPT_MERGE_DOC.format(part_docs=combined_docs), 
-        model=model
-    )
+    return stream_final_doc(PROMPT_MERGE_DOC.format(part_docs=combined_docs), model, checkpoint)
 
 if __name__ == "__main__":
     
@@ -0,0 +1,229 @@
+from array import array
+from dataclasses import dataclass
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.token_counter import get_token_counter
+from .message_table import MessageTable, as_message_table
+
+# 转发前缀，例如 "【转发】"、"转发："、"Forwarded message"
+FORWARD_PREFIX_PATTERN = re.compile(r'^(?:【?转发】?[:：]?|\[?转发\]?[:：]?|forwarded(?: message)?[:：]?)\s*', re.IGNORECASE)
+# 归一化时去掉所有空白、标点和符号，只保留文字与数字
+NORMALIZE_PATTERN = re.compile(r'[\W_]+')
+
+# 每批计算签名的最大 shingle 数，控制 (num_perm, shingles) 矩阵的内存占用
+SHINGLE_BATCH_SIZE = 1 << 16
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+@dataclass
+class DedupConfig:
+    """
+    近似重复消息去重配置
+
+    Attributes:
+        threshold: 两条消息 shingle 集合的 Jaccard 相似度估计值不低于该值时视为重复
+        num_perm: MinHash 签名长度
+        bands: LSH 分段数，num_perm 必须能被整除；每段 num_perm // bands 行
+        shingle_size: 字符 shingle 的长度
+        min_chars: 归一化后少于该字符数的短消息不参与去重
+        seed: 哈希函数的随机种子，固定后结果可复现
+    """
+    threshold: float = 0.8
+    num_perm: int = 64
+    bands: int = 8
+    shingle_size: int = 3
+    min_chars: int = 20
+    seed: int = 1
+
+
+@dataclass
+class DedupReport:
+    """去重统计"""
+    total_messages: int = 0
+    candidate_messages: int = 0
+    removed_messages: int = 0
+    clusters: int = 0
+    removed_tokens: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"去重合并 {self.removed_messages}/{self.total_messages} 条消息为 {self.clusters} 组"
+            f"（参与比较 {self.candidate_messages} 条）, 移除 {self.removed_tokens} tokens"
+        )
+
+
+def normalize_content(content: str) -> str:
+    """去掉转发前缀、空白和标点，并统一为小写"""
+    content = FORWARD_PREFIX_PATTERN.sub('', content.strip())
+    return NORMALIZE_PATTERN.sub('', content).lower()
+
+
+def _hash_functions(config: DedupConfig) -> Tuple[np.ndarray, np.ndarray]:
+    """num_perm 组 multiply-shift 哈希的参数（a 为奇数）"""
+    rng = np.random.default_rng(config.seed)
+    a = rng.integers(1, 1 << 63, size=config.num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=config.num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def minhash_signatures(texts: List[str], config: DedupConfig) -> np.ndarray:
+    """
+    批量计算字符 shingle 集合的 MinHash 签名
+
+    所有文本拼接成一个码点数组，用多项式滚动哈希一次算出全部 shingle 的哈希，
+    再对每组哈希函数按文本分段取最小值（np.minimum.reduceat），不在 Python 层逐条循环。
+
+    Args:
+        texts: 归一化后的文本，每条长度不小于 shingle_size
+        config: 去重配置
+
+    Returns:
+        np.ndarray: 形状为 (len(texts), num_perm) 的 uint32 签名矩阵
+    """
+    n = config.shingle_size
+    signatures = np.empty((len(texts), config.num_perm), dtype=np.uint32)
+    a, b = _hash_functions(config)
+
+    start = 0
+    while start < len(texts):
+        # 按 shingle 总数而不是文本条数划分批次
+        stop = start
+        shingles = 0
+        while stop < len(texts) and (shingles == 0 or shingles + len(texts[stop]) <= SHINGLE_BATCH_SIZE):
+            shingles += len(texts[stop]) - n + 1
+            stop += 1
+
+        batch = texts[start:stop]
+        lengths = np.fromiter((len(text) for text in batch), dtype=np.int64, count=len(batch))
+        codepoints = np.frombuffer(''.join(batch).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+        # 每个位置开始的 n 字符 shingle 的滚动哈希（uint64 溢出即取模）
+        hashes = np.zeros(len(codepoints) - n + 1, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for offset in range(n):
+                hashes = hashes * _MIX + codepoints[offset:len(codepoints) - n + 1 + offset]
+
+        # 只保留不跨越文本边界的 shingle，各文本的 shingle 连续排列
+        counts = lengths - n + 1
+        text_offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        segment_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        positions = np.repeat(text_offsets - segment_starts, counts) + np.arange(counts.sum())
+        hashes = hashes[positions]
+
+        with np.errstate(over='ignore'):
+            permuted = ((a * hashes[None, :] + b) >> np.uint64(32)).astype(np.uint32)
+        signatures[start:stop] = np.minimum.reduceat(permuted, segment_starts, axis=1).T
+        start = stop
+
+    return signatures
+
+
+def find_duplicates(signatures: np.ndarray, config: DedupConfig) -> np.ndarray:
+    """
+    用 LSH 分段在线性时间内找出近似重复消息
+
+    按顺序处理每条消息：在各分段的桶中查找已有的代表消息，签名一致率不低于阈值则归入该代表；
+    否则把它登记为新的代表。每条消息最多与 bands 个代表比较。
+
+    Args:
+        signatures: (n, num_perm) 签名矩阵
+        config: 去重配置
+
+    Returns:
+        np.ndarray: 每条消息所属代表的下标（代表自身为自己的下标）
+    """
+    if config.num_perm % config.bands:
+        raise ValueError("num_perm must be divisible by bands")
+
+    rows = config.num_perm // config.bands
+    # 每个分段的 rows 个签名值压成一个 64 位键，向量化计算后转为 Python int 作为桶的键
+    weights = _MIX ** np.arange(rows, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        band_keys = (signatures.astype(np.uint64).reshape(len(signatures), config.bands, rows) * weights).sum(axis=2)
+    band_keys = band_keys.tolist()
+    buckets: List[Dict[int, int]] = [{} for _ in range(config.bands)]
+    representatives = np.arange(len(signatures))
+    min_agreement = config.threshold * config.num_perm
+
+    for i, keys in enumerate(band_keys):
+        match = -1
+        for band, key in enumerate(keys):
+            candidate = buckets[band].get(key)
+            if candidate is not None and np.count_nonzero(signatures[candidate] == signatures[i]) >= min_agreement:
+                match = candidate
+                break
+        if match >= 0:
+            representatives[i] = match
+            continue
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, i)
+
+    return representatives
+
+
+def dedup_messages(chat: "str | MessageTable",
+                   config: Optional[DedupConfig] = None) -> Tuple[MessageTable, DedupReport]:
+    """
+    把近似重复的消息（转发的公告、复制粘贴的通知、反复提问）合并为第一次出现的那条
+
+    保留的代表消息带有 occurrences 列，message() 会在末尾标注出现次数。
+    整体耗时与消息条数成线性关系。
+
+    Args:
+        chat: 聊天记录文本或已构建的 MessageTable
+        config: 去重配置，默认使用 DedupConfig()
+
+    Returns:
+        Tuple[MessageTable, DedupReport]: 去重后的索引和统计报告
+    """
+    config = config or DedupConfig()
+    table = as_message_table(chat)
+    report = DedupReport(total_messages=len(table))
+
+    candidates = []
+    texts = []
+    for i in range(len(table)):
+        text = normalize_content(table.content(i))
+        if len(text) >= max(config.min_chars, config.shingle_size):
+            candidates.append(i)
+            texts.append(text)
+    report.candidate_messages = len(candidates)
+    if not candidates:
+        return table, report
+
+    candidates = np.asarray(candidates, dtype=np.int64)
+    representatives = candidates[find_duplicates(minhash_signatures(texts, config), config)]
+    duplicates = representatives != candidates
+    report.removed_messages = int(np.count_nonzero(duplicates))
+    if not report.removed_messages:
+        return table, report
+
+    occurrences = np.ones(len(table), dtype=np.int32)
+    if table.occurrences is not None:
+        occurrences[:] = np.frombuffer(table.occurrences, dtype=np.int32)
+    np.add.at(occurrences, representatives[duplicates], occurrences[candidates[duplicates]])
+    report.clusters = len(np.unique(representatives[duplicates]))
+
+    keep = np.ones(len(table), dtype=np.bool_)
+    keep[candidates[duplicates]] = False
+
+    token_counts = None
+    if table.token_counts is not None:
+        # 被合并消息的 token 数计入报告；代表消息多了次数标注，需要重新计数
+        token_counts = np.frombuffer(table.token_counts, dtype=np.int32).copy()
+        report.removed_tokens = int(token_counts[~keep].sum())
+        annotated = np.unique(representatives[duplicates])
+        annotated_table = table.with_columns(occurrences=array('i', occurrences.tobytes()))
+        token_counts[annotated] = get_token_counter().count_batch(
+            [annotated_table.message(i) for i in annotated.tolist()]
+        )
+        token_counts = array('i', token_counts.tobytes())
+    else:
+        removed = np.flatnonzero(~keep).tolist()
+        report.removed_tokens = sum(get_token_counter().count_batch([table.message(i) for i in removed]))
+
+    deduped = table.with_columns(token_counts=token_counts, occurrences=array('i', occurrences.tobytes()))
+    return deduped.take(keep), report
@@ -0,0 +1,158 @@
+from array import array
+import codecs
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from typing import Optional
+
+from ..utils.token_counter import get_token_counter
+from .message_table import MessageTable
+from .reader import detect_encoding
+from .split import TOKEN_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'E2DIDX02'
+# magic, 编码名, 消息数, 发送者表长度, 源文件大小, 源文件 mtime_ns
+INDEX_HEADER = struct.Struct('<8s16sQQQQ')
+# 各列的 typecode 与宽度：起始偏移、结束偏移、时间戳、发送者 id、token 数
+INDEX_COLUMNS = (('q', 8), ('q', 8), ('q', 8), ('i', 4), ('i', 4))
+INDEX_ROW_SIZE = sum(width for _, width in INDEX_COLUMNS)
+
+
+def index_path_for(file_path: str) -> str:
+    """返回输入文件对应的索引文件路径"""
+    return file_path + INDEX_SUFFIX
+
+
+def write_message_index(file_path: str) -> Optional[str]:
+    """
+    为聊天记录文件生成二进制索引文件（sidecar）
+
+    索引与原文件放在同一目录，依次保存：文件头、消息起始/结束字节偏移（int64）、
+    时间戳（int64）、发送者 id（int32）、每条消息的 token 数（int32），以及 JSON 编码的发送者表。
+
+    Args:
+        file_path: 聊天记录文件路径
+
+    Returns:
+        Optional[str]: 索引文件路径，文件为空时返回 None
+    """
+    if sys.byteorder != 'little':
+        return None
+
+    stat = os.stat(file_path)
+    if not stat.st_size:
+        return None
+
+    with open(file_path, 'rb') as file:
+        encoding = detect_encoding(file)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            table = MessageTable.from_buffer(buffer, encoding)
+            token_counts = array('i')
+            counter = get_token_counter()
+            for start in range(0, len(table), TOKEN_BATCH_SIZE):
+                stop = min(start + TOKEN_BATCH_SIZE, len(table))
+                token_counts.extend(counter.count_batch(table.messages(start, stop)))
+            senders = json.dumps(table.senders, ensure_ascii=False).encode('utf-8')
+
+            index_path = index_path_for(file_path)
+            tmp_path = index_path + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                out.write(INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    encoding.encode('ascii'),
+                    len(table),
+                    len(senders),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ))
+                for column in (table.starts, table.ends, table.timestamps, table.sender_ids, token_counts):
+                    out.write(column.tobytes())
+                out.write(senders)
+            os.replace(tmp_path, index_path)
+
+    logger.info(f"Wrote message index for {len(table)} messages to {index_path}")
+    return index_path
+
+
+def load_message_index(file_path: str) -> Optional[MessageTable]:
+    """
+    通过 mmap 加载聊天记录文件的索引
+
+    索引各列直接映射为 memoryview，消息文本按偏移从映射的原文件中切片解码，
+    不会读取所需区间以外的字节。
+
+    Args:
+        file_path: 聊天记录文件路径
+
+    Returns:
+        Optional[MessageTable]: 索引不存在、格式不符或已过期时返回 None
+    """
+    index_path = index_path_for(file_path)
+    if sys.byteorder != 'little' or not os.path.exists(index_path):
+        return None
+
+    stat = os.stat(file_path)
+    # 空文件不会生成索引，也无法 mmap
+    if not stat.st_size:
+        return None
+
+    with open(index_path, 'rb') as index_file:
+        if os.fstat(index_file.fileno()).st_size < INDEX_HEADER.size:
+            return None
+        index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = None
+    columns = []
+    buffer = None
+    try:
+        magic, encoding, count, senders_size, source_size, source_mtime = INDEX_HEADER.unpack_from(index)
+        if magic != INDEX_MAGIC or source_size != stat.st_size or source_mtime != stat.st_mtime_ns:
+            index.close()
+            return None
+        # 截断或写坏的索引：各列与发送者表的总长度必须与文件大小一致
+        if INDEX_HEADER.size + count * INDEX_ROW_SIZE + senders_size != len(index):
+            raise ValueError(f"unexpected index size {len(index)} for {count} messages")
+
+        view = memoryview(index)
+        offset = INDEX_HEADER.size
+        for typecode, width in INDEX_COLUMNS:
+            columns.append(view[offset:offset + count * width].cast(typecode))
+            offset += count * width
+        senders = json.loads(bytes(view[offset:offset + senders_size]).decode('utf-8'))
+        if not isinstance(senders, list):
+            raise ValueError("sender table is not a list")
+        encoding = encoding.rstrip(b'\0').decode('ascii')
+        codecs.lookup(encoding)
+
+        with open(file_path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (struct.error, TypeError, ValueError, LookupError, OSError) as e:
+        # json.JSONDecodeError 与 UnicodeDecodeError 都是 ValueError 的子类
+        logger.warning(f"Ignoring corrupt message index {index_path}: {str(e)}")
+        # mmap 上还有导出的 memoryview 时无法关闭，先释放各列
+        for column in columns:
+            column.release()
+        if view is not None:
+            view.release()
+        index.close()
+        if buffer is not None:
+            buffer.close()
+        return None
+
+    starts, ends, timestamps, sender_ids, token_counts = columns
+    return MessageTable(
+        buffer,
+        starts,
+        ends,
+        timestamps,
+        sender_ids,
+        senders,
+        encoding=encoding,
+        token_counts=token_counts,
+    )
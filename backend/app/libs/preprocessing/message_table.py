@@ -0,0 +1,349 @@
+from array import array
+from calendar import timegm
+import codecs
+import hashlib
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .timeline import TIMESTAMP_WIDTH, as_datetime64, timestamps_from_buffer
+
+# 消息头：行首的 'YYYY-MM-DD HH:MM:SS ' 定宽时间戳，例如 2023-05-11 19:33:39
+HEADER_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} ')
+BYTES_HEADER_PATTERN = re.compile(HEADER_PATTERN.pattern.encode('ascii'))
+HEADER_WIDTH = 20
+SENDER_PATTERN = re.compile(r'([^-\n]+?)(?:[ ]*-[ ]*|\s+)')
+# 文件开头的 BOM：utf-8 原始字节，以及按 utf-8 解码后留下的 U+FEFF
+BOM = '\ufeff'
+BYTES_BOM = codecs.BOM_UTF8
+
+# 解析发送者时最多查看的内容长度
+SENDER_SCAN_WIDTH = 256
+# 合并近似重复消息后，在代表消息末尾标注的出现次数
+OCCURRENCE_SUFFIX = ' （共出现 {count} 次）'
+
+
+def parse_timestamp(timestamp_str: str, day_cache: Optional[Dict[str, int]] = None) -> int:
+    """
+    将 'YYYY-MM-DD HH:MM:SS' 前缀换算为 epoch 秒
+
+    Args:
+        timestamp_str: 以时间戳开头的字符串
+        day_cache: 可选的日期缓存，同一天的消息共用日期部分的换算结果
+
+    Returns:
+        int: epoch 秒（按 UTC 换算，不做时区转换）；越界的月、日、时分秒顺延，例如 2023-02-30 按 2023-03-02 换算
+    """
+    day = timestamp_str[:10]
+    day_seconds = day_cache.get(day) if day_cache is not None else None
+    if day_seconds is None:
+        year, month = divmod(int(day[:4]) * 12 + int(day[5:7]) - 1, 12)
+        day_seconds = timegm((year, month + 1, 1, 0, 0, 0)) + (int(day[8:10]) - 1) * 86400
+        if day_cache is not None:
+            day_cache[day] = day_seconds
+    return day_seconds + int(timestamp_str[11:13]) * 3600 + int(timestamp_str[14:16]) * 60 + int(timestamp_str[17:19])
+
+
+def normalize_newlines(text: str) -> str:
+    """把 '\\r\\n' 和单独的 '\\r' 换成 '\\n'，与 read_file 以文本模式读取时的通用换行一致"""
+    if '\r' not in text:
+        return text
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def iter_message_spans(buffer, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+    """
+    逐行扫描聊天记录，产出每条消息的 [start, end) 区间
+
+    只在行首用定宽匹配识别时间戳消息头；消息一直延续到下一个消息头所在行之前的换行符，
+    最后一条消息延续到 stop。消息正文中以日期开头的行（如 "2023-05-11 开会"）
+    不会被误判为新消息。第一条消息头之前的内容会被忽略；从 buffer 开头扫描时跳过 BOM，
+    第一行仍按消息头识别。
+
+    Args:
+        buffer: 已解码的 str，或原始字节（bytes / mmap）
+        start: 扫描起点，必须位于行首
+        stop: 扫描终点，默认到 buffer 末尾
+
+    Yields:
+        Tuple[int, int]: 消息在 buffer 中的起止偏移
+    """
+    if stop is None:
+        stop = len(buffer)
+    if isinstance(buffer, str):
+        match_header, newline, carriage_return, bom = HEADER_PATTERN.match, '\n', '\r', BOM
+    else:
+        match_header, newline, carriage_return, bom = BYTES_HEADER_PATTERN.match, b'\n', b'\r', BYTES_BOM
+    find = buffer.find
+
+    message_start = -1
+    line_start = start
+    if start == 0 and buffer[:len(bom)] == bom:
+        line_start = len(bom)
+    while line_start < stop:
+        if match_header(buffer, line_start, stop):
+            if message_start >= 0:
+                # 消息不包含换行符；'\r\n' 换行时也不包含行尾的 '\r'
+                end = line_start - 1
+                yield message_start, end - 1 if buffer[end - 1:end] == carriage_return else end
+            message_start = line_start
+        line_end = find(newline, line_start, stop)
+        if line_end < 0:
+            break
+        line_start = line_end + 1
+
+    if message_start >= 0:
+        # 扫描范围在 '\r\n' 处截止时（并行扫描的分片）同样去掉 '\r'
+        if buffer[stop:stop + 1] == newline and buffer[stop - 1:stop] == carriage_return:
+            stop -= 1
+        yield message_start, stop
+
+
+class MessageTable:
+    """
+    聊天记录的列式消息索引
+
+    对原始文本只扫描一次，记录每条消息在原文中的起止偏移、时间戳（int64 epoch 秒，不做时区转换）
+    和发送者 id，之后的分割、统计都基于这张表完成，不再重复解析原文。
+
+    buffer 可以是已解码的 str，也可以是原始字节（bytes / mmap）。后者的偏移为字节偏移，
+    取消息时只解码对应的字节区间。
+
+    可选列：token_counts 为每条消息的 token 数；occurrences 为去重后每条代表消息的出现次数，
+    大于 1 时 message() 会在消息末尾标注次数。
+
+    selected 表示这是按下标选出的子集（take() 的结果，例如预过滤之后）。子集为空时仍是聊天记录，
+    不能像扫描不出消息的原文那样退回按行处理 buffer。
+    """
+
+    def __init__(self,
+                 buffer,
+                 starts,
+                 ends,
+                 timestamps,
+                 sender_ids,
+                 senders: List[str],
+                 encoding: Optional[str] = None,
+                 token_counts=None,
+                 occurrences=None,
+                 selected: bool = False):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+        self.timestamps = timestamps
+        self.sender_ids = sender_ids
+        self.senders = senders
+        self.encoding = encoding
+        self.token_counts = token_counts
+        self.occurrences = occurrences
+        self.selected = selected
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_text(cls, text: str) -> "MessageTable":
+        """
+        单次扫描聊天记录文本构建消息索引
+
+        Args:
+            text: 完整的聊天记录文本
+
+        Returns:
+            MessageTable: 消息索引
+        """
+        return cls._scan(text, None)
+
+    @classmethod
+    def from_buffer(cls, buffer, encoding: str, start: int = 0, stop: Optional[int] = None) -> "MessageTable":
+        """
+        单次扫描未解码的聊天记录字节构建消息索引，偏移为字节偏移
+
+        时间戳与换行符都是 ASCII 字符，utf-8 与 gbk 的多字节字符不会误匹配，
+        因此可以直接在原始字节上扫描。'\\r\\n' 换行的行首同样以 '\\n' 定位，
+        取消息时再统一换行符，得到的消息与 read_file 读入后 from_text 的结果相同。
+
+        Args:
+            buffer: 原始字节（bytes 或 mmap）
+            encoding: 原始字节的编码
+            start: 只扫描 [start, stop) 范围，偏移仍相对于整个 buffer
+            stop: 扫描范围的结束位置，默认到 buffer 末尾
+
+        Returns:
+            MessageTable: 消息索引
+        """
+        return cls._scan(buffer, encoding, start, stop)
+
+    @classmethod
+    def _scan(cls, buffer, encoding: Optional[str], start: int = 0, stop: Optional[int] = None) -> "MessageTable":
+        starts = array('q')
+        ends = array('q')
+        sender_ids = array('i')
+        senders: List[str] = []
+        sender_index = {}
+
+        for message_start, message_end in iter_message_spans(buffer, start, stop):
+            content_start = message_start + HEADER_WIDTH
+            content_head = buffer[content_start:min(message_end, content_start + SENDER_SCAN_WIDTH)]
+            if encoding is not None:
+                content_head = content_head.decode(encoding, errors='ignore')
+
+            sender_match = SENDER_PATTERN.match(content_head)
+            sender = sender_match.group(1).strip() if sender_match else ''
+            sender_id = sender_index.get(sender)
+            if sender_id is None:
+                sender_id = len(senders)
+                sender_index[sender] = sender_id
+                senders.append(sender)
+
+            starts.append(message_start)
+            ends.append(message_end)
+            sender_ids.append(sender_id)
+
+        # 时间戳在扫描结束后按定宽前缀整体向量化解析
+        timestamps = timestamps_from_buffer(buffer, starts, encoding)
+
+        return cls(buffer, starts, ends, timestamps, sender_ids, senders, encoding)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def plain_text(self) -> bool:
+        """是否为非聊天记录格式的文本：扫描原文没有找到任何消息（过滤后为空的子集不算）"""
+        return not len(self) and not self.selected
+
+    @property
+    def text(self) -> str:
+        """完整的原始文本（字节缓冲区会整体解码，只在确实需要全文时使用）"""
+        if self.encoding is None:
+            return self.buffer
+        return normalize_newlines(str(self.buffer[:], self.encoding))
+
+    @property
+    def size(self) -> int:
+        """原始缓冲区的长度（字符数或字节数）"""
+        return len(self.buffer)
+
+    def digest(self) -> str:
+        """原始缓冲区与所选消息区间的 sha256，用于识别相同内容的生成任务（结果会缓存）"""
+        if self._digest is None:
+            h = hashlib.sha256()
+            h.update(self.buffer.encode('utf-8') if self.encoding is None else self.buffer)
+            h.update(self.starts.tobytes())
+            h.update(self.ends.tobytes())
+            if self.occurrences is not None:
+                h.update(np.asarray(self.occurrences).tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def timestamp_array(self) -> np.ndarray:
+        """以 datetime64[s] 数组的形式返回时间戳列（零拷贝）"""
+        return as_datetime64(self.timestamps)
+
+    def _slice(self, start: int, end: int) -> str:
+        if self.encoding is None:
+            return self.buffer[start:end]
+        return normalize_newlines(str(memoryview(self.buffer)[start:end], self.encoding))
+
+    def message(self, index: int) -> str:
+        """返回第 index 条消息的完整文本（时间戳 + 内容）"""
+        text = self._slice(self.starts[index], self.ends[index])
+        if self.occurrences is not None and self.occurrences[index] > 1:
+            text += OCCURRENCE_SUFFIX.format(count=self.occurrences[index])
+        return text
+
+    def timestamp_str(self, index: int) -> str:
+        """返回第 index 条消息的原始时间戳字符串"""
+        start = self.starts[index]
+        return self._slice(start, start + TIMESTAMP_WIDTH)
+
+    def sender(self, index: int) -> str:
+        """返回第 index 条消息的发送者"""
+        return self.senders[self.sender_ids[index]]
+
+    def content(self, index: int) -> str:
+        """返回第 index 条消息去掉时间戳和发送者之后的正文"""
+        start = self.starts[index] + HEADER_WIDTH
+        text = self._slice(start, self.ends[index])
+        sender_match = SENDER_PATTERN.match(text, 0, SENDER_SCAN_WIDTH)
+        if sender_match and sender_match.group(1).strip() == self.sender(index):
+            return text[sender_match.end():]
+        return text
+
+    def take(self, indices) -> "MessageTable":
+        """
+        按下标选出部分消息，返回共享同一缓冲区的新索引
+
+        Args:
+            indices: 升序的消息下标（序列、布尔掩码或 ndarray）
+
+        Returns:
+            MessageTable: 只包含选中消息的索引，各列为新的 array
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == np.bool_:
+            indices = np.flatnonzero(indices)
+        elif indices.dtype.kind != 'i':
+            # 空列表默认是 float 类型
+            indices = indices.astype(np.int64)
+
+        def take_column(column, typecode: str) -> array:
+            values = np.frombuffer(column, dtype=np.dtype(typecode))
+            return array(typecode, values[indices].tobytes())
+
+        token_counts = self.token_counts
+        if token_counts is not None:
+            token_counts = take_column(token_counts, 'i')
+        occurrences = self.occurrences
+        if occurrences is not None:
+            occurrences = take_column(occurrences, 'i')
+
+        return MessageTable(
+            self.buffer,
+            take_column(self.starts, 'q'),
+            take_column(self.ends, 'q'),
+            np.frombuffer(self.timestamps, dtype=np.int64)[indices],
+            take_column(self.sender_ids, 'i'),
+            self.senders,
+            encoding=self.encoding,
+            token_counts=token_counts,
+            occurrences=occurrences,
+            selected=True,
+        )
+
+    def with_columns(self, token_counts=None, occurrences=None) -> "MessageTable":
+        """返回替换了 token_counts / occurrences 列的新索引（为 None 的列保持不变）"""
+        return MessageTable(
+            self.buffer,
+            self.starts,
+            self.ends,
+            self.timestamps,
+            self.sender_ids,
+            self.senders,
+            encoding=self.encoding,
+            token_counts=self.token_counts if token_counts is None else token_counts,
+            occurrences=self.occurrences if occurrences is None else occurrences,
+            selected=self.selected,
+        )
+
+    def messages(self, start: int = 0, stop: Optional[int] = None) -> Iterable[str]:
+        """按顺序迭代 [start, stop) 范围内的消息文本"""
+        if stop is None:
+            stop = len(self)
+        for i in range(start, stop):
+            yield self.message(i)
+
+    def join(self, start: int = 0, stop: Optional[int] = None) -> str:
+        """将 [start, stop) 范围内的消息用换行符拼接为一个片段"""
+        return '\n'.join(self.messages(start, stop))
+
+    def join_indices(self, indices: Iterable[int]) -> str:
+        """将指定下标的消息用换行符拼接为一个片段"""
+        return '\n'.join(self.message(i) for i in indices)
+
+
+def as_message_table(chat: "str | MessageTable") -> MessageTable:
+    """接受原始文本或已构建的索引，统一返回 MessageTable"""
+    if isinstance(chat, MessageTable):
+        return chat
+    return MessageTable.from_text(chat)
@@ -0,0 +1,153 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.token_counter import get_token_counter
+from .message_table import BYTES_HEADER_PATTERN, MessageTable
+from .reader import detect_encoding, read_file
+from .split import TOKEN_BATCH_SIZE, split_by_tokens
+
+# 分片边界：行首的完整时间戳（边界取在换行符之后）
+SHARD_BOUNDARY_PATTERN = re.compile(b'\n' + BYTES_HEADER_PATTERN.pattern)
+# 小于该大小的文件不值得开进程池
+MIN_SHARD_SIZE = 4 << 20
+
+
+def shard_ranges(buffer, shards: int) -> List[Tuple[int, int]]:
+    """
+    把字节缓冲区按消息边界切成大约等长的若干区间
+
+    每个区间都在某条消息的时间戳处开始，并在下一个区间开头的换行符之前结束，
+    因此对每个区间单独扫描得到的消息与整体扫描完全一致。
+
+    Args:
+        buffer: 原始字节（bytes 或 mmap）
+        shards: 期望的分片数
+
+    Returns:
+        List[Tuple[int, int]]: 每个分片的 [start, stop) 字节区间
+    """
+    size = len(buffer)
+    cuts = [0]
+    for i in range(1, shards):
+        target = max(size * i // shards, cuts[-1])
+        match = SHARD_BOUNDARY_PATTERN.search(buffer, target)
+        if not match:
+            break
+        if match.start() + 1 > cuts[-1]:
+            cuts.append(match.start() + 1)
+    cuts.append(size + 1)
+    return [(start, stop - 1) for start, stop in zip(cuts, cuts[1:])]
+
+
+def _scan_shard(file_path: str, encoding: str, start: int, stop: int):
+    """在子进程中解析一个分片并计算每条消息的 token 数（偏移为整个文件的字节偏移）"""
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            table = MessageTable.from_buffer(buffer, encoding, start, stop)
+            token_counts = array('i')
+            counter = get_token_counter()
+            for batch_start in range(0, len(table), TOKEN_BATCH_SIZE):
+                batch_stop = min(batch_start + TOKEN_BATCH_SIZE, len(table))
+                token_counts.extend(counter.count_batch(table.messages(batch_start, batch_stop)))
+            return (
+                table.starts,
+                table.ends,
+                np.asarray(table.timestamps, dtype=np.int64),
+                table.sender_ids,
+                table.senders,
+                token_counts,
+            )
+
+
+def build_message_table_parallel(file_path: str, workers: Optional[int] = None) -> MessageTable:
+    """
+    多进程构建带 token 数的消息索引
+
+    文件按消息边界切成与进程数相同的分片，每个进程独立完成解析与 token 计数，
+    最后按分片顺序拼接各列，并把各分片的发送者 id 映射到全局发送者表。
+
+    Args:
+        file_path: 聊天记录文件路径
+        workers: 进程数，默认为 CPU 核数
+
+    Returns:
+        MessageTable: 以 mmap 的原文件为缓冲区、带 token_counts 列的消息索引
+    """
+    workers = workers or os.cpu_count() or 1
+    if not os.path.getsize(file_path):
+        return MessageTable.from_text('')
+
+    with open(file_path, 'rb') as file:
+        encoding = detect_encoding(file)
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    shards = max(1, min(workers, len(buffer) // MIN_SHARD_SIZE))
+    ranges = shard_ranges(buffer, shards)
+
+    if len(ranges) == 1:
+        results = [_scan_shard(file_path, encoding, *ranges[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            futures = [executor.submit(_scan_shard, file_path, encoding, start, stop) for start, stop in ranges]
+            results = [future.result() for future in futures]
+
+    senders: List[str] = []
+    sender_index = {}
+    starts = array('q')
+    ends = array('q')
+    sender_ids = array('i')
+    token_counts = array('i')
+    timestamps = []
+    for shard_starts, shard_ends, shard_timestamps, shard_sender_ids, shard_senders, shard_tokens in results:
+        remap = []
+        for sender in shard_senders:
+            if sender not in sender_index:
+                sender_index[sender] = len(senders)
+                senders.append(sender)
+            remap.append(sender_index[sender])
+        starts.extend(shard_starts)
+        ends.extend(shard_ends)
+        sender_ids.extend(remap[sender_id] for sender_id in shard_sender_ids)
+        token_counts.extend(shard_tokens)
+        timestamps.append(shard_timestamps)
+
+    return MessageTable(
+        buffer,
+        starts,
+        ends,
+        np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64),
+        sender_ids,
+        senders,
+        encoding=encoding,
+        token_counts=token_counts,
+    )
+
+
+def split_by_tokens_parallel(file_path: str, max_tokens: int = 8000, workers: Optional[int] = None) -> List[str]:
+    """
+    split_by_tokens 的多进程版本，结果与单进程版本完全一致
+
+    解析和 token 计数在各分片进程中完成；按 token 装箱是对整数列的一次顺序扫描，
+    在拼接后的完整索引上进行，因此跨越分片边界的片段不需要额外处理。
+
+    Args:
+        file_path: 聊天记录文件路径
+        max_tokens: 每个片段最大token数
+        workers: 进程数，默认为 CPU 核数
+
+    Returns:
+        List[str]: 分割后的文本片段列表
+    """
+    table = build_message_table_parallel(file_path, workers)
+    if not len(table):
+        if not table.size:
+            return []
+        # 非聊天记录格式，退回按行分割
+        return split_by_tokens(read_file(file_path), max_tokens)
+    return split_by_tokens(table, max_tokens)
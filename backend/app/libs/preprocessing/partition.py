@@ -0,0 +1,237 @@
+import hashlib
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..utils.token_counter import get_token_counter
+from .message_table import MessageTable, as_message_table
+from .split import _with_token_counts
+from .timeline import period_keys
+
+# 片段内用于拼接消息的换行符计入的token数
+SEPARATOR_TOKENS = 1
+# 锚点哈希的取值范围（32 位）
+_ANCHOR_HASH_RANGE = 1 << 32
+
+# 句子边界：中文句末标点、换行之后，或英文句末标点后跟空白处
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[。！？；…\n])|(?<=[.!?;])(?=\s)')
+
+
+def split_oversized(text: str, max_tokens: int) -> List[str]:
+    """
+    把超过 max_tokens 的单条消息按句子边界切成若干不超过 max_tokens 的部分
+
+    句子按顺序贪心合并；单个句子仍然超限时，按能容纳的最长前缀硬切。
+
+    Args:
+        text: 消息文本
+        max_tokens: 每部分最大token数
+
+    Returns:
+        List[str]: 切分后的部分，按顺序拼接即为原文
+    """
+    counter = get_token_counter()
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY_PATTERN.split(text) if sentence]
+
+    pieces = []
+    for sentence, tokens in zip(sentences, counter.count_batch(sentences)):
+        if tokens <= max_tokens:
+            pieces.append(sentence)
+            continue
+        while sentence:
+            # 二分查找 token 数不超过 max_tokens 的最长前缀（至少 1 个字符）
+            lo, hi = 1, len(sentence)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if counter.count(sentence[:mid]) <= max_tokens:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            pieces.append(sentence[:lo])
+            sentence = sentence[lo:]
+
+    parts = []
+    current = ''
+    current_tokens = 0
+    for piece, tokens in zip(pieces, counter.count_batch(pieces)):
+        if current and current_tokens + tokens > max_tokens:
+            parts.append(current)
+            current = ''
+            current_tokens = 0
+        current += piece
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _greedy_chunk_count(prefix: np.ndarray, capacity: int) -> Tuple[int, List[int]]:
+    """容量为 capacity 时，从头贪心装箱所需的片段数及各片段的结束下标"""
+    stops = []
+    start = 0
+    total = len(prefix) - 1
+    while start < total:
+        stop = int(np.searchsorted(prefix, prefix[start] + capacity, side='right')) - 1
+        # 单个元素超过容量时也要前进，单独成段
+        stop = max(stop, start + 1)
+        stops.append(stop)
+        start = stop
+    return len(stops), stops
+
+
+def balanced_partition(weights: Sequence[int], chunks: int) -> List[Tuple[int, int]]:
+    """
+    把带权序列切成至多 chunks 个连续片段，使最大片段的权重和最小
+
+    对片段容量做二分查找：给定容量时从头贪心装箱所需的片段数随容量单调不增，
+    因此满足片段数不超过 chunks 的最小容量就是最优的最大片段权重。
+    每次检查只在前缀和上做 searchsorted，复杂度 O(chunks * log n * log(sum))。
+
+    Args:
+        weights: 每个元素的非负整数权重（如 token 数）
+        chunks: 片段数上限
+
+    Returns:
+        List[Tuple[int, int]]: 每个片段的 [start, stop) 下标区间
+    """
+    if not len(weights):
+        return []
+    weights = np.asarray(weights, dtype=np.int64)
+    prefix = np.concatenate(([0], np.cumsum(weights)))
+    chunks = max(1, min(chunks, len(weights)))
+
+    lo = int(weights.max())
+    hi = max(lo, int(prefix[-1]))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _greedy_chunk_count(prefix, mid)[0] <= chunks:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    _, stops = _greedy_chunk_count(prefix, lo)
+    return list(zip([0] + stops[:-1], stops))
+
+
+def balanced_split_by_tokens(chat_text: "str | MessageTable",
+                             max_tokens: int = 8000,
+                             concurrency: Optional[int] = None) -> List[str]:
+    """
+    按 token 数把聊天记录切成权重接近的连续片段，用于并行的 map 阶段
+
+    与 split_by_tokens 相比：
+    - 片段数取满足 max_tokens 所需的最少片段数，再在片段之间均分 token，不会出现很小的尾片段
+    - 指定 concurrency 时，片段数向上取整到并发数的整数倍：批次数不变，但每批都占满并发，
+      单个片段更小，最慢片段决定的总耗时更短
+    - 超过 max_tokens 的单条消息在句子边界处切开，不会整条塞给模型
+    - 片段内拼接消息的换行符也计入 max_tokens
+
+    Args:
+        chat_text: 原始文本（聊天记录格式或普通文本）或已构建的 MessageTable
+        max_tokens: 每个片段最大token数
+        concurrency: map 阶段的并发数
+
+    Returns:
+        List[str]: 分割后的文本片段列表
+    """
+    table = as_message_table(chat_text)
+    if len(table):
+        items, token_counts = table.messages(), table.token_counts
+    elif not table.plain_text:
+        # 过滤后没有剩下任何消息，不能退回原文
+        return []
+    else:
+        # 非聊天记录格式，按行切分
+        items, token_counts = table.text.split('\n'), None
+
+    texts = []
+    weights = []
+    for item, item_tokens in _with_token_counts(items, token_counts):
+        if item_tokens + SEPARATOR_TOKENS <= max_tokens:
+            texts.append(item)
+            weights.append(item_tokens + SEPARATOR_TOKENS)
+            continue
+        parts = split_oversized(item, max_tokens - SEPARATOR_TOKENS)
+        texts.extend(parts)
+        weights.extend(tokens + SEPARATOR_TOKENS for tokens in get_token_counter().count_batch(parts))
+
+    if not texts:
+        return []
+
+    chunks = _greedy_chunk_count(np.concatenate(([0], np.cumsum(weights))), max_tokens)[0]
+    if concurrency and chunks > concurrency:
+        chunks = -(-chunks // concurrency) * concurrency
+
+    return ['\n'.join(texts[start:stop]) for start, stop in balanced_partition(weights, chunks)]
+
+
+def _anchor_hash(key: int) -> int:
+    """周期起点的稳定哈希（与进程、运行次数无关）"""
+    return int.from_bytes(hashlib.blake2b(str(key).encode('ascii'), digest_size=4).digest(), 'big')
+
+
+def anchored_split_by_tokens(chat_text: "str | MessageTable",
+                             max_tokens: int = 8000,
+                             target_tokens: Optional[int] = None,
+                             period: str = 'day') -> List[str]:
+    """
+    只在稳定的时间锚点（默认为天边界）处切分聊天记录，用于可以增量复用 map 结果的场景
+
+    balanced_split_by_tokens 的切分点取决于全文的 token 总数，新导出只多了几天消息，
+    所有片段边界也都会移动。这里改用内容定义的切分：
+    - 同一周期（天）的消息是不可分的块；块超过 max_tokens 时单独在块内均分
+    - 每个块之后是否切分只由该块自己决定：以周期起点的哈希为随机数，
+      切分概率为 块 token 数 / target_tokens，片段的期望大小约为 target_tokens
+    - 加入下一块会超过 max_tokens 时强制切分；强制切分造成的偏移在下一个自然锚点处恢复
+
+    因此在开头或末尾增删若干天，只有相邻的一两个片段改变，其余片段的内容逐字不变，
+    可以直接命中 map 结果缓存。代价是片段数不再按并发数取整；单天的 token 数接近 max_tokens 时，
+    天粒度的切分比 balanced_split_by_tokens 产生更多片段。
+
+    Args:
+        chat_text: 聊天记录文本或已构建的 MessageTable；非聊天记录格式时退回 balanced_split_by_tokens
+        max_tokens: 每个片段最大token数
+        target_tokens: 片段的期望token数，默认为 max_tokens，使片段数尽量接近按 max_tokens 均分的片段数
+        period: 锚点周期，'day'、'week' 或 'month'
+
+    Returns:
+        List[str]: 分割后的文本片段列表
+    """
+    table = as_message_table(chat_text)
+    if table.plain_text:
+        return balanced_split_by_tokens(table, max_tokens=max_tokens)
+    if not len(table):
+        return []
+    target_tokens = max(1, target_tokens or max_tokens)
+
+    token_counts = table.token_counts
+    if token_counts is None:
+        token_counts = get_token_counter().count_batch(table.messages())
+    # table.join 在消息之间插入换行符，每条消息按 token 数 + 1 计权，与 balanced_split_by_tokens 一致
+    prefix = np.concatenate(([0], np.cumsum(np.asarray(token_counts, dtype=np.int64) + SEPARATOR_TOKENS)))
+
+    keys = period_keys(table.timestamp_array(), period).astype(np.int64)
+    edges = [0] + (np.flatnonzero(np.diff(keys)) + 1).tolist() + [len(table)]
+
+    chunks = []
+    start = stop = 0
+    for block_start, block_stop in zip(edges[:-1], edges[1:]):
+        block_tokens = int(prefix[block_stop] - prefix[block_start])
+        if block_tokens > max_tokens:
+            if stop > start:
+                chunks.append(table.join(start, stop))
+            chunks.extend(balanced_split_by_tokens(table.take(np.arange(block_start, block_stop)),
+                                                   max_tokens=max_tokens))
+            start = stop = block_stop
+            continue
+        if stop > start and prefix[block_stop] - prefix[start] > max_tokens:
+            chunks.append(table.join(start, stop))
+            start = stop
+        stop = block_stop
+        if _anchor_hash(int(keys[block_start])) < _ANCHOR_HASH_RANGE * block_tokens / target_tokens:
+            chunks.append(table.join(start, stop))
+            start = stop
+    if stop > start:
+        chunks.append(table.join(start, stop))
+    return chunks
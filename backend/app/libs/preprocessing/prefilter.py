@@ -0,0 +1,180 @@
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.token_counter import get_token_counter
+from .message_table import MessageTable, as_message_table
+from .split import TOKEN_BATCH_SIZE
+
+
+@dataclass
+class PrefilterRule:
+    """
+    一条过滤规则：正文（去掉首尾空白后）完整匹配 pattern，或发送者完整匹配 sender_pattern 时丢弃该消息
+    """
+    name: str
+    pattern: Optional[str] = None
+    sender_pattern: Optional[str] = None
+
+    def __post_init__(self):
+        self._pattern = re.compile(self.pattern, re.DOTALL) if self.pattern else None
+        self._sender_pattern = re.compile(self.sender_pattern) if self.sender_pattern else None
+
+    def matches(self, content: str, sender: str) -> bool:
+        if self._pattern is not None and self._pattern.fullmatch(content):
+            return True
+        return self._sender_pattern is not None and bool(self._sender_pattern.fullmatch(sender))
+
+
+# 图片、表情、语音等只剩占位符的消息
+PLACEHOLDER_RULE = PrefilterRule(
+    'placeholder',
+    r'(?:\[[^\[\]\n]{1,12}\]\s*)+',
+)
+# "+1"、"收到"、"好的"之类的简单应答
+ACKNOWLEDGEMENT_RULE = PrefilterRule(
+    'acknowledgement',
+    r'(?:\+1|1|收到|收到了|好|好的|好滴|嗯|嗯嗯|哦|哦哦|ok|OK|Ok|okay|谢谢|多谢|感谢|谢啦|赞|顶|对|是的|明白|了解)'
+    r'[\s!！。.~～]*',
+)
+# 进群、退群、撤回、拍一拍等系统通知
+SYSTEM_NOTICE_RULE = PrefilterRule(
+    'system_notice',
+    r'.{0,64}(?:加入了群聊|退出了群聊|移出了群聊|撤回了一条消息|修改群名为|拍了拍).{0,64}',
+)
+# 机器人账号发出的消息
+BOT_RULE = PrefilterRule(
+    'bot',
+    sender_pattern=r'.*(?:机器人|[Bb]ot|BOT)',
+)
+
+
+def default_rules() -> List[PrefilterRule]:
+    return [PLACEHOLDER_RULE, ACKNOWLEDGEMENT_RULE, SYSTEM_NOTICE_RULE, BOT_RULE]
+
+
+@dataclass
+class PrefilterConfig:
+    """
+    预过滤配置
+
+    Attributes:
+        rules: 依次检查的规则，命中第一条即丢弃
+        min_chars: 正文去掉空白后少于该字符数的消息视为无信息
+        min_entropy: 短消息的字符熵（bit/字符）低于该值时丢弃，用于过滤"哈哈哈哈"、"6666"之类的刷屏
+        entropy_max_chars: 只对不超过该长度的消息做熵检查
+    """
+    rules: List[PrefilterRule] = field(default_factory=default_rules)
+    min_chars: int = 2
+    min_entropy: float = 1.0
+    entropy_max_chars: int = 32
+
+
+@dataclass
+class PrefilterReport:
+    """预过滤统计：按规则记录丢弃的消息数和 token 数"""
+    total_messages: int = 0
+    removed_messages: int = 0
+    total_tokens: int = 0
+    removed_tokens: int = 0
+    removed_by_rule: Dict[str, int] = field(default_factory=dict)
+    removed_tokens_by_rule: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def removed_token_ratio(self) -> float:
+        return self.removed_tokens / self.total_tokens if self.total_tokens else 0.0
+
+    def summary(self) -> str:
+        rules = ', '.join(
+            f"{name}: {count} 条/{self.removed_tokens_by_rule.get(name, 0)} tokens"
+            for name, count in sorted(self.removed_by_rule.items(), key=lambda item: -item[1])
+        )
+        return (
+            f"预过滤移除 {self.removed_messages}/{self.total_messages} 条消息, "
+            f"{self.removed_tokens}/{self.total_tokens} tokens ({self.removed_token_ratio:.1%})"
+            + (f" [{rules}]" if rules else "")
+        )
+
+
+def char_entropy(text: str) -> float:
+    """按字符频率计算的香农熵（bit/字符）"""
+    if not text:
+        return 0.0
+    total = len(text)
+    return -sum(count / total * math.log2(count / total) for count in Counter(text).values())
+
+
+def classify_message(content: str, sender: str, config: PrefilterConfig) -> Optional[str]:
+    """
+    判断一条消息是否为低信息量消息
+
+    Args:
+        content: 去掉时间戳和发送者之后的正文
+        sender: 发送者
+        config: 预过滤配置
+
+    Returns:
+        Optional[str]: 命中的规则名；保留该消息时返回 None
+    """
+    content = content.strip()
+    for rule in config.rules:
+        if rule.matches(content, sender):
+            return rule.name
+
+    compact = ''.join(content.split())
+    if len(compact) < config.min_chars:
+        return 'too_short'
+    if len(compact) <= config.entropy_max_chars and char_entropy(compact) < config.min_entropy:
+        return 'low_entropy'
+    return None
+
+
+def prefilter_messages(chat: "str | MessageTable",
+                       config: Optional[PrefilterConfig] = None) -> Tuple[MessageTable, PrefilterReport]:
+    """
+    在发送给模型之前丢弃低信息量消息（占位符、简单应答、系统通知、机器人消息、刷屏）
+
+    返回的索引与原索引共享缓冲区，并带上每条消息的 token 数，
+    后续 split_by_tokens 可以直接复用，不会重复计数。
+
+    Args:
+        chat: 聊天记录文本或已构建的 MessageTable
+        config: 预过滤配置，默认使用 PrefilterConfig()
+
+    Returns:
+        Tuple[MessageTable, PrefilterReport]: 过滤后的索引和统计报告
+    """
+    config = config or PrefilterConfig()
+    table = as_message_table(chat)
+
+    token_counts = table.token_counts
+    if token_counts is None:
+        token_counts = array('i')
+        counter = get_token_counter()
+        for start in range(0, len(table), TOKEN_BATCH_SIZE):
+            stop = min(start + TOKEN_BATCH_SIZE, len(table))
+            token_counts.extend(counter.count_batch(table.messages(start, stop)))
+        table = table.with_columns(token_counts=token_counts)
+
+    report = PrefilterReport(total_messages=len(table))
+    keep = np.ones(len(table), dtype=np.bool_)
+    for i in range(len(table)):
+        tokens = token_counts[i]
+        report.total_tokens += tokens
+        rule = classify_message(table.content(i), table.sender(i), config)
+        if rule is None:
+            continue
+        keep[i] = False
+        report.removed_messages += 1
+        report.removed_tokens += tokens
+        report.removed_by_rule[rule] = report.removed_by_rule.get(rule, 0) + 1
+        report.removed_tokens_by_rule[rule] = report.removed_tokens_by_rule.get(rule, 0) + tokens
+
+    if not report.removed_messages:
+        return table, report
+    return table.take(keep), report
@@ -1,7 +1,15 @@
-from typing import TypedDict, List
+from typing import BinaryIO, TypedDict, List, Iterator
 from datetime import datetime
+import codecs
+import mmap
 import re
 import os 
+from .message_table import MessageTable, as_message_table, iter_message_spans, normalize_newlines
+
+# 流式读取时每次读入的字节数
+DEFAULT_BLOCK_SIZE = 1 << 20
+# 判断编码时读取的文件开头字节数
+SNIFF_SIZE = 1 << 16
 
 class Message(TypedDict):
     timestamp: str
@@ -46,6 +54,169 @@ def read_file(filename: str) -> str:
     except Exception as e:
         raise IOError(f"Error reading file {filename}: {str(e)}")
 
+def sniff_encoding(sample: bytes) -> str:
+    """
+    根据文件开头的字节判断编码，只支持 utf-8 与 gbk
+
+    Args:
+        sample: 文件开头的一段字节
+
+    Returns:
+        str: 编码名称
+    """
+    try:
+        # 非 final 模式下，末尾被截断的多字节字符不会报错
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        codecs.getincrementaldecoder('gbk')().decode(sample, final=False)
+        return 'gbk'
+    except UnicodeDecodeError:
+        raise IOError("Unable to detect encoding, expected utf-8 or gbk")
+
+def _decodes(file: BinaryIO, encoding: str, block_size: int) -> bool:
+    """按块增量解码整个文件，返回是否全部解码成功"""
+    file.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        block = file.read(block_size)
+        while block:
+            decoder.decode(block, final=False)
+            block = file.read(block_size)
+        decoder.decode(b'', final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def detect_encoding(file: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> str:
+    """
+    判断整个文件的编码，只支持 utf-8 与 gbk
+
+    先根据开头 SNIFF_SIZE 字节判断；判断为 utf-8 时再按块校验整个文件，
+    开头全是 ASCII、后面才出现 gbk 字符的文件校验失败后改用 gbk，与 read_file 的回退一致。
+    内存占用只与块大小有关。
+
+    Args:
+        file: 以二进制模式打开的文件，返回前会回到文件开头
+        block_size: 每次读取的字节数
+
+    Returns:
+        str: 编码名称
+
+    Raises:
+        IOError: 当文件既不是 utf-8 也不是 gbk 时
+    """
+    file.seek(0)
+    encoding = sniff_encoding(file.read(SNIFF_SIZE))
+    if encoding == 'utf-8' and not _decodes(file, encoding, block_size):
+        if not _decodes(file, 'gbk', block_size):
+            raise IOError("Unable to detect encoding, expected utf-8 or gbk")
+        encoding = 'gbk'
+    file.seek(0)
+    return encoding
+
+def _decode_messages(file: BinaryIO, encoding: str, block_size: int) -> Iterator[str]:
+    """从文件开头按块增量解码并逐条产出完整消息（换行符与 read_file 一致），解码失败时抛出 UnicodeDecodeError"""
+    file.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ''
+    block = file.read(block_size)
+
+    while block:
+        buffer += decoder.decode(block, final=False)
+        # 只产出后面已经出现下一条消息头的完整消息，最后一条留到下一轮
+        spans = list(iter_message_spans(buffer))
+        for start, end in spans[:-1]:
+            yield normalize_newlines(buffer[start:end])
+        # 没有消息头时只保留最后一行（可能是被截断的消息头）
+        keep_from = spans[-1][0] if spans else buffer.rfind('\n') + 1
+        buffer = buffer[keep_from:]
+        block = file.read(block_size)
+
+    buffer += decoder.decode(b'', final=True)
+    for start, end in iter_message_spans(buffer):
+        yield normalize_newlines(buffer[start:end])
+
+def iter_messages(filename: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[str]:
+    """
+    流式读取聊天记录文件，逐条产出完整消息
+
+    按固定大小的字节块读取，根据文件开头判断编码并增量解码，
+    内存占用只与块大小和最长的单条消息有关，与文件大小无关。
+    产出的消息与对整个文件执行 MessageTable.from_text 得到的消息一致。
+
+    开头全是 ASCII 的 gbk 文件会被判断为 utf-8，直到中途解码失败；
+    此时已产出的消息只含 ASCII，在 gbk 下完全相同，因此改用 gbk 从头解码并跳过这些消息。
+
+    Args:
+        filename: 要读取的文件的完整路径
+        block_size: 每次读取的字节数
+
+    Yields:
+        str: 单条消息文本（时间戳 + 内容）
+
+    Raises:
+        FileNotFoundError: 当文件不存在时
+        IOError: 当文件编码无法识别或解码失败时
+    """
+    if not filename:
+        raise ValueError("Filename cannot be empty")
+        
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"File not found: {filename}")
+
+    with open(filename, 'rb') as file:
+        encoding = sniff_encoding(file.read(SNIFF_SIZE))
+        yielded = 0
+        ascii_only = True
+        while True:
+            try:
+                for index, message in enumerate(_decode_messages(file, encoding, block_size)):
+                    if index < yielded:
+                        continue
+                    ascii_only = ascii_only and message.isascii()
+                    yielded += 1
+                    yield message
+                return
+            except UnicodeDecodeError:
+                if encoding != 'utf-8' or not ascii_only:
+                    raise IOError(f"Unable to decode file with {encoding} encoding: {filename}")
+                encoding = 'gbk'
+
+def map_message_table(filename: str) -> MessageTable:
+    """
+    不读入整个文件，直接在 mmap 的原始字节上构建消息索引
+
+    编码由 detect_encoding 按块校验整个文件得到；消息内容在取用时才解码，
+    内存中只有索引列，文件内容由操作系统按需分页读入。
+
+    Args:
+        filename: 要读取的文件的完整路径
+
+    Returns:
+        MessageTable: 以 mmap 的原文件为缓冲区的消息索引
+
+    Raises:
+        FileNotFoundError: 当文件不存在时
+        ValueError: 当文件为空时
+        IOError: 当文件编码无法识别时
+    """
+    if not filename:
+        raise ValueError("Filename cannot be empty")
+
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"File not found: {filename}")
+
+    if not os.path.getsize(filename):
+        raise ValueError(f"File is empty: {filename}")
+
+    with open(filename, 'rb') as file:
+        encoding = detect_encoding(file)
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return MessageTable.from_buffer(buffer, encoding)
+
 def read_chat_records(filename, max_lines=300):
     """
     读取聊天记录文件的前N行并返回格式化的字符串
@@ -114,22 +285,20 @@ def parse_single_message(message_text: str) -> Message:
         metadata={}
     )
 
-def parse_messages(chat_text: str) -> List[Message]:
+def parse_messages(chat_text: "str | MessageTable") -> List[Message]:
     """
     将聊天记录文本解析为标准格式的消息列表
     
     Args:
-        chat_text: 完整的聊天记录文本
+        chat_text: 完整的聊天记录文本或已构建的 MessageTable
         
     Returns:
         List[Message]: 标准格式的消息列表
     """
-    # 使用更灵活的模式来分割消息
-    pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} .+?)(?=\n\d{4}-\d{2}-\d{2}|\Z)'
-    messages = re.findall(pattern, chat_text, re.DOTALL)
+    table = as_message_table(chat_text)
     
     parsed_messages = []
-    for msg in messages:
+    for msg in table.messages():
         if msg.strip():
             try:
                 parsed_messages.append(parse_single_message(msg))
@@ -1,15 +1,20 @@
-from datetime import datetime, timedelta
 import re
 import os
-from typing import List
-from ..utils.ai_chat_client import num_tokens_from_string
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Sequence
+from ..utils.token_counter import get_token_counter
+from .message_table import MessageTable, as_message_table, parse_timestamp
+from .timeline import period_groups, session_boundaries
+
+# 批量计算 token 数时每批的消息数
+TOKEN_BATCH_SIZE = 1024
 
 def split_chat_records(chat_text, max_messages=500, min_messages=300, time_gap_minutes=100):
     """
     分割聊天记录
     
     参数:
-    chat_text: 原始聊天记录文本
+    chat_text: 原始聊天记录文本、已构建的 MessageTable，或逐条产出消息的迭代器（如 iter_messages）
     max_messages: 每个片段最大消息数
     min_messages: 每个片段最小消息数（除最后一个片段外）
     time_gap_minutes: 判定为新会话的时间间隔（分钟）
@@ -17,28 +22,39 @@ def split_chat_records(chat_text, max_messages=500, min_messages=300, time_gap_m
     返回:
     list of str: 分割后的聊天记录片段列表
     """
-    # 解析消息
-    # 时间格式：2023-05-11 19:33:39
-    pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (.*?)(?=\n\d{4}-\d{2}-\d{2}|\Z)'
-    messages = re.findall(pattern, chat_text, re.DOTALL)
+    return list(iter_split_chat_records(chat_text, max_messages, min_messages, time_gap_minutes))
+
+
+def iter_split_chat_records(chat_text, max_messages=500, min_messages=300, time_gap_minutes=100) -> Iterator[str]:
+    """
+    split_chat_records 的生成器版本，逐个产出片段
+
+    传入消息迭代器时，内存占用只与单个片段的大小有关。
+    """
+    if isinstance(chat_text, (str, MessageTable)):
+        # 已有时间戳列时，切分点用向量化计算
+        table = as_message_table(chat_text)
+        boundaries = session_boundaries(table.timestamp_array(), max_messages, min_messages, time_gap_minutes)
+        for start, stop in boundaries:
+            yield table.join(start, stop)
+        return
     
-    if not messages:
-        return []
+    day_cache = {}
+    records = ((parse_timestamp(message, day_cache), message) for message in chat_text)
     
-    # 存储分割后的片段
-    segments = []
+    time_gap_seconds = time_gap_minutes * 60
     current_segment = []
-    last_time = datetime.strptime(messages[0][0], '%Y-%m-%d %H:%M:%S')
+    last_time = None
     
-    for i, (timestamp, content) in enumerate(messages):
-        current_time = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        time_diff = (current_time - last_time).total_seconds() / 60
+    for current_time, message in records:
+        if last_time is None:
+            last_time = current_time
         
         # 判断是否需要分割
         should_split = False
         
         # 检查时间间隔和最小消息数要求
-        if time_diff > time_gap_minutes and len(current_segment) >= min_messages:
+        if current_time - last_time > time_gap_seconds and len(current_segment) >= min_messages:
             should_split = True
             
         # 检查消息数量
@@ -46,17 +62,15 @@ def split_chat_records(chat_text, max_messages=500, min_messages=300, time_gap_m
             should_split = True
             
         if should_split and current_segment:
-            segments.append('\n'.join(f"{t} {c}" for t, c in current_segment))
+            yield '\n'.join(current_segment)
             current_segment = []
             
-        current_segment.append((timestamp, content))
+        current_segment.append(message)
         last_time = current_time
     
     # 添加最后一个片段
     if current_segment:
-        segments.append('\n'.join(f"{t} {c}" for t, c in current_segment))
-    
-    return segments
+        yield '\n'.join(current_segment)
 
 
 def segment_test():
@@ -97,51 +111,34 @@ def split_tasks(task_text: str) -> list[str]:
     
     return parsed_tasks
 
-def split_by_time_period(chat_text: str, period: str = 'day') -> list[str]:
+def split_by_time_period(chat_text: "str | MessageTable", period: str = 'day') -> list[str]:
     """
     按时间周期分割聊天记录
     
     参数:
-    chat_text: 原始聊天记录文本
+    chat_text: 原始聊天记录文本或已构建的 MessageTable
     period: 分割周期，可选值：'day', 'week', 'month'
     
     返回:
     list of str: 按时间周期分割后的聊天记录片段列表
     """
-    # 解析消息
-    pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (.*?)(?=\n\d{4}-\d{2}-\d{2}|\Z)'
-    messages = re.findall(pattern, chat_text, re.DOTALL)
+    table = as_message_table(chat_text)
     
-    if not messages:
+    if not len(table):
         return []
     
-    # 按时间周期分组
-    segments_dict = {}
-    for timestamp, content in messages:
-        dt = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        
-        # 获取时间周期的key
-        if period == 'day':
-            period_key = dt.replace(hour=0, minute=0, second=0)
-        elif period == 'week':
-            # 获取本周一
-            period_key = dt - timedelta(days=dt.weekday())
-            period_key = period_key.replace(hour=0, minute=0, second=0)
-        elif period == 'month':
-            period_key = dt.replace(day=1, hour=0, minute=0, second=0)
-        else:
-            raise ValueError("period must be one of: 'day', 'week', 'month'")
-            
-        # 添加到对应分组
-        if period_key not in segments_dict:
-            segments_dict[period_key] = []
-        segments_dict[period_key].append((timestamp, content))
+    # 按时间周期分组（向量化取整到周期起点）
+    groups = period_groups(table.timestamp_array(), period)
     
     # 转换为文本片段
     segments = []
-    for period_key in sorted(segments_dict.keys()):
-        segment = '\n'.join(f"{t} {c}" for t, c in segments_dict[period_key])
-        segments.append(segment)
+    for indices in groups:
+        start, stop = int(indices[0]), int(indices[-1]) + 1
+        if stop - start == len(indices):
+            # 时间有序时每组是连续区间
+            segments.append(table.join(start, stop))
+        else:
+            segments.append(table.join_indices(indices.tolist()))
     
     return segments
 
@@ -156,14 +153,13 @@ def limit_text_length(text: str, max_tokens: int = 10000) -> List[str]:
     Returns:
         List[str]: 分割后的文本列表
     """
-    # 粗略估计：平均每个token约4个字符
-    CHARS_PER_TOKEN = 4
-    max_chars = max_tokens * CHARS_PER_TOKEN
+    # 快速估算：中文等 CJK 字符与其他字符分别计费，不做实际编码
+    counter = get_token_counter()
     
     if not text:
         return []
         
-    if len(text) <= max_chars:
+    if counter.estimate(text) <= max_tokens:
         return [text]
         
     # 按消息分割
@@ -175,16 +171,16 @@ def limit_text_length(text: str, max_tokens: int = 10000) -> List[str]:
     current_length = 0
     
     for message in messages:
-        message_length = len(message) + 1  # +1 for newline
+        message_length = counter.estimate(message) + 1  # +1 for newline
         
         # 如果当前消息加入后超过限制，保存当前块并开始新块
-        if current_length + message_length > max_chars and current_chunk:
+        if current_length + message_length > max_tokens and current_chunk:
             chunks.append('\n'.join(current_chunk))
             current_chunk = []
             current_length = 0
             
         # 处理单条消息超过限制的情况
-        if message_length > max_chars:
+        if message_length > max_tokens:
             # 如果当前块非空，先保存
             if current_chunk:
                 chunks.append('\n'.join(current_chunk))
@@ -204,94 +200,91 @@ def limit_text_length(text: str, max_tokens: int = 10000) -> List[str]:
     
     return chunks
 
-def split_by_tokens(chat_text: str, max_tokens: int = 8000) -> List[str]:
+def split_by_tokens(chat_text, max_tokens: int = 8000) -> List[str]:
     """
     按照token数量分割文本
     
     Args:
-        chat_text: 原始文本（可以是聊天记录格式或普通文本）
+        chat_text: 原始文本（可以是聊天记录格式或普通文本）、已构建的 MessageTable，
+                   或逐条产出消息的迭代器（如 iter_messages）
         max_tokens: 每个片段最大token数
     
     Returns:
         List[str]: 分割后的文本片段列表
     """
+    return list(iter_split_by_tokens(chat_text, max_tokens))
+
+
+def iter_split_by_tokens(chat_text, max_tokens: int = 8000) -> Iterator[str]:
+    """
+    split_by_tokens 的生成器版本，逐个产出片段
+
+    传入消息迭代器时，内存占用只与单个片段的大小有关。
+    """
+    if not isinstance(chat_text, (str, MessageTable)):
+        yield from _pack_by_tokens(chat_text, max_tokens, separator_tokens=0)
+        return
+    
     # 尝试解析聊天消息
-    # 时间格式：2023-05-11 19:33:39
-    pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (.*?)(?=\n\d{4}-\d{2}-\d{2}|\Z)'
-    messages = re.findall(pattern, chat_text, re.DOTALL)
+    table = as_message_table(chat_text)
     
     # 如果成功解析为聊天记录格式
-    if messages:
-        # 存储分割后的片段
-        segments = []
-        current_segment = []
-        current_tokens = 0
-        
-        for i, (timestamp, content) in enumerate(messages):
-            # 构造完整消息
-            message = f"{timestamp} {content}"
-            message_tokens = num_tokens_from_string(message)
-            
-            # 如果单条消息就超过最大token限制
-            if message_tokens > max_tokens:
-                # 如果当前段落非空，先保存当前段落
-                if current_segment:
-                    segments.append('\n'.join(current_segment))
-                    current_segment = []
-                    current_tokens = 0
-                # 将大消息单独作为一个段落
-                segments.append(message)
-                continue
-                
-            # 如果当前消息加入后会超过token限制，保存当前段落并开始新段落
-            if current_tokens + message_tokens > max_tokens:
-                segments.append('\n'.join(current_segment))
-                current_segment = []
-                current_tokens = 0
-                
-            # 将消息添加到当前段落
-            current_segment.append(message)
-            current_tokens += message_tokens
-        
-        # 处理最后一个段落
-        if current_segment:
-            segments.append('\n'.join(current_segment))
-        
-        return segments
+    if len(table):
+        # 从索引文件加载的表自带每条消息的 token 数，无需重新编码
+        yield from _pack_by_tokens(table.messages(), max_tokens, separator_tokens=0, token_counts=table.token_counts)
+    # 如果不是聊天记录格式，按照换行符分割（换行符按 1 个token计）；过滤后为空的子集不产出片段
+    elif table.plain_text:
+        yield from _pack_by_tokens(table.text.split('\n'), max_tokens, separator_tokens=1)
+
+
+def _with_token_counts(items: Iterable[str],
+                       token_counts: Optional[Sequence[int]] = None,
+                       batch_size: int = TOKEN_BATCH_SIZE) -> Iterator[tuple[str, int]]:
+    """为每条文本配上 token 数；没有预先计算的计数时按批调用 TokenCounter"""
+    if token_counts is not None:
+        yield from zip(items, token_counts)
+        return
+    
+    counter = get_token_counter()
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield from zip(batch, counter.count_batch(batch))
+
+
+def _pack_by_tokens(items: Iterable[str],
+                    max_tokens: int,
+                    separator_tokens: int,
+                    token_counts: Optional[Sequence[int]] = None) -> Iterator[str]:
+    """按顺序把消息（或行）贪心地装入不超过 max_tokens 的片段"""
+    current_segment = []
+    current_tokens = 0
     
-    # 如果不是聊天记录格式，按照换行符分割
-    else:
-        lines = chat_text.split('\n')
-        segments = []
-        current_segment = []
-        current_tokens = 0
+    for item, item_tokens in _with_token_counts(items, token_counts):
         
-        for line in lines:
-            line_tokens = num_tokens_from_string(line)
-            
-            # 如果单行就超过最大token限制
-            if line_tokens > max_tokens:
-                # 如果当前段落非空，先保存当前段落
-                if current_segment:
-                    segments.append('\n'.join(current_segment))
-                    current_segment = []
-                    current_tokens = 0
-                # 将大行单独作为一个段落
-                segments.append(line)
-                continue
-                
-            # 如果加入当前行后会超过token限制，保存当前段落并开始新段落
-            if current_tokens + line_tokens + 1 > max_tokens:  # +1 为换行符
-                segments.append('\n'.join(current_segment))
+        # 如果单条就超过最大token限制
+        if item_tokens > max_tokens:
+            # 如果当前段落非空，先保存当前段落
+            if current_segment:
+                yield '\n'.join(current_segment)
                 current_segment = []
                 current_tokens = 0
-                
-            # 将行添加到当前段落
-            current_segment.append(line)
-            current_tokens += line_tokens + 1  # +1 为换行符
-        
-        # 处理最后一个段落
-        if current_segment:
-            segments.append('\n'.join(current_segment))
-        
-        return segments
\ No newline at end of file
+            # 将大消息单独作为一个段落
+            yield item
+            continue
+            
+        # 如果加入后会超过token限制，保存当前段落并开始新段落
+        if current_tokens + item_tokens + separator_tokens > max_tokens:
+            yield '\n'.join(current_segment)
+            current_segment = []
+            current_tokens = 0
+            
+        # 添加到当前段落
+        current_segment.append(item)
+        current_tokens += item_tokens + separator_tokens
+    
+    # 处理最后一个段落
+    if current_segment:
+        yield '\n'.join(current_segment)
@@ -0,0 +1,159 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+TIMESTAMP_WIDTH = 19
+# 'YYYY-MM-DD HH:MM:SS' 中各字段在定宽前缀里的位置
+_DIGIT_COLUMNS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_DIGIT_WEIGHTS = np.array([1000, 100, 10, 1, 10, 1, 10, 1, 10, 1, 10, 1, 10, 1], dtype=np.int64)
+# 年、月、日、时、分、秒在 _DIGIT_COLUMNS 中对应的区间
+_FIELD_SLICES = [slice(0, 4), slice(4, 6), slice(6, 8), slice(8, 10), slice(10, 12), slice(12, 14)]
+_VALID_PERIODS = ('day', 'week', 'month')
+
+
+def parse_timestamp_prefixes(prefixes: np.ndarray) -> np.ndarray:
+    """
+    将定宽的 'YYYY-MM-DD HH:MM:SS' 字节前缀批量解析为 datetime64[s] 数组
+
+    与 parse_timestamp（calendar.timegm）一致，越界的字段顺延而不报错，
+    例如 2023-02-30 按 2023-03-02 处理：消息头只按格式识别，一条日期写错的消息不能让整个文件无法处理。
+
+    Args:
+        prefixes: 形状为 (n, 19) 的 uint8 数组，每行是一条消息的时间戳字节
+
+    Returns:
+        np.ndarray: datetime64[s] 数组
+
+    Raises:
+        ValueError: 前缀中有非数字字符时（消息头模式保证不会出现）
+    """
+    if not len(prefixes):
+        return np.empty(0, dtype='datetime64[s]')
+
+    digits = prefixes[:, _DIGIT_COLUMNS].astype(np.int64) - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        raise ValueError("timestamp prefix contains non-digit characters")
+
+    weighted = digits * _DIGIT_WEIGHTS
+    year, month, day, hour, minute, second = (weighted[:, field].sum(axis=1) for field in _FIELD_SLICES)
+
+    months = (year - 1970) * 12 + (month - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    return days.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second).astype('timedelta64[s]')
+
+
+def timestamps_from_buffer(buffer, starts: Sequence[int], encoding=None) -> np.ndarray:
+    """
+    从原始缓冲区中按消息起始偏移取出时间戳前缀并批量解析
+
+    Args:
+        buffer: 已解码的 str，或原始字节（bytes / mmap）
+        starts: 每条消息的起始偏移
+        encoding: buffer 为字节时的编码；为 None 表示 buffer 是 str
+
+    Returns:
+        np.ndarray: epoch 秒（int64）
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    if not len(starts):
+        return np.empty(0, dtype=np.int64)
+
+    if encoding is None:
+        prefixes = ''.join(buffer[start:start + TIMESTAMP_WIDTH] for start in starts.tolist())
+        raw = np.frombuffer(prefixes.encode('ascii'), dtype=np.uint8).reshape(-1, TIMESTAMP_WIDTH)
+    else:
+        source = np.frombuffer(buffer, dtype=np.uint8)
+        raw = source[starts[:, None] + np.arange(TIMESTAMP_WIDTH)]
+
+    return parse_timestamp_prefixes(raw).astype(np.int64)
+
+
+def as_datetime64(timestamps) -> np.ndarray:
+    """把 epoch 秒列（array / memoryview / ndarray）零拷贝地视为 datetime64[s]"""
+    return np.frombuffer(timestamps, dtype=np.int64).view('datetime64[s]')
+
+
+def session_breaks(timestamps: np.ndarray, time_gap_minutes: float) -> np.ndarray:
+    """
+    找出与上一条消息间隔超过 time_gap_minutes 的消息下标
+
+    Args:
+        timestamps: datetime64[s] 数组
+        time_gap_minutes: 判定为新会话的时间间隔（分钟）
+
+    Returns:
+        np.ndarray: 升序的消息下标（不含 0）
+    """
+    gaps = np.diff(timestamps.astype(np.int64))
+    return np.flatnonzero(gaps > time_gap_minutes * 60) + 1
+
+
+def session_boundaries(timestamps: np.ndarray,
+                       max_messages: int,
+                       min_messages: int,
+                       time_gap_minutes: float) -> List[Tuple[int, int]]:
+    """
+    计算按会话间隔与消息数限制切分后的片段区间
+
+    规则与逐条扫描的版本一致：片段至少满 min_messages 条时，遇到会话间隔就切分；
+    片段满 max_messages 条时强制切分。只在候选切分点之间跳转，复杂度与片段数相关。
+
+    Returns:
+        List[Tuple[int, int]]: 每个片段的 [start, stop) 消息下标区间
+    """
+    total = len(timestamps)
+    breaks = session_breaks(timestamps, time_gap_minutes)
+    min_size = max(min_messages, 1)
+    max_size = max(max_messages, 1)
+
+    boundaries = []
+    start = 0
+    while start < total:
+        k = np.searchsorted(breaks, start + min_size, side='left')
+        gap_stop = int(breaks[k]) if k < len(breaks) else total
+        stop = min(gap_stop, start + max_size, total)
+        boundaries.append((start, stop))
+        start = stop
+    return boundaries
+
+
+def period_keys(timestamps: np.ndarray, period: str) -> np.ndarray:
+    """
+    将时间戳向下取整到所在周期的起点（天、周一或月初）
+
+    Args:
+        timestamps: datetime64[s] 数组
+        period: 'day', 'week' 或 'month'
+
+    Returns:
+        np.ndarray: 周期起点的 datetime64[D] 数组
+    """
+    if period not in _VALID_PERIODS:
+        raise ValueError("period must be one of: 'day', 'week', 'month'")
+
+    days = timestamps.astype('datetime64[D]')
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 为周四，向前取整到周一
+        day_numbers = days.astype(np.int64)
+        return (day_numbers - (day_numbers + 3) % 7).astype('datetime64[D]')
+    return timestamps.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def period_groups(timestamps: np.ndarray, period: str) -> List[np.ndarray]:
+    """
+    按周期分组，返回每组的消息下标；组按周期先后排列，组内保持原始顺序
+
+    Args:
+        timestamps: datetime64[s] 数组
+        period: 'day', 'week' 或 'month'
+
+    Returns:
+        List[np.ndarray]: 每个周期的消息下标数组
+    """
+    keys = period_keys(timestamps, period).astype(np.int64)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    edges = np.flatnonzero(np.diff(sorted_keys)) + 1
+    return np.split(order, edges)
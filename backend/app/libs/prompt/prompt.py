@@ -1,3 +1,6 @@
+# 提示词版本号：提示词或结果后处理方式改变时递增，使已缓存的模型回复失效
+PROMPT_VERSION = "1"
+
 PROMPT_GEN_OVERVIEW = """
 你是一位语言精炼优雅的作家
 帮我给以下聊天记录生成一个overview：
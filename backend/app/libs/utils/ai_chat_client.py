@@ -1,54 +1,47 @@
 import os
+import time
 import httpx
-import tiktoken
 import asyncio
-from aiolimiter import AsyncLimiter
-from openai import OpenAI, AsyncOpenAI
+import logging
+from typing import Callable, Optional
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
 from dotenv import load_dotenv
 import json
+from .token_counter import get_token_counter
+from .client_pool import get_client_pool
+from .completion_cache import cache_key, get_completion_cache, replay_stream
+from .rate_limiter import get_rate_limiter, parse_retry_after
+from .model_registry import get_model_registry
+from .circuit_breaker import CircuitOpenError, get_circuit_breaker
+from .singleflight import get_single_flight
+from .cassette import get_cassette
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 # 常量配置
 DEFAULT_TEMPERATURE = 0.05
 DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant."
-semaphore = asyncio.Semaphore(10)
+# 单个模型一次请求的超时（秒）
+REQUEST_TIMEOUT = 200.0
+# 收到 429 后按 Retry-After 等待并重试的次数
+RATE_LIMIT_RETRIES = 3
+# 连接错误（含 SDK 超时）与 5xx 在同一模型上退避重试的次数；SDK 内置重试已关闭，统一在这里处理
+TRANSIENT_RETRIES = 2
+TRANSIENT_BACKOFF = 0.5
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+# 这些错误说明服务商暂时不可用，路由调用会换下一个候选模型重试
+FAILOVER_ERRORS = (RateLimitError, APIConnectionError, InternalServerError, TimeoutError, CircuitOpenError)
 
 
 def _get_client(model: str, is_async: bool = False) -> OpenAI | AsyncOpenAI:
-    """Return appropriate OpenAI client based on model and type."""
-    client_class = AsyncOpenAI if is_async else OpenAI
-    
-    # 处理 OpenRouter 模型 (包含 '/' 的模型名称)
-    if '/' in model:
-        api_key = os.environ.get("OPENROUTER_API_KEY")
-        base_url = os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
-        if not api_key:
-            raise ValueError(
-                "Missing required environment variable: OPENROUTER_API_KEY"
-            )
-        return client_class(api_key=api_key, base_url=base_url)
-    
-    # 处理 Deepseek 模型
-    if model == 'deepseek-v3-0324' or model == 'deepseek-r1' or model == 'deepseek-v3':
-        api_key = os.environ.get("DEEPSEEK_API_KEY")
-        base_url = os.environ.get("DEEPSEEK_API_BASE")
-        if not api_key or not base_url:
-            raise ValueError(
-                "Missing required environment variables for Deepseek: "
-                "DEEPSEEK_API_KEY and DEEPSEEK_API_BASE must be set"
-            )
-        return client_class(api_key=api_key, base_url=base_url)
-    
-    # 处理默认 OpenAI 模型
-    api_key = os.environ.get("OPENAI_API_KEY")
-    base_url = os.environ.get("OPENAI_API_BASE")
-    if not api_key:
-        raise ValueError("Missing required environment variable: OPENAI_API_KEY")
-    
-    return client_class(
-        api_key=api_key,
-        base_url=base_url or "https://api.openai.com/v1"
-    )
+    """Return the pooled OpenAI client for the model's provider."""
+    pool = get_client_pool()
+    return pool.get_async(model) if is_async else pool.get(model)
+
+def _estimate_prompt_tokens(messages: list) -> int:
+    """Cheap pre-dispatch token estimate used by the TPM bucket."""
+    text = '\n'.join(m["content"] for m in messages if isinstance(m.get("content"), str))
+    return get_token_counter().estimate(text)
 
 def _prepare_messages(message, system_message: str = DEFAULT_SYSTEM_MESSAGE):
     """Prepare messages for chat completion."""
@@ -113,7 +106,10 @@ def ai_chat(message: str | list,
 async def ai_chat_async(message: str | list, 
             model: str = "gpt-4o-mini", 
             response_format: str = 'NOT_GIVEN', 
-            tools: list = None) -> str:
+            tools: list = None,
+            use_cache: bool = True,
+            coalesce: bool = True,
+            timeout: float = REQUEST_TIMEOUT) -> str:
     """
     Asynchronous chat completion using OpenAI API.
     
@@ -122,12 +118,52 @@ async def ai_chat_async(message: str | list,
         model: Model to use for completion
         response_format: Optional response format (e.g., 'json')
         tools: Optional list of function definitions for function calling
+        use_cache: Serve identical requests from the completion cache
+        coalesce: Let concurrent identical requests share one upstream call
+        timeout: Seconds to wait for the upstream response
     
     Returns:
         str: AI response content
     """
-    client = _get_client(model, is_async=True)
     messages = message if isinstance(message, list) else _prepare_messages(message)
+
+    cache = get_completion_cache()
+    use_cache = use_cache and cache.config.enabled
+    key = cache_key(model, messages, DEFAULT_TEMPERATURE, response_format, tools)
+    if use_cache:
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry["content"]
+
+    if coalesce:
+        # 相同的请求正在进行时直接等待它的结果，不重复请求上游
+        return await get_single_flight().do(
+            key, lambda: _complete_async(messages, model, response_format, tools, key, use_cache, timeout)
+        )
+    return await _complete_async(messages, model, response_format, tools, key, use_cache, timeout)
+
+def _prompt_key(messages: list, response_format: str, tools: list) -> str:
+    """与模型无关的请求哈希，回放时路由选了另一个模型也能找到录制的回复"""
+    return cache_key("", messages, DEFAULT_TEMPERATURE, response_format, tools)
+
+async def _complete_async(messages: list,
+                          model: str,
+                          response_format: str,
+                          tools: list,
+                          key: str,
+                          store: bool,
+                          timeout: float = REQUEST_TIMEOUT) -> str:
+    """Send one completion request through the rate limiter and circuit breaker; cache the result under key if store."""
+    cassette = get_cassette()
+    prompt_key = None
+    if cassette.config.mode != "off":
+        prompt_key = _prompt_key(messages, response_format, tools)
+        recorded = cassette.lookup(key, prompt_key)
+        if recorded is not None:
+            # 回放不经过限流和熔断，也不计入模型延迟统计
+            return await cassette.replay(recorded)
+
+    client = _get_client(model, is_async=True)
     
     kwargs = {
         "messages": messages,
@@ -142,17 +178,53 @@ async def ai_chat_async(message: str | list,
         kwargs["tools"] = tools
         kwargs["tool_choice"] = "auto"
     
+    limiter = get_rate_limiter(model)
+    registry = get_model_registry()
+    breaker = get_circuit_breaker(model)
+    estimated_tokens = _estimate_prompt_tokens(messages)
+    # 熔断打开时直接失败（路由调用会换下一个候选模型），不占用限流名额，也不用等到超时
+    breaker.before_call()
+    call_start = time.monotonic()
     try:
-        async with semaphore:
-            chat_completion = await asyncio.wait_for(
-                client.chat.completions.create(**kwargs),
-                timeout=200
-            )
-    except asyncio.TimeoutError:
-        raise TimeoutError("API request timed out after 200 seconds")
-    except Exception as e:
-        raise e
-
+        rate_limited = transient = 0
+        while True:
+            try:
+                async with limiter.slot(estimated_tokens):
+                    start = time.monotonic()
+                    chat_completion = await asyncio.wait_for(
+                        client.chat.completions.create(**kwargs),
+                        timeout=timeout
+                    )
+                break
+            except RateLimitError as e:
+                # 暂停该服务商/模型的后续请求，下一次 slot() 会等到 Retry-After 之后
+                limiter.on_rate_limited(parse_retry_after(e.response.headers))
+                rate_limited += 1
+                if rate_limited > RATE_LIMIT_RETRIES:
+                    raise
+            except TRANSIENT_ERRORS as e:
+                transient += 1
+                if transient > TRANSIENT_RETRIES:
+                    raise
+                logger.warning(f"Transient error from {model}, retry {transient}/{TRANSIENT_RETRIES}: {str(e)}")
+                await asyncio.sleep(TRANSIENT_BACKOFF * 2 ** (transient - 1))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"API request timed out after {timeout:g} seconds")
+    except RateLimitError:
+        # 429 说明服务仍在响应，交给限流器处理，不计入熔断
+        registry.record_failure(model)
+        breaker.on_abandoned()
+        raise
+    except FAILOVER_ERRORS:
+        registry.record_failure(model)
+        breaker.on_failure()
+        raise
+    except BaseException:
+        breaker.on_abandoned(time.monotonic() - call_start)
+        raise
+    latency = time.monotonic() - start
+    registry.record_success(model, latency)
+    breaker.on_success()
 
     response_message = chat_completion.choices[0].message
     
@@ -163,20 +235,25 @@ async def ai_chat_async(message: str | list,
         function_args = json.loads(tool_call.function.arguments)
         
         # 返回函数调用的结果
-        return json.dumps({
+        result = json.dumps({
             "function_call": {
                 "name": function_name,
                 "arguments": function_args
             }
         })
-    
-    return response_message.content
+    else:
+        result = response_message.content
+
+    if prompt_key is not None:
+        cassette.record(key, prompt_key, model, result, latency)
+    if store:
+        await get_completion_cache().aput(key, model, result)
+    return result
 
 # Token handling utilities
 def num_tokens_from_string(string: str, encoding_name: str = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    return len(encoding.encode(string))
+    return get_token_counter(encoding_name).count(string)
 
 def truncate_list_by_token_size(list_data: list, max_token_size: int) -> list:
     """
@@ -220,21 +297,21 @@ def ai_chat_stream(message: str | list,
         kwargs["tools"] = tools
         kwargs["tool_choice"] = "auto"
 
+    stream = client.chat.completions.create(**kwargs)
     try:
-        stream = client.chat.completions.create(**kwargs)
         for chunk in stream:
             if chunk.choices[0].delta.content is not None:
                 yield chunk.choices[0].delta.content
     finally:
-        # 确保清理资源
-        if hasattr(client, 'close'):
-            client.close()
+        # 只关闭本次响应，连接归还连接池，客户端继续复用
+        stream.close()
 
 
 async def ai_chat_stream_async(message: str | list, 
                   model: str = "gpt-4o-mini", 
                   response_format: str = 'NOT_GIVEN',
-                  tools: list = None):
+                  tools: list = None,
+                  use_cache: bool = True):
     """
     异步流式版本的聊天完成功能。
     
@@ -243,12 +320,35 @@ async def ai_chat_stream_async(message: str | list,
         model: 使用的模型
         response_format: 可选的响应格式（例如'json'）
         tools: 可选的函数定义列表
+        use_cache: 是否使用补全缓存；命中时按原始片段回放，完整输出后写入缓存
         
     Yields:
         聊天响应的文本片段
     """
-    client = _get_client(model, is_async=True)
     messages = message if isinstance(message, list) else _prepare_messages(message)
+
+    cache = get_completion_cache()
+    use_cache = use_cache and cache.config.enabled
+    key = cache_key(model, messages, DEFAULT_TEMPERATURE, response_format, tools)
+    if use_cache:
+        entry = await cache.aget(key)
+        if entry is not None:
+            async for chunk in replay_stream(entry):
+                yield chunk
+            return
+
+    cassette = get_cassette()
+    prompt_key = None
+    if cassette.config.mode != "off":
+        prompt_key = _prompt_key(messages, response_format, tools)
+        recorded = cassette.lookup(key, prompt_key)
+        if recorded is not None:
+            # 按录制时的片段间隔回放，不经过限流和熔断
+            async for chunk in cassette.replay_stream(recorded):
+                yield chunk
+            return
+
+    client = _get_client(model, is_async=True)
     
     kwargs = {
         "messages": messages,
@@ -264,14 +364,150 @@ async def ai_chat_stream_async(message: str | list,
         kwargs["tools"] = tools
         kwargs["tool_choice"] = "auto"
 
+    # 创建异步流（限流只作用于建立请求，流式读取不占用并发名额）
+    limiter = get_rate_limiter(model)
+    registry = get_model_registry()
+    breaker = get_circuit_breaker(model)
+    estimated_tokens = _estimate_prompt_tokens(messages)
+    breaker.before_call()
+    call_start = time.monotonic()
+    # 收到首个片段即视为请求成功并结算熔断器；之后的中途错误不再计入，避免一次请求同时记成功和失败
+    settled = False
     try:
-        # 创建异步流
-        stream = await client.chat.completions.create(**kwargs)
-        # 使用 async for 来正确迭代异步流
-        async for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
-    finally:
-        # 确保清理资源
-        if hasattr(client, 'close'):
-            await client.close()  # 如果 close 是异步方法，使用 await
\ No newline at end of file
+        # 只重试建立请求；流开始之后的错误不重试，避免重复输出
+        rate_limited = transient = 0
+        while True:
+            try:
+                async with limiter.slot(estimated_tokens):
+                    start = time.monotonic()
+                    stream = await client.chat.completions.create(**kwargs)
+                break
+            except RateLimitError as e:
+                limiter.on_rate_limited(parse_retry_after(e.response.headers))
+                rate_limited += 1
+                if rate_limited > RATE_LIMIT_RETRIES:
+                    raise
+            except TRANSIENT_ERRORS as e:
+                transient += 1
+                if transient > TRANSIENT_RETRIES:
+                    raise
+                logger.warning(f"Transient error from {model}, retry {transient}/{TRANSIENT_RETRIES}: {str(e)}")
+                await asyncio.sleep(TRANSIENT_BACKOFF * 2 ** (transient - 1))
+        chunks = []
+        offsets = []
+        try:
+            # 使用 async for 来正确迭代异步流
+            async for chunk in stream:
+                if not settled:
+                    # 流式请求以首个片段的到达时间作为延迟
+                    registry.record_success(model, time.monotonic() - start)
+                    breaker.on_success()
+                    settled = True
+                if chunk.choices[0].delta.content is not None:
+                    chunks.append(chunk.choices[0].delta.content)
+                    offsets.append(time.monotonic() - start)
+                    yield chunk.choices[0].delta.content
+            # 只有完整结束的流才写入缓存和磁带，中途断开的不记录
+            if prompt_key is not None:
+                cassette.record(key, prompt_key, model, ''.join(chunks), time.monotonic() - start, chunks, offsets)
+            if use_cache:
+                await cache.aput(key, model, ''.join(chunks), chunks)
+        finally:
+            # 只关闭本次响应，连接归还连接池，客户端继续复用
+            await stream.close()
+    except RateLimitError:
+        if not settled:
+            registry.record_failure(model)
+            breaker.on_abandoned()
+        raise
+    except FAILOVER_ERRORS as e:
+        if settled:
+            logger.warning(f"Stream from {model} broke off mid-response: {type(e).__name__}: {str(e)}")
+        else:
+            registry.record_failure(model)
+            breaker.on_failure()
+        raise
+    except BaseException:
+        # 包括调用方提前关闭生成器
+        if not settled:
+            breaker.on_abandoned(time.monotonic() - call_start)
+        raise
+    else:
+        if not settled:
+            breaker.on_success()
+
+
+async def ai_chat_routed_async(message: str | list,
+                               stage: str,
+                               model: Optional[str] = None,
+                               response_format: str = 'NOT_GIVEN',
+                               tools: list = None,
+                               use_cache: bool = True,
+                               coalesce: bool = True,
+                               timeout: float = REQUEST_TIMEOUT,
+                               on_model: Optional[Callable[[str], None]] = None) -> str:
+    """
+    按阶段路由的异步聊天：依次尝试路由器给出的候选模型，服务商不可用时自动切换
+
+    Args:
+        message: 用户消息(字符串)或完整消息列表
+        stage: 阶段名，见 model_registry 中的 STAGE_*
+        model: 调用方指定的模型；健康时优先使用，否则作为最后的候选
+        response_format: 可选的响应格式（例如'json'）
+        tools: 可选的函数定义列表
+        use_cache: 是否使用补全缓存
+        coalesce: 是否与正在进行的相同请求合并
+        timeout: 每个候选模型的超时（秒）；超时后切换到下一个候选，总耗时最多为 timeout 乘以候选数
+        on_model: 成功返回时以实际给出回复的模型调用（故障切换后与 model 不同）
+
+    Returns:
+        str: AI 回复内容
+    """
+    messages = message if isinstance(message, list) else _prepare_messages(message)
+    candidates = get_model_registry().route(stage, _estimate_prompt_tokens(messages), preferred=model)
+    for index, candidate in enumerate(candidates):
+        try:
+            result = await ai_chat_async(messages, candidate, response_format, tools, use_cache, coalesce, timeout)
+            if on_model is not None:
+                on_model(candidate)
+            return result
+        except FAILOVER_ERRORS as e:
+            if index == len(candidates) - 1:
+                raise
+            logger.warning(f"Model {candidate} failed ({type(e).__name__}: {e}), failing over to {candidates[index + 1]}")
+
+
+async def ai_chat_stream_routed_async(message: str | list,
+                                      stage: str,
+                                      model: Optional[str] = None,
+                                      response_format: str = 'NOT_GIVEN',
+                                      tools: list = None,
+                                      use_cache: bool = True):
+    """
+    按阶段路由的异步流式聊天
+
+    只在收到第一个片段之前切换模型；已经开始输出后出错直接抛出，避免输出拼接两个模型的内容。
+
+    Yields:
+        聊天响应的文本片段
+    """
+    messages = message if isinstance(message, list) else _prepare_messages(message)
+    candidates = get_model_registry().route(stage, _estimate_prompt_tokens(messages), preferred=model)
+    for index, candidate in enumerate(candidates):
+        stream = ai_chat_stream_async(messages, candidate, response_format, tools, use_cache)
+        try:
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                return
+            except FAILOVER_ERRORS as e:
+                if index == len(candidates) - 1:
+                    raise
+                logger.warning(f"Model {candidate} failed ({type(e).__name__}: {e}), failing over to {candidates[index + 1]}")
+                continue
+            yield first
+            async for chunk in stream:
+                yield chunk
+            return
+        finally:
+            await stream.aclose()
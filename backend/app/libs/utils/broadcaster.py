@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set
+
+from .cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多积压的片段数，超过后该订阅者被断开
+DEFAULT_QUEUE_SIZE = 1024
+
+_END = object()
+
+
+class SlowSubscriberError(Exception):
+    """订阅者读取太慢、队列已满时抛出，该订阅者被断开，其他订阅者不受影响"""
+
+
+class _Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class Broadcaster:
+    """
+    把一个上游异步流分发给多个订阅者
+
+    - 生产者任务只消费一次上游流，每个片段放入所有订阅者各自的有界队列
+    - 后加入的订阅者先回放已经产生的片段，再接收新片段
+    - 某个订阅者的队列满了（客户端太慢）时只断开它，不阻塞生产者和其他订阅者
+    - 所有订阅者都离开而流尚未结束时，取消生产者任务和它的取消令牌
+    """
+
+    def __init__(self, factory: Callable[[], Awaitable[AsyncIterator[str]]],
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 cancel_token: Optional[CancellationToken] = None):
+        self.queue_size = queue_size
+        self.cancel_token = cancel_token
+        self.history: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.dropped = 0
+        self._subscribers: Set[_Subscriber] = set()
+        self._task = asyncio.get_running_loop().create_task(self._produce(factory))
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def add_done_callback(self, callback: Callable[[asyncio.Task], None]) -> None:
+        self._task.add_done_callback(callback)
+
+    async def _produce(self, factory) -> None:
+        source = None
+        try:
+            source = await factory()
+            if hasattr(source, '__aiter__'):
+                async for chunk in source:
+                    self._publish(chunk)
+            else:
+                for chunk in source:
+                    self._publish(chunk)
+        except BaseException as e:
+            self.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.done = True
+            for subscriber in list(self._subscribers):
+                self._offer(subscriber, _END)
+            if source is not None and hasattr(source, 'aclose'):
+                await source.aclose()
+
+    def _publish(self, chunk: str) -> None:
+        self.history.append(chunk)
+        for subscriber in list(self._subscribers):
+            self._offer(subscriber, chunk)
+
+    def _offer(self, subscriber: _Subscriber, item) -> None:
+        if subscriber.dropped:
+            return
+        try:
+            subscriber.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            subscriber.dropped = True
+            self.dropped += 1
+            logger.warning(f"Dropping slow subscriber ({subscriber.queue.qsize()} chunks queued)")
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """
+        订阅输出：先回放已有片段，再接收后续片段
+
+        Raises:
+            SlowSubscriberError: 本订阅者积压超过 queue_size 个片段
+            上游抛出的异常会原样传给每个订阅者
+        """
+        subscriber = _Subscriber(self.queue_size)
+        # 先登记再取快照，之后的片段都会进入队列，不会遗漏
+        replay = len(self.history)
+        self._subscribers.add(subscriber)
+        if self.done:
+            self._offer(subscriber, _END)
+        try:
+            for index in range(replay):
+                yield self.history[index]
+            while True:
+                if subscriber.dropped and subscriber.queue.empty():
+                    raise SlowSubscriberError("Subscriber fell too far behind the stream")
+                item = await subscriber.queue.get()
+                if item is _END:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                yield item
+        finally:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers and not self.done:
+                logger.info("All subscribers left, cancelling broadcast")
+                if self.cancel_token is not None:
+                    self.cancel_token.cancel("all subscribers left")
+                self._task.cancel()
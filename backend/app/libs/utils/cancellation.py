@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class CancellationToken:
+    """
+    一次生成任务的取消令牌
+
+    由任务的所有者持有（发起请求的连接、共享流的 Broadcaster、后台任务 worker），
+    沿 generate_doc_async -> process_chunk_parallel_async / process_grouped_docs_parallel 传递。
+    取消时立即取消登记过的所有子任务：排队中的任务不再发出请求，进行中的 LLM 调用被中断，
+    信号量与限流器的并发名额随子任务退出释放。
+
+    与 asyncio 的取消不同，令牌可以在任务树之外（例如另一个连接的断开检测）触发，
+    并且取消是一次性的：之后登记的任务会被立即取消。
+    """
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._cancelled = False
+        self._tasks: Set[asyncio.Future] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """取消令牌及所有登记的子任务；重复调用无效"""
+        if self._cancelled:
+            return
+        self._cancelled = True
+        self.reason = reason
+        tasks = [task for task in self._tasks if not task.done()]
+        self._tasks.clear()
+        if tasks:
+            logger.info(f"Cancelling {len(tasks)} in-flight tasks: {reason}")
+        for task in tasks:
+            task.cancel()
+
+    def track(self, task: asyncio.Future) -> asyncio.Future:
+        """登记子任务，令牌取消时一并取消；任务结束后自动移除"""
+        if self._cancelled:
+            task.cancel()
+            return task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def raise_if_cancelled(self) -> None:
+        """令牌已取消时抛出 asyncio.CancelledError，在开始新阶段前调用"""
+        if self._cancelled:
+            raise asyncio.CancelledError(self.reason)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for task in self._tasks if not task.done())
@@ -0,0 +1,199 @@
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from .completion_cache import default_cache_path
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay", "auto")
+
+
+class CassetteMissError(Exception):
+    """replay 模式下请求不在磁带中"""
+
+
+@dataclass
+class CassetteConfig:
+    """
+    LLM 请求录制/回放配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        mode: off 不启用；record 录制真实请求；replay 只回放，未录制的请求抛出 CassetteMissError；
+              auto 已录制的回放，其余请求真实发出并录制（LLM_CASSETTE_MODE）
+        path: 磁带文件路径，每行一条 JSON 记录，录制时追加写入（LLM_CASSETTE_PATH）
+        speed: 回放速度，1 为按录制时的耗时与片段间隔回放，0 为立即返回（LLM_CASSETTE_SPEED，可写 instant）
+    """
+    mode: str = "off"
+    path: str = field(default_factory=lambda: default_cache_path("llm_cassette.jsonl"))
+    speed: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> "CassetteConfig":
+        speed = os.environ.get("LLM_CASSETTE_SPEED", str(cls.speed)).lower()
+        return cls(
+            mode=os.environ.get("LLM_CASSETTE_MODE", cls.mode).lower(),
+            path=os.environ.get("LLM_CASSETTE_PATH") or default_cache_path("llm_cassette.jsonl"),
+            speed=0.0 if speed == "instant" else float(speed),
+        )
+
+
+class Cassette:
+    """
+    录制 ai_chat_async / ai_chat_stream_async 的真实请求，并按录制时的节奏回放
+
+    每条记录包含请求哈希（与补全缓存相同的 cache_key）、与模型无关的 prompt 哈希、回复内容、
+    总耗时，流式请求还包含每个片段及其相对请求开始的时间。回放时先按请求哈希查找，
+    找不到再按 prompt 哈希查找，这样路由器在回放时选了另一个模型也能命中。
+    同一请求录制了多次时按录制顺序依次回放，用完后重复最后一条。
+
+    录制只覆盖真正发往上游的请求；需要完整录制一次任务时应关闭补全缓存（LLM_CACHE_ENABLED=false）。
+    """
+
+    def __init__(self, config: Optional[CassetteConfig] = None):
+        self.config = config or CassetteConfig.from_env()
+        if self.config.mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {self.config.mode!r}, expected one of {MODES}")
+        self._by_key: Dict[str, List[dict]] = defaultdict(list)
+        self._by_prompt: Dict[str, List[dict]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.config.mode in ("record", "auto")
+
+    @property
+    def replaying(self) -> bool:
+        return self.config.mode in ("replay", "auto")
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self.config.path):
+                with open(self.config.path, encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            self._index(json.loads(line))
+            self._loaded = True
+            logger.info(f"Loaded {len(self._by_key)} recorded requests from {self.config.path}")
+
+    def _index(self, entry: dict) -> None:
+        self._by_key[entry["key"]].append(entry)
+        self._by_prompt[entry["prompt_key"]].append(entry)
+
+    def lookup(self, key: str, prompt_key: str) -> Optional[dict]:
+        """
+        查找录制的回复
+
+        Returns:
+            Optional[dict]: 录制的记录；未启用回放或（auto 模式下）未录制时返回 None
+
+        Raises:
+            CassetteMissError: replay 模式下请求未录制
+        """
+        if not self.replaying:
+            return None
+        self._load()
+        for index_key, entries in ((key, self._by_key.get(key)), (prompt_key, self._by_prompt.get(prompt_key))):
+            if entries:
+                cursor = self._cursors[index_key]
+                self._cursors[index_key] = cursor + 1
+                self.hits += 1
+                return entries[min(cursor, len(entries) - 1)]
+        self.misses += 1
+        if self.config.mode == "replay":
+            raise CassetteMissError(f"Request {key[:12]} is not in cassette {self.config.path}")
+        return None
+
+    def record(self,
+               key: str,
+               prompt_key: str,
+               model: str,
+               content: str,
+               latency: float,
+               chunks: Optional[List[str]] = None,
+               offsets: Optional[List[float]] = None) -> None:
+        """追加一条录制记录；offsets 为每个片段相对请求开始的秒数"""
+        if not self.recording or content is None:
+            return
+        entry = {
+            "key": key,
+            "prompt_key": prompt_key,
+            "model": model,
+            "content": content,
+            "latency": round(latency, 4),
+            "recorded_at": time.time(),
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+            entry["offsets"] = [round(offset, 4) for offset in offsets]
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.config.path) or '.', exist_ok=True)
+            with open(self.config.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            if self._loaded:
+                self._index(entry)
+            self.recorded += 1
+
+    async def replay(self, entry: dict) -> str:
+        """按录制时的耗时返回非流式回复"""
+        if self.config.speed > 0:
+            await asyncio.sleep(entry["latency"] * self.config.speed)
+        return entry["content"]
+
+    async def replay_stream(self, entry: dict) -> AsyncIterator[str]:
+        """按录制时的片段间隔回放流式回复；非流式记录整段输出"""
+        chunks = entry.get("chunks") or [entry["content"]]
+        offsets = entry.get("offsets") or [entry["latency"]]
+        previous = 0.0
+        for chunk, offset in zip(chunks, offsets):
+            delay = (offset - previous) * self.config.speed
+            previous = offset
+            # 立即回放时也让出事件循环，保持与真实流式输出相同的调度行为
+            await asyncio.sleep(max(0.0, delay))
+            yield chunk
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.config.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+        }
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """返回进程级共享的磁带"""
+    global _cassette
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette()
+    return _cassette
+
+
+def configure_cassette(config: CassetteConfig) -> Cassette:
+    """用新的配置替换共享磁带，例如压测脚本在启动时切换到回放模式"""
+    global _cassette
+    with _cassette_lock:
+        _cassette = Cassette(config)
+    return _cassette
@@ -0,0 +1,194 @@
+import asyncio
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from ..prompt.prompt import PROMPT_VERSION
+from .completion_cache import default_cache_path
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_SPACE_PATTERN = re.compile(r'[ \t　]+(?=\n)')
+
+
+@dataclass
+class ChunkCacheConfig:
+    """
+    map 结果缓存配置，默认值可通过环境变量覆盖
+
+    缓存默认关闭：启用后 map 阶段改用按天锚定的分段（anchored_split_by_tokens），
+    片段数不再按并发数取整，只有同一群聊会反复上传新导出时才值得开启。
+
+    Attributes:
+        enabled: 是否启用缓存并改用锚定分段（LLM_CHUNK_CACHE_ENABLED）
+        path: SQLite 数据库文件路径（LLM_CHUNK_CACHE_PATH）
+        max_entries: 条目数上限，超出后按最近访问时间淘汰（LLM_CHUNK_CACHE_MAX_ENTRIES）
+        max_age: 条目最后一次命中后保留的秒数（LLM_CHUNK_CACHE_MAX_AGE）
+        evict_interval: 每写入多少条检查一次淘汰
+    """
+    enabled: bool = False
+    path: str = field(default_factory=lambda: default_cache_path("chunks.sqlite3"))
+    max_entries: int = 50000
+    max_age: float = 30 * 24 * 3600
+    evict_interval: int = 32
+
+    @classmethod
+    def from_env(cls) -> "ChunkCacheConfig":
+        return cls(
+            enabled=os.environ.get("LLM_CHUNK_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            path=os.environ.get("LLM_CHUNK_CACHE_PATH") or default_cache_path("chunks.sqlite3"),
+            max_entries=int(os.environ.get("LLM_CHUNK_CACHE_MAX_ENTRIES", cls.max_entries)),
+            max_age=float(os.environ.get("LLM_CHUNK_CACHE_MAX_AGE", cls.max_age)),
+        )
+
+
+def normalize_chunk(chunk: str) -> str:
+    """统一换行符、去掉行尾与首尾空白；导出工具不同造成的空白差异不影响命中"""
+    return _TRAILING_SPACE_PATTERN.sub('', chunk.replace('\r\n', '\n').replace('\r', '\n')).strip()
+
+
+def chunk_key(chunk: str, doc_type: str, model: str, prompt_version: str = PROMPT_VERSION) -> str:
+    """
+    map 结果的缓存键：(规范化后的片段内容哈希, 文档类型, map 模型, 提示词版本)
+
+    不含项目或任务信息，因此不同项目上传的相同群聊、同一项目的新导出中未变化的片段都能命中。
+    """
+    h = hashlib.sha256()
+    for part in (prompt_version, doc_type, model):
+        h.update(str(part).encode('utf-8') + b'\0')
+    h.update(normalize_chunk(chunk).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ChunkCache:
+    """
+    基于 SQLite 的片段级 map 结果缓存
+
+    与补全缓存不同，键只取决于片段内容、文档类型、模型和提示词版本，
+    配合按天锚定的分段（anchored_split_by_tokens），新导出中未变化的历史片段直接命中，
+    只有新增或改动的片段才发给模型。
+    条目超过 max_age 或条目数超过 max_entries 时，按最近访问时间淘汰。
+    """
+
+    def __init__(self, config: Optional[ChunkCacheConfig] = None):
+        self.config = config or ChunkCacheConfig.from_env()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+        self.evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.config.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.config.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " key TEXT PRIMARY KEY,"
+                " doc_type TEXT NOT NULL,"
+                " model TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_accessed_at ON chunks (accessed_at)")
+            self._conn = conn
+            self._evict(conn, time.time())
+        return self._conn
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM chunks WHERE accessed_at < ?", (now - self.config.max_age,)).rowcount
+        # 从最久未访问的条目开始删除，直到条目数回到上限以内
+        removed = conn.execute(
+            "DELETE FROM chunks WHERE key IN ("
+            " SELECT key FROM chunks ORDER BY accessed_at"
+            " LIMIT MAX((SELECT COUNT(*) FROM chunks) - ?, 0))",
+            (self.config.max_entries,),
+        ).rowcount
+        if expired or removed:
+            logger.info(f"Evicted {expired} expired and {removed} least recently used chunk results")
+        self.evictions += expired + removed
+
+    def get(self, key: str) -> Optional[str]:
+        """取回缓存的 map 结果，没有时返回 None；命中时刷新访问时间"""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT content FROM chunks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE chunks SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, doc_type: str, model: str, content: str) -> None:
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO chunks (key, doc_type, model, content, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, doc_type, model, content, now, now),
+            )
+            self.saved += 1
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.config.evict_interval:
+                self._writes_since_evict = 0
+                self._evict(conn, now)
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, doc_type: str, model: str, content: str) -> None:
+        await asyncio.to_thread(self.put, key, doc_type, model, content)
+
+    def evict(self) -> None:
+        """立即执行一次淘汰"""
+        with self._lock:
+            self._evict(self._connection(), time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM chunks")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.config.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved": self.saved,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[ChunkCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_chunk_cache() -> ChunkCache:
+    """返回进程级共享的 map 结果缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ChunkCache()
+    return _cache
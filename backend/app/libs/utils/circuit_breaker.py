@@ -0,0 +1,192 @@
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+import logging
+import os
+import threading
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+from .client_pool import provider_name
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+@dataclass
+class BreakerConfig:
+    """
+    熔断器配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        window: 计算错误率时使用的最近请求数（LLM_BREAKER_WINDOW）
+        min_calls: 窗口内请求数达到这个值后才按错误率判断
+        failure_rate: 错误率达到这个值时打开熔断（LLM_BREAKER_FAILURE_RATE）
+        slow_call_duration: 请求在这么多秒后仍被取消（外层超时）时按失败计
+        open_duration: 打开状态持续的秒数，之后进入半开状态（LLM_BREAKER_OPEN_DURATION）
+        half_open_probes: 半开状态下允许同时发出的探测请求数，全部成功后关闭熔断
+    """
+    window: int = 20
+    min_calls: int = 5
+    failure_rate: float = 0.5
+    slow_call_duration: float = 120.0
+    open_duration: float = 30.0
+    half_open_probes: int = 2
+
+    @classmethod
+    def from_env(cls) -> "BreakerConfig":
+        return cls(
+            window=int(os.environ.get("LLM_BREAKER_WINDOW", cls.window)),
+            failure_rate=float(os.environ.get("LLM_BREAKER_FAILURE_RATE", cls.failure_rate)),
+            open_duration=float(os.environ.get("LLM_BREAKER_OPEN_DURATION", cls.open_duration)),
+        )
+
+
+class CircuitOpenError(Exception):
+    """熔断打开时直接拒绝请求"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open, retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    单个服务商/模型的熔断器
+
+    - 关闭：正常放行，记录最近 window 次请求的成败，错误率超过阈值时打开
+    - 打开：在 open_duration 内直接抛出 CircuitOpenError，不占用限流名额也不等待超时
+    - 半开：放行 half_open_probes 个探测请求，全部成功则关闭，任何一个失败则重新打开
+
+    429、参数错误等说明服务仍在正常响应，不计入错误率。
+    """
+
+    def __init__(self, name: str, config: BreakerConfig):
+        self.name = name
+        self.config = config
+        self.state = CircuitState.CLOSED
+        self.outcomes: Deque[bool] = deque(maxlen=config.window)
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _transition(self, state: CircuitState) -> None:
+        if state is self.state:
+            return
+        logger.warning(f"Circuit for {self.name}: {self.state.value} -> {state.value}")
+        self.state = state
+        if state is CircuitState.OPEN:
+            self.opened += 1
+            self.opened_at = time.monotonic()
+        elif state is CircuitState.HALF_OPEN:
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+        else:
+            self.outcomes.clear()
+
+    def _refresh(self) -> None:
+        if self.state is CircuitState.OPEN and time.monotonic() - self.opened_at >= self.config.open_duration:
+            self._transition(CircuitState.HALF_OPEN)
+
+    @property
+    def available(self) -> bool:
+        """当前是否会放行请求（供路由器排序使用，不占用探测名额）"""
+        self._refresh()
+        if self.state is CircuitState.OPEN:
+            return False
+        if self.state is CircuitState.HALF_OPEN:
+            return self.probes_in_flight < self.config.half_open_probes
+        return True
+
+    @property
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def before_call(self) -> None:
+        """请求前调用；熔断打开或探测名额已满时抛出 CircuitOpenError"""
+        self._refresh()
+        if self.state is CircuitState.OPEN:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.opened_at + self.config.open_duration - time.monotonic())
+        if self.state is CircuitState.HALF_OPEN:
+            if self.probes_in_flight >= self.config.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 1.0)
+            self.probes_in_flight += 1
+
+    def on_success(self) -> None:
+        if self.state is CircuitState.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            self.probe_successes += 1
+            if self.probe_successes >= self.config.half_open_probes:
+                self._transition(CircuitState.CLOSED)
+            return
+        self.outcomes.append(True)
+
+    def on_failure(self) -> None:
+        if self.state is CircuitState.HALF_OPEN:
+            # 探测失败，重新打开
+            self._transition(CircuitState.OPEN)
+            return
+        self.outcomes.append(False)
+        if (self.state is CircuitState.CLOSED
+                and len(self.outcomes) >= self.config.min_calls
+                and self.failure_rate >= self.config.failure_rate):
+            self._transition(CircuitState.OPEN)
+
+    def on_abandoned(self, elapsed: float = 0.0) -> None:
+        """
+        请求没有得出成败（被取消、429、参数错误等）时调用，释放探测名额
+
+        Args:
+            elapsed: 请求已经发出的秒数；超过 slow_call_duration 的取消按超时失败处理
+        """
+        if elapsed >= self.config.slow_call_duration:
+            self.on_failure()
+        elif self.state is CircuitState.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def stats(self) -> dict:
+        self._refresh()
+        return {
+            "state": self.state.value,
+            "failure_rate": self.failure_rate,
+            "calls_in_window": len(self.outcomes),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_config: Optional[BreakerConfig] = None
+
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    """返回模型对应的（服务商, 模型）熔断器"""
+    global _config
+    key = (provider_name(model), model)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                if _config is None:
+                    _config = BreakerConfig.from_env()
+                breaker = CircuitBreaker(f"{key[0]}/{model}", _config)
+                _breakers[key] = breaker
+    return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, dict]:
+    return {breaker.name: breaker.stats() for breaker in list(_breakers.values())}
@@ -0,0 +1,230 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+logger = logging.getLogger(__name__)
+
+DEEPSEEK_MODELS = ('deepseek-v3-0324', 'deepseek-r1', 'deepseek-v3')
+
+
+@dataclass(frozen=True)
+class Provider:
+    """一个 OpenAI 兼容的服务端点"""
+    name: str
+    api_key: str
+    base_url: str
+
+
+def provider_name(model: str) -> str:
+    """根据模型名判断服务商（不读取环境变量）"""
+    if '/' in model:
+        return "openrouter"
+    if model in DEEPSEEK_MODELS:
+        return "deepseek"
+    return "openai"
+
+
+def resolve_provider(model: str) -> Provider:
+    """根据模型名选择服务商，并从环境变量读取密钥和地址"""
+    name = provider_name(model)
+
+    # 指向本地模拟服务（mock_llm）时，所有模型都发到模拟服务；服务商名不变，限流与熔断仍按服务商区分
+    mock_base = os.environ.get("LLM_MOCK_BASE")
+    if mock_base:
+        return Provider(name, "mock", mock_base)
+
+    # 处理 OpenRouter 模型 (包含 '/' 的模型名称)
+    if name == "openrouter":
+        api_key = os.environ.get("OPENROUTER_API_KEY")
+        base_url = os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
+        if not api_key:
+            raise ValueError(
+                "Missing required environment variable: OPENROUTER_API_KEY"
+            )
+        return Provider("openrouter", api_key, base_url)
+
+    # 处理 Deepseek 模型
+    if name == "deepseek":
+        api_key = os.environ.get("DEEPSEEK_API_KEY")
+        base_url = os.environ.get("DEEPSEEK_API_BASE")
+        if not api_key or not base_url:
+            raise ValueError(
+                "Missing required environment variables for Deepseek: "
+                "DEEPSEEK_API_KEY and DEEPSEEK_API_BASE must be set"
+            )
+        return Provider("deepseek", api_key, base_url)
+
+    # 处理默认 OpenAI 模型
+    api_key = os.environ.get("OPENAI_API_KEY")
+    base_url = os.environ.get("OPENAI_API_BASE")
+    if not api_key:
+        raise ValueError("Missing required environment variable: OPENAI_API_KEY")
+    return Provider("openai", api_key, base_url or "https://api.openai.com/v1")
+
+
+@dataclass
+class PoolConfig:
+    """
+    连接池配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        max_connections: 每个服务商的最大连接数（LLM_POOL_MAX_CONNECTIONS）
+        max_keepalive_connections: 保持空闲的最大连接数（LLM_POOL_MAX_KEEPALIVE）
+        keepalive_expiry: 空闲连接保留的秒数（LLM_POOL_KEEPALIVE_EXPIRY）
+        http2: 是否启用 HTTP/2，需要安装 h2（LLM_POOL_HTTP2）
+        timeout: 单次请求的超时秒数（LLM_POOL_TIMEOUT）
+        verify: 是否校验服务端证书，自签名证书的内网网关可关闭（LLM_POOL_VERIFY）
+    """
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+    timeout: float = 600.0
+    verify: bool = True
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        return cls(
+            max_connections=int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", cls.max_connections)),
+            max_keepalive_connections=int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", cls.max_keepalive_connections)),
+            keepalive_expiry=float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", cls.keepalive_expiry)),
+            http2=os.environ.get("LLM_POOL_HTTP2", "").lower() in ("1", "true", "yes"),
+            timeout=float(os.environ.get("LLM_POOL_TIMEOUT", cls.timeout)),
+            verify=os.environ.get("LLM_POOL_VERIFY", "true").lower() not in ("0", "false", "no"),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ClientPool:
+    """
+    按服务商复用的 OpenAI 客户端注册表
+
+    同一服务商的所有请求共享一个 httpx 连接池，keep-alive 连接在进程生命周期内复用，
+    不再为每次调用重新建立 TCP/TLS 连接。异步客户端与创建它的事件循环绑定，
+    在另一个事件循环中使用时（例如脚本里多次 asyncio.run）会为该循环单独创建。
+    """
+
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig.from_env()
+        self._clients: Dict[Provider, OpenAI] = {}
+        self._async_clients: Dict[Tuple[Provider, asyncio.AbstractEventLoop], AsyncOpenAI] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _http2(self) -> bool:
+        if self.config.http2 and not _http2_available():
+            logger.warning("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+            self.config.http2 = False
+        return self.config.http2
+
+    def get(self, model: str) -> OpenAI:
+        """返回模型对应服务商的同步客户端"""
+        provider = resolve_provider(model)
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None:
+                client = OpenAI(
+                    api_key=provider.api_key,
+                    base_url=provider.base_url,
+                    timeout=self.config.timeout,
+                    http_client=DefaultHttpxClient(
+                        limits=self.config.limits(),
+                        http2=self._http2(),
+                        verify=self.config.verify,
+                    ),
+                )
+                self._clients[provider] = client
+                self.created += 1
+            return client
+
+    def get_async(self, model: str) -> AsyncOpenAI:
+        """返回模型对应服务商、绑定当前事件循环的异步客户端"""
+        provider = resolve_provider(model)
+        key = (provider, asyncio.get_running_loop())
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None:
+                # 已关闭的事件循环上的客户端不会再被使用
+                for stale in [k for k in self._async_clients if k[1].is_closed()]:
+                    del self._async_clients[stale]
+                client = AsyncOpenAI(
+                    api_key=provider.api_key,
+                    base_url=provider.base_url,
+                    timeout=self.config.timeout,
+                    # 429 结合限流器、连接错误与 5xx 按退避在 ai_chat_async 中重试，不在 SDK 内部静默重试
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=self.config.limits(),
+                        http2=self._http2(),
+                        verify=self.config.verify,
+                    ),
+                )
+                self._async_clients[key] = client
+                self.created += 1
+            return client
+
+    async def aclose(self) -> None:
+        """关闭所有客户端及其连接池"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = list(self._clients.values())
+            async_clients = list(self._async_clients.items())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            client.close()
+        for (_, client_loop), client in async_clients:
+            # 其他事件循环的客户端无法在这里 await，只能随循环一起释放
+            if client_loop is loop:
+                await client.close()
+
+
+_pool: Optional[ClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """返回进程级共享的客户端池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ClientPool()
+    return _pool
+
+
+def configure_client_pool(config: PoolConfig) -> ClientPool:
+    """用新的配置替换共享客户端池（已创建的客户端不受影响，应在启动时调用）"""
+    global _pool
+    with _pool_lock:
+        _pool = ClientPool(config)
+    return _pool
+
+
+async def close_client_pool() -> None:
+    """关闭共享客户端池，在应用关闭时调用"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        await pool.aclose()
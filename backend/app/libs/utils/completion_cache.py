@@ -0,0 +1,249 @@
+import asyncio
+from dataclasses import dataclass, field
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, List, Optional
+
+from ..prompt.prompt import PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# 非流式结果按流式回放时，每个片段的字符数
+REPLAY_CHUNK_SIZE = 16
+
+
+def default_cache_path(filename: str) -> str:
+    """
+    本地缓存文件的默认路径：LLM_CACHE_DIR 目录下的 filename
+
+    LLM_CACHE_DIR 默认为应用数据目录（PROJECT_FOLDER，默认值与 app.core.config 一致）下的 .cache，
+    不随进程的工作目录变化，也不会在代码仓库中生成缓存文件。
+    """
+    cache_dir = os.environ.get("LLM_CACHE_DIR") or os.path.join(
+        os.environ.get("PROJECT_FOLDER") or os.path.join(os.getcwd(), "projects"), ".cache")
+    return os.path.join(cache_dir, filename)
+
+
+@dataclass
+class CacheConfig:
+    """
+    补全缓存配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        enabled: 是否启用缓存（LLM_CACHE_ENABLED）
+        path: SQLite 数据库文件路径（LLM_CACHE_PATH）
+        max_bytes: 缓存内容的总大小上限，超出后按最近访问时间淘汰（LLM_CACHE_MAX_BYTES）
+        max_age: 条目的最长保留秒数（LLM_CACHE_MAX_AGE）
+        evict_interval: 每写入多少条检查一次淘汰
+    """
+    enabled: bool = True
+    path: str = field(default_factory=lambda: default_cache_path("completions.sqlite3"))
+    max_bytes: int = 512 << 20
+    max_age: float = 7 * 24 * 3600
+    evict_interval: int = 32
+
+    @classmethod
+    def from_env(cls) -> "CacheConfig":
+        return cls(
+            enabled=os.environ.get("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no"),
+            path=os.environ.get("LLM_CACHE_PATH") or default_cache_path("completions.sqlite3"),
+            max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", cls.max_bytes)),
+            max_age=float(os.environ.get("LLM_CACHE_MAX_AGE", cls.max_age)),
+        )
+
+
+def cache_key(model: str,
+              messages: list,
+              temperature: float,
+              response_format: str = 'NOT_GIVEN',
+              tools: Optional[list] = None,
+              prompt_version: str = PROMPT_VERSION) -> str:
+    """
+    计算补全请求的内容哈希
+
+    消息内容去掉首尾空白、统一换行符后参与哈希；提示词版本号变化时所有旧条目自然失效。
+    """
+    normalized = [
+        {
+            "role": m.get("role"),
+            "content": m["content"].replace('\r\n', '\n').strip() if isinstance(m.get("content"), str) else m.get("content"),
+        }
+        for m in messages
+    ]
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": normalized,
+            "temperature": temperature,
+            "response_format": response_format,
+            "tools": tools,
+            "prompt_version": prompt_version,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """
+    基于 SQLite 的内容寻址补全缓存
+
+    每个条目保存完整回复以及流式输出时的原始片段，命中时可以按原样回放。
+    条目超过 max_age 或总大小超过 max_bytes 时，按最近访问时间淘汰。
+    同步方法做实际的数据库读写；异步方法把它们放到线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, config: Optional[CacheConfig] = None):
+        self.config = config or CacheConfig.from_env()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.config.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.config.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " chunks TEXT,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        读取缓存条目
+
+        Returns:
+            Optional[dict]: {"content": str, "chunks": Optional[List[str]]}，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT content, chunks, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[2] > self.config.max_age:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        content, chunks, _ = row
+        return {"content": content, "chunks": json.loads(chunks) if chunks else None}
+
+    def put(self, key: str, model: str, content: str, chunks: Optional[List[str]] = None) -> None:
+        """写入缓存条目，必要时触发淘汰"""
+        if content is None:
+            return
+        now = time.time()
+        chunks_json = json.dumps(chunks, ensure_ascii=False) if chunks else None
+        size = len(content.encode('utf-8')) + (len(chunks_json.encode('utf-8')) if chunks_json else 0)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, content, chunks, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, chunks_json, size, now, now),
+            )
+            self.writes += 1
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.config.evict_interval:
+                self._writes_since_evict = 0
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute(
+            "DELETE FROM completions WHERE created_at < ?", (now - self.config.max_age,)
+        ).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        removed = 0
+        if total > self.config.max_bytes:
+            # 从最久未访问的条目开始删除，直到总大小回到上限以内
+            excess = total - self.config.max_bytes
+            freed = 0
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM completions ORDER BY accessed_at"):
+                victims.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM completions WHERE key = ?", victims)
+            removed = len(victims)
+        self.evictions += expired + removed
+
+    def evict(self) -> None:
+        """立即执行一次淘汰"""
+        with self._lock:
+            self._evict(self._connection(), time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM completions")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def aget(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, model: str, content: str, chunks: Optional[List[str]] = None) -> None:
+        await asyncio.to_thread(self.put, key, model, content, chunks)
+
+    def stats(self) -> dict:
+        """命中率等统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.config.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+async def replay_stream(entry: dict) -> AsyncIterator[str]:
+    """把缓存条目按流式片段回放；没有原始片段时按固定长度切分完整回复"""
+    chunks = entry.get("chunks")
+    if not chunks:
+        content = entry["content"]
+        chunks = [content[i:i + REPLAY_CHUNK_SIZE] for i in range(0, len(content), REPLAY_CHUNK_SIZE)]
+    for chunk in chunks:
+        yield chunk
+        # 让出事件循环，保持与真实流式输出相同的调度行为
+        await asyncio.sleep(0)
+
+
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """返回进程级共享的补全缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CompletionCache()
+    return _cache
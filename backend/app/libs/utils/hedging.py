@@ -0,0 +1,186 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class HedgeConfig:
+    """
+    对冲请求配置，from_env() 从环境变量读取（LLM_HEDGE_*）
+
+    Attributes:
+        enabled: 调用方没有传入配置时，文档生成的 map 阶段是否启用对冲（LLM_HEDGE_ENABLED，默认关闭）
+        percentile: 请求耗时超过近期延迟分布的这个分位数时发出对冲请求
+        min_samples: 延迟样本不足时不对冲
+        min_delay: 对冲等待时间的下限（秒），避免对本来就很快的请求对冲
+        max_hedge_ratio: 对冲请求占总请求数的比例上限
+        alternate_model: 对冲请求使用的备用模型，默认与原请求相同
+        window: 计算分位数时使用的最近样本数
+    """
+    enabled: bool = False
+    percentile: float = 95.0
+    min_samples: int = 20
+    min_delay: float = 5.0
+    max_hedge_ratio: float = 0.1
+    alternate_model: Optional[str] = None
+    window: int = 200
+
+    @classmethod
+    def from_env(cls) -> "HedgeConfig":
+        return cls(
+            enabled=os.environ.get("LLM_HEDGE_ENABLED", "false").lower() not in ("0", "false", "no"),
+            percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", cls.percentile)),
+            min_samples=int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", cls.min_samples)),
+            min_delay=float(os.environ.get("LLM_HEDGE_MIN_DELAY", cls.min_delay)),
+            max_hedge_ratio=float(os.environ.get("LLM_HEDGE_MAX_RATIO", cls.max_hedge_ratio)),
+            alternate_model=os.environ.get("LLM_HEDGE_ALTERNATE_MODEL") or None,
+            window=int(os.environ.get("LLM_HEDGE_WINDOW", cls.window)),
+        )
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    primary_wins: int = 0
+    hedge_wins: int = 0
+    failures: int = 0
+    skipped_by_budget: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "skipped_by_budget": self.skipped_by_budget,
+        }
+
+
+@dataclass
+class Hedger:
+    """
+    单个模型的对冲执行器
+
+    请求耗时超过近期延迟的指定分位数后，再发出一个相同的请求（可以换成备用模型），
+    先成功返回的结果胜出，另一个请求被取消。对冲比例受 max_hedge_ratio 限制。
+    """
+    model: str
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+    stats: HedgeStats = field(default_factory=HedgeStats)
+
+    def record(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def hedge_delay(self, config: HedgeConfig) -> Optional[float]:
+        """返回发出对冲请求前的等待时间；样本不足时返回 None"""
+        samples = list(self.latencies)[-config.window:]
+        if len(samples) < config.min_samples:
+            return None
+        return max(config.min_delay, float(np.percentile(samples, config.percentile)))
+
+    def _within_budget(self, config: HedgeConfig) -> bool:
+        return self.stats.hedged + 1 <= config.max_hedge_ratio * self.stats.requests
+
+    async def run(self, call: Callable[[str], Awaitable[T]], config: HedgeConfig) -> T:
+        """
+        执行一次（可能被对冲的）请求
+
+        Args:
+            call: 以模型名为参数发起请求的协程函数
+            config: 对冲配置
+
+        Returns:
+            先成功返回的结果；两个请求都失败时抛出原请求的异常
+        """
+        self.stats.requests += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(call(self.model))
+
+        try:
+            # map 阶段的请求几乎同时发出，开始时往往还没有足够的延迟样本；
+            # 等待期间其他请求陆续完成，因此样本不足时每隔 min_delay 重新计算一次对冲时机
+            while True:
+                delay = self.hedge_delay(config)
+                if delay is None:
+                    wait = max(config.min_delay, 1.0)
+                else:
+                    wait = delay - (time.monotonic() - start)
+                if wait > 0:
+                    done, _ = await asyncio.wait({primary}, timeout=wait)
+                    if done:
+                        result = await primary
+                        self.record(time.monotonic() - start)
+                        return result
+                if delay is not None and time.monotonic() - start >= delay:
+                    break
+
+            if not self._within_budget(config):
+                self.stats.skipped_by_budget += 1
+                result = await primary
+                self.record(time.monotonic() - start)
+                return result
+
+            self.stats.hedged += 1
+            hedge_model = config.alternate_model or self.model
+            logger.info(f"Hedging request to {self.model} after {delay:.1f}s with {hedge_model}")
+            hedge = asyncio.ensure_future(call(hedge_model))
+            return await self._race(primary, hedge, start)
+        except BaseException:
+            primary.cancel()
+            raise
+
+    async def _race(self, primary: asyncio.Future, hedge: asyncio.Future, start: float):
+        pending = {primary, hedge}
+        first_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if task is primary or first_error is None:
+                            first_error = task.exception()
+                        continue
+                    if task is primary:
+                        self.stats.primary_wins += 1
+                    else:
+                        self.stats.hedge_wins += 1
+                    # 对冲胜出时记录的是原请求耗时的下限，慢请求仍会抬高分位数
+                    self.record(time.monotonic() - start)
+                    return task.result()
+            self.stats.failures += 1
+            raise first_error
+        finally:
+            # 输掉的请求直接取消，连接随之释放
+            for task in pending:
+                task.cancel()
+
+
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(model: str) -> Hedger:
+    """返回模型对应的对冲执行器（延迟样本在进程内跨任务累积）"""
+    hedger = _hedgers.get(model)
+    if hedger is None:
+        with _hedgers_lock:
+            hedger = _hedgers.setdefault(model, Hedger(model))
+    return hedger
+
+
+def hedge_stats() -> Dict[str, dict]:
+    return {model: hedger.stats.as_dict() for model, hedger in list(_hedgers.items())}
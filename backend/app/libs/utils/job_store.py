@@ -0,0 +1,255 @@
+import asyncio
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from ..prompt.prompt import PROMPT_VERSION
+from .completion_cache import default_cache_path, replay_stream
+
+logger = logging.getLogger(__name__)
+
+# 检查点所属的阶段；汇总轮次记为 "reduce:<轮次>"
+STAGE_MAP = "map"
+STAGE_FINAL = "final"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+
+
+@dataclass
+class JobStoreConfig:
+    """
+    任务检查点存储配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        enabled: 是否保存检查点（LLM_JOB_STORE_ENABLED）
+        path: SQLite 数据库文件路径（LLM_JOB_STORE_PATH）
+        max_age: 任务最后一次更新后保留的秒数，过期的任务与检查点在打开数据库时清理（LLM_JOB_MAX_AGE）
+    """
+    enabled: bool = True
+    path: str = field(default_factory=lambda: default_cache_path("jobs.sqlite3"))
+    max_age: float = 3 * 24 * 3600
+
+    @classmethod
+    def from_env(cls) -> "JobStoreConfig":
+        return cls(
+            enabled=os.environ.get("LLM_JOB_STORE_ENABLED", "true").lower() not in ("0", "false", "no"),
+            path=os.environ.get("LLM_JOB_STORE_PATH") or default_cache_path("jobs.sqlite3"),
+            max_age=float(os.environ.get("LLM_JOB_MAX_AGE", cls.max_age)),
+        )
+
+
+def job_id_for(*parts) -> str:
+    """由任务输入（聊天记录摘要、文档类型、分段参数等）计算默认任务 ID，输入相同的重复任务复用检查点"""
+    h = hashlib.sha256(PROMPT_VERSION.encode('utf-8'))
+    for part in parts:
+        h.update(b'\0' + str(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+def unit_hash(prompt: str) -> str:
+    """工作单元的输入哈希：完整 prompt 加提示词版本号，与模型无关"""
+    h = hashlib.sha256(PROMPT_VERSION.encode('utf-8'))
+    h.update(prompt.replace('\r\n', '\n').strip().encode('utf-8'))
+    return h.hexdigest()
+
+
+class JobStore:
+    """
+    基于 SQLite 的 map-reduce 任务检查点
+
+    每完成一个 map 片段、一个汇总分组或最终文档，就以 (任务 ID, 输入哈希) 为键保存结果。
+    任务重启或重复提交时，输入相同的单元直接取回结果，只重新处理未完成的部分。
+    按输入哈希而不是序号匹配，因此分段方式变化（例如并发上限不同导致片段数不同）时
+    也不会取错结果，只是命中的单元变少。
+    """
+
+    def __init__(self, config: Optional[JobStoreConfig] = None):
+        self.config = config or JobStoreConfig.from_env()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.saved = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.config.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.config.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " doc_type TEXT,"
+                " status TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                " job_id TEXT NOT NULL,"
+                " unit TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " idx INTEGER NOT NULL,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (job_id, unit))"
+            )
+            self._conn = conn
+            self._purge(conn, time.time())
+        return self._conn
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = [row[0] for row in conn.execute(
+            "SELECT job_id FROM jobs WHERE updated_at < ?", (now - self.config.max_age,)
+        )]
+        if expired:
+            conn.executemany("DELETE FROM checkpoints WHERE job_id = ?", [(job_id,) for job_id in expired])
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+            logger.info(f"Purged {len(expired)} expired jobs")
+
+    def start(self, job_id: str, doc_type: Optional[str] = None) -> int:
+        """
+        登记任务开始（或重新开始）
+
+        Returns:
+            int: 已保存的检查点数量，大于 0 表示这是一次恢复
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO jobs (job_id, doc_type, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(job_id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (job_id, doc_type, STATUS_RUNNING, now, now),
+            )
+            return conn.execute("SELECT COUNT(*) FROM checkpoints WHERE job_id = ?", (job_id,)).fetchone()[0]
+
+    def finish(self, job_id: str, status: str = STATUS_DONE) -> None:
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id)
+            )
+
+    def get(self, job_id: str, prompt: str) -> Optional[str]:
+        """取回输入为 prompt 的单元结果，没有时返回 None"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT content FROM checkpoints WHERE job_id = ? AND unit = ?", (job_id, unit_hash(prompt))
+            ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, job_id: str, stage: str, index: int, prompt: str, content: str) -> None:
+        """保存一个单元的结果"""
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (job_id, unit, stage, idx, content, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, unit_hash(prompt), stage, index, content, now),
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+            self.saved += 1
+
+    def progress(self, job_id: str) -> Optional[dict]:
+        """
+        任务状态与各阶段已完成的单元数
+
+        Returns:
+            Optional[dict]: {"status": str, "stages": {stage: count}}，任务不存在时返回 None
+        """
+        with self._lock:
+            conn = self._connection()
+            job = conn.execute("SELECT status, updated_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            stages: Dict[str, int] = dict(conn.execute(
+                "SELECT stage, COUNT(*) FROM checkpoints WHERE job_id = ? GROUP BY stage", (job_id,)
+            ).fetchall())
+        return {"status": job[0], "updated_at": job[1], "stages": stages}
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM checkpoints WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.config.enabled,
+            "hits": self.hits,
+            "saved": self.saved,
+        }
+
+
+class JobCheckpoint:
+    """
+    绑定到某个任务和阶段的检查点句柄，传给 map / 汇总函数使用
+
+    异步方法把数据库读写放到线程池中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, store: JobStore, job_id: str, stage: str):
+        self.store = store
+        self.job_id = job_id
+        self.stage = stage
+
+    def for_stage(self, stage: str) -> "JobCheckpoint":
+        return JobCheckpoint(self.store, self.job_id, stage)
+
+    async def aget(self, prompt: str) -> Optional[str]:
+        return await asyncio.to_thread(self.store.get, self.job_id, prompt)
+
+    async def aput(self, index: int, prompt: str, content: str) -> None:
+        await asyncio.to_thread(self.store.put, self.job_id, self.stage, index, prompt, content)
+
+    async def stream(self, prompt: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        最终文档的流式输出：已保存时直接回放，否则转发 factory() 的输出，完整结束后保存并标记任务完成
+
+        Args:
+            prompt: 最终汇总的 prompt
+            factory: 返回上游流的函数，只在没有保存结果时调用
+        """
+        saved = await self.aget(prompt)
+        if saved is not None:
+            logger.info(f"Job {self.job_id[:12]} already finished, replaying saved document")
+            async for chunk in replay_stream({"content": saved}):
+                yield chunk
+            return
+        chunks = []
+        async for chunk in factory():
+            chunks.append(chunk)
+            yield chunk
+        await self.aput(0, prompt, ''.join(chunks))
+        await asyncio.to_thread(self.store.finish, self.job_id)
+
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """返回进程级共享的任务检查点存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = JobStore()
+    return _store
@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+from dataclasses import dataclass, replace
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 生成模拟回复使用的词表，每个词按一个 token 计
+VOCABULARY = (
+    "群聊", "讨论", "总结", "成员", "问题", "方案", "建议", "结论", "数据", "模型",
+    "部署", "测试", "需求", "时间", "文档", "接口", "性能", "版本", "计划", "反馈",
+)
+
+
+@dataclass
+class MockProfile:
+    """
+    模拟服务端的延迟与故障配置
+
+    Attributes:
+        ttft: 首个 token 的平均等待秒数
+        ttft_sigma: 首 token 延迟的对数正态分布 sigma，0 表示固定延迟
+        tokens_per_second: 输出速度
+        output_ratio: 输出 token 数相对 prompt token 数的比例
+        min_output_tokens: 输出 token 数下限
+        max_output_tokens: 输出 token 数上限
+        chunk_tokens: 流式输出时每个片段包含的 token 数
+        rate_limit_rate: 返回 429 的概率
+        retry_after: 429 响应的 Retry-After 秒数
+        error_rate: 返回 503 的概率
+        timeout_rate: 请求挂起不返回的概率（用于触发客户端超时）
+        hang_seconds: 挂起请求的持续秒数
+        seed: 故障与延迟抽样的随机种子；回复内容只由 prompt 决定
+    """
+    ttft: float = 0.5
+    ttft_sigma: float = 0.3
+    tokens_per_second: float = 200.0
+    output_ratio: float = 0.2
+    min_output_tokens: int = 16
+    max_output_tokens: int = 2048
+    chunk_tokens: int = 4
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 600.0
+    seed: int = 0
+
+
+PROFILES: Dict[str, MockProfile] = {
+    # 不等待，只测管线本身的开销
+    "instant": MockProfile(ttft=0.0, ttft_sigma=0.0, tokens_per_second=0.0),
+    "fast": MockProfile(ttft=0.2, ttft_sigma=0.2, tokens_per_second=500.0),
+    # 接近 OpenRouter 上 gemini-flash 一类模型的表现
+    "realistic": MockProfile(ttft=0.8, ttft_sigma=0.5, tokens_per_second=150.0),
+    # 长尾明显，用于评估对冲请求
+    "long_tail": MockProfile(ttft=0.8, ttft_sigma=1.2, tokens_per_second=150.0),
+    # 带 429、503 和超时，用于评估限流、熔断与故障切换
+    "flaky": MockProfile(ttft=0.5, ttft_sigma=0.5, tokens_per_second=200.0,
+                         rate_limit_rate=0.05, error_rate=0.05, timeout_rate=0.01, hang_seconds=30.0),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """按字符数粗略估算 token 数：CJK 字符每个约 1 token，其他字符约 4 个 1 token"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return max(1, cjk + (len(text) - cjk) // 4)
+
+
+def mock_completion(messages: List[dict], profile: MockProfile) -> Tuple[List[str], int]:
+    """
+    根据 prompt 生成确定性的模拟回复
+
+    Returns:
+        Tuple[List[str], int]: 回复的 token 列表，以及 prompt 的 token 数
+    """
+    prompt = "\n".join(m.get("content") or "" for m in messages if isinstance(m.get("content"), str))
+    prompt_tokens = estimate_tokens(prompt)
+    output_tokens = int(min(profile.max_output_tokens,
+                            max(profile.min_output_tokens, prompt_tokens * profile.output_ratio)))
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    rng = random.Random(digest)
+    tokens = [f"[mock {digest[:8]}] "]
+    tokens.extend(rng.choice(VOCABULARY) for _ in range(output_tokens - 1))
+    return tokens, prompt_tokens
+
+
+class MockLLMServer:
+    """
+    本地运行的 OpenAI 兼容模拟服务（POST /v1/chat/completions，支持 stream）
+
+    回复内容由 prompt 决定，长度按 prompt 长度缩放；延迟、429、503 和超时按 MockProfile 抽样。
+    设置环境变量 LLM_MOCK_BASE 为 base_url 后，所有模型的请求都会发到这里，
+    不消耗真实配额，也不需要网络。
+
+    可以用 start() 在后台线程中运行（测试、压测脚本），也可以用
+    python -m app.libs.utils.mock_llm 单独启动。
+    """
+
+    def __init__(self, profile: Optional[MockProfile] = None, host: str = '127.0.0.1', port: int = 0):
+        self.profile = profile or PROFILES["realistic"]
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.stats: Dict[str, int] = {
+            "requests": 0, "streams": 0, "rate_limited": 0, "errors": 0, "timeouts": 0, "completion_tokens": 0,
+        }
+        self._rng = random.Random(self.profile.seed)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _ttft(self) -> float:
+        profile = self.profile
+        if profile.ttft_sigma <= 0:
+            return profile.ttft
+        # 对数正态分布，均值保持为 ttft
+        sigma = profile.ttft_sigma
+        return profile.ttft * math.exp(self._rng.gauss(0.0, sigma) - sigma * sigma / 2)
+
+    def _token_delay(self, tokens: int) -> float:
+        if self.profile.tokens_per_second <= 0:
+            return 0.0
+        return tokens / self.profile.tokens_per_second
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method, path, _ = request_line.split(' ', 2)
+                if method != 'POST' or not path.rstrip('/').endswith('/chat/completions'):
+                    await self._send_json(writer, 404, {"error": {"message": f"Unknown endpoint {path}"}})
+                    continue
+                await self._complete(writer, json.loads(body or b'{}'))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict,
+                         extra_headers: str = '') -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests', 503: 'Service Unavailable'}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n{extra_headers}"
+            f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+        )
+        await writer.drain()
+
+    async def _complete(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        profile = self.profile
+        self.stats["requests"] += 1
+        roll = self._rng.random()
+        if roll < profile.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            await self._send_json(writer, 429, {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit"}},
+                                  f"Retry-After: {profile.retry_after:g}\r\n")
+            return
+        roll -= profile.rate_limit_rate
+        if roll < profile.error_rate:
+            self.stats["errors"] += 1
+            await self._send_json(writer, 503, {"error": {"message": "Service unavailable (mock)"}})
+            return
+        roll -= profile.error_rate
+        if roll < profile.timeout_rate:
+            self.stats["timeouts"] += 1
+            await asyncio.sleep(profile.hang_seconds)
+            raise ConnectionResetError("mock timeout")
+
+        model = request.get("model", "mock")
+        tokens, prompt_tokens = mock_completion(request.get("messages", []), profile)
+        self.stats["completion_tokens"] += len(tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+
+        await asyncio.sleep(self._ttft())
+        if not request.get("stream"):
+            await asyncio.sleep(self._token_delay(len(tokens)))
+            await self._send_json(writer, 200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ''.join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.stats["streams"] += 1
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        def event(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            payload = json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }, ensure_ascii=False)
+            data = f"data: {payload}\n\n".encode('utf-8')
+            return f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n"
+
+        step = max(1, profile.chunk_tokens)
+        for i in range(0, len(tokens), step):
+            if i:
+                await asyncio.sleep(self._token_delay(step))
+            writer.write(event({"content": ''.join(tokens[i:i + step])}))
+            await writer.drain()
+        writer.write(event({}, "stop"))
+        done = b"data: [DONE]\n\n"
+        writer.write(f"{len(done):x}\r\n".encode('latin-1') + done + b"\r\n0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self) -> None:
+        """在当前事件循环中运行，直到被取消"""
+        server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        logger.info(f"Mock LLM server listening on {self.base_url}")
+        async with server:
+            await server.serve_forever()
+
+    def start(self) -> str:
+        """在后台线程中启动，返回 base_url"""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self.serve())
+            except asyncio.CancelledError:
+                pass
+
+        threading.Thread(target=run, daemon=True).start()
+        self._ready.wait()
+        return self.base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动 OpenAI 兼容的模拟 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="延迟与故障配置")
+    parser.add_argument("--ttft", type=float, help="覆盖首 token 平均延迟（秒）")
+    parser.add_argument("--tps", type=float, help="覆盖输出速度（token/秒）")
+    parser.add_argument("--error-rate", type=float, help="覆盖 503 概率")
+    parser.add_argument("--rate-limit-rate", type=float, help="覆盖 429 概率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    overrides = {"seed": args.seed}
+    for name, value in (("ttft", args.ttft), ("tokens_per_second", args.tps),
+                        ("error_rate", args.error_rate), ("rate_limit_rate", args.rate_limit_rate)):
+        if value is not None:
+            overrides[name] = value
+    server = MockLLMServer(replace(PROFILES[args.profile], **overrides), args.host, args.port)
+    logging.basicConfig(level=logging.INFO)
+    print(f"export LLM_MOCK_BASE={server.base_url}")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
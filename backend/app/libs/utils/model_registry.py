@@ -0,0 +1,266 @@
+from dataclasses import dataclass
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .circuit_breaker import get_circuit_breaker
+from .client_pool import provider_name, resolve_provider
+
+logger = logging.getLogger(__name__)
+
+# 文档生成与聊天的各个阶段
+STAGE_MAP = "map"          # 分段生成部分文档
+STAGE_REDUCE = "reduce"    # 汇总部分文档、生成最终文档
+STAGE_CHAT = "chat"        # 流式聊天、月度总结
+STAGE_QUICK = "quick"      # 非流式聊天、文档转 HTML 等轻量请求
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    模型的静态信息
+
+    Attributes:
+        name: 请求时使用的模型名
+        context_window: 上下文窗口（token）
+        max_output_tokens: 为输出预留的 token 数，与 prompt 一起不能超过上下文窗口
+        input_cost: 每百万输入 token 的价格（美元）
+        output_cost: 每百万输出 token 的价格（美元）
+    """
+    name: str
+    context_window: int
+    max_output_tokens: int = 8192
+    input_cost: float = 0.0
+    output_cost: float = 0.0
+
+    @property
+    def provider(self) -> str:
+        return provider_name(self.name)
+
+    def fits(self, prompt_tokens: int) -> bool:
+        return prompt_tokens + self.max_output_tokens <= self.context_window
+
+
+@dataclass
+class StageRoute:
+    """
+    某个阶段可用的模型
+
+    Attributes:
+        primary: 质量满足该阶段要求的模型，路由时在其中选最快的
+        fallback: 所有主模型都不可用时才使用的备用模型
+    """
+    primary: Tuple[str, ...]
+    fallback: Tuple[str, ...] = ()
+
+
+@dataclass
+class ModelHealth:
+    """
+    模型的实时健康状况：延迟和错误率都用指数加权移动平均（EWMA）
+
+    连续失败达到 max_consecutive_failures 或错误率超过 max_error_rate 后进入冷却期，
+    冷却期内排在健康模型之后；冷却期结束后重新参与路由，成功后逐步恢复。
+    """
+    alpha: float = 0.2
+    max_error_rate: float = 0.5
+    max_consecutive_failures: int = 3
+    cooldown: float = 30.0
+    latency: Optional[float] = None
+    error_rate: float = 0.0
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    last_failure: float = 0.0
+
+    def record_success(self, latency: float) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+        self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = time.monotonic()
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha
+
+    @property
+    def healthy(self) -> bool:
+        degraded = (self.consecutive_failures >= self.max_consecutive_failures
+                    or self.error_rate > self.max_error_rate)
+        # 冷却期已过时允许重新探测，探测失败会重新计时
+        return not degraded or time.monotonic() - self.last_failure >= self.cooldown
+
+    def as_dict(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+DEFAULT_MODELS: Tuple[ModelSpec, ...] = (
+    ModelSpec("google/gemini-2.0-flash-001", context_window=1_048_576, max_output_tokens=8192,
+              input_cost=0.10, output_cost=0.40),
+    ModelSpec("deepseek-reasoner", context_window=65_536, max_output_tokens=8192,
+              input_cost=0.55, output_cost=2.19),
+    ModelSpec("deepseek/deepseek-r1", context_window=163_840, max_output_tokens=8192,
+              input_cost=0.55, output_cost=2.19),
+    ModelSpec("deepseek/deepseek-r1-distill-llama-70b", context_window=131_072, max_output_tokens=8192,
+              input_cost=0.10, output_cost=0.40),
+)
+
+# 各阶段的默认路由，可通过 LLM_ROUTE_<STAGE>=模型1,模型2 覆盖主模型列表
+DEFAULT_ROUTES: Dict[str, StageRoute] = {
+    STAGE_MAP: StageRoute(
+        primary=("google/gemini-2.0-flash-001",),
+        fallback=("deepseek/deepseek-r1-distill-llama-70b",),
+    ),
+    STAGE_REDUCE: StageRoute(
+        primary=("deepseek-reasoner", "deepseek/deepseek-r1"),
+        fallback=("google/gemini-2.0-flash-001",),
+    ),
+    STAGE_CHAT: StageRoute(
+        primary=("deepseek/deepseek-r1-distill-llama-70b",),
+        fallback=("google/gemini-2.0-flash-001",),
+    ),
+    STAGE_QUICK: StageRoute(
+        primary=("google/gemini-2.0-flash-001",),
+        fallback=("deepseek/deepseek-r1-distill-llama-70b",),
+    ),
+}
+
+
+def _provider_configured(model: str) -> bool:
+    try:
+        resolve_provider(model)
+    except ValueError:
+        return False
+    return True
+
+
+class ModelRegistry:
+    """
+    模型注册表与按延迟选择模型的路由器
+
+    - 保存每个模型的上下文窗口、服务商和价格
+    - ai_chat_async / ai_chat_stream_async 在每次请求后回报延迟与成败
+    - route() 返回某个阶段按优先级排好的候选模型：健康的主模型按 EWMA 延迟从快到慢，
+      然后是健康的备用模型，最后是不健康的模型（全部不可用时仍然尝试）
+    """
+
+    def __init__(self, models: Tuple[ModelSpec, ...] = DEFAULT_MODELS,
+                 routes: Optional[Dict[str, StageRoute]] = None):
+        self._specs: Dict[str, ModelSpec] = {spec.name: spec for spec in models}
+        self._health: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+        self.routes: Dict[str, StageRoute] = dict(routes or DEFAULT_ROUTES)
+        for stage, route in list(self.routes.items()):
+            value = os.environ.get(f"LLM_ROUTE_{stage.upper()}")
+            if value:
+                self.routes[stage] = StageRoute(
+                    primary=tuple(name.strip() for name in value.split(',') if name.strip()),
+                    fallback=route.fallback,
+                )
+
+    def register(self, spec: ModelSpec) -> None:
+        with self._lock:
+            self._specs[spec.name] = spec
+
+    def spec(self, model: str) -> ModelSpec:
+        """返回模型信息；未登记的模型按 128k 上下文处理"""
+        spec = self._specs.get(model)
+        return spec if spec is not None else ModelSpec(model, context_window=131_072)
+
+    def health(self, model: str) -> ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            with self._lock:
+                health = self._health.setdefault(model, ModelHealth())
+        return health
+
+    def record_success(self, model: str, latency: float) -> None:
+        self.health(model).record_success(latency)
+
+    def record_failure(self, model: str) -> None:
+        health = self.health(model)
+        health.record_failure()
+        if not health.healthy:
+            logger.warning(
+                f"Model {model} marked unhealthy (error rate {health.error_rate:.2f}, "
+                f"{health.consecutive_failures} consecutive failures)"
+            )
+
+    def route(self, stage: str, prompt_tokens: int = 0, preferred: Optional[str] = None) -> List[str]:
+        """
+        返回某个阶段的候选模型，按尝试顺序排列
+
+        Args:
+            stage: 阶段名（STAGE_MAP / STAGE_REDUCE / STAGE_CHAT / STAGE_QUICK）
+            prompt_tokens: prompt 的 token 数，上下文窗口放不下的模型会被排除
+            preferred: 调用方指定的模型；健康时排在最前面
+
+        Returns:
+            List[str]: 候选模型名，至少包含一个
+        """
+        route = self.routes.get(stage) or self.routes[STAGE_QUICK]
+
+        def eligible(names) -> List[str]:
+            return [
+                name for name in names
+                if self.spec(name).fits(prompt_tokens) and _provider_configured(name)
+            ]
+
+        def by_latency(names: List[str]) -> List[str]:
+            # 还没有延迟样本的模型排在前面，先探测一次
+            return sorted(names, key=lambda name: self.health(name).latency or 0.0)
+
+        def is_healthy(name: str) -> bool:
+            # 熔断打开的模型放到最后，请求会被熔断器直接拒绝并切换到下一个
+            return self.health(name).healthy and get_circuit_breaker(name).available
+
+        primary = eligible(route.primary)
+        fallback = [name for name in eligible(route.fallback) if name not in primary]
+        healthy = by_latency([name for name in primary if is_healthy(name)]) \
+            + by_latency([name for name in fallback if is_healthy(name)])
+        unhealthy = [name for name in primary + fallback if name not in healthy]
+
+        candidates = healthy + unhealthy
+        if preferred:
+            if preferred in candidates:
+                candidates.remove(preferred)
+            if is_healthy(preferred):
+                candidates.insert(0, preferred)
+            else:
+                candidates.append(preferred)
+        if not candidates:
+            # 没有任何模型满足约束时仍返回主模型，由请求本身报错
+            candidates = list(route.primary[:1])
+        return candidates
+
+    def stats(self) -> Dict[str, dict]:
+        result = {}
+        for name, health in list(self._health.items()):
+            spec = self.spec(name)
+            result[name] = {"provider": spec.provider, "context_window": spec.context_window, **health.as_dict()}
+        return result
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """返回进程级共享的模型注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
@@ -0,0 +1,248 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from aiolimiter import AsyncLimiter
+
+from .client_pool import resolve_provider
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LimitConfig:
+    """
+    单个服务商/模型的限流配置
+
+    Attributes:
+        rpm: 每分钟请求数上限
+        tpm: 每分钟 token 数上限（按请求前的估算值扣减）
+        initial_concurrency: 初始并发数
+        min_concurrency: 并发数下限
+        max_concurrency: 并发数上限
+        latency_factor: 单次延迟超过平均延迟的这个倍数时视为拥塞信号
+        completion_tokens: 每次请求预留的输出 token 数，计入 TPM 估算
+    """
+    rpm: float = 500
+    tpm: float = 1_000_000
+    initial_concurrency: int = 10
+    min_concurrency: int = 1
+    max_concurrency: int = 64
+    latency_factor: float = 3.0
+    completion_tokens: int = 1024
+
+
+# 各服务商的默认配额，可通过 LLM_LIMIT_<PROVIDER>_RPM / _TPM / _CONCURRENCY / _MAX_CONCURRENCY 覆盖
+DEFAULT_LIMITS: Dict[str, LimitConfig] = {
+    "openrouter": LimitConfig(rpm=600, tpm=2_000_000, initial_concurrency=20),
+    "deepseek": LimitConfig(rpm=300, tpm=1_000_000, initial_concurrency=10),
+    "openai": LimitConfig(rpm=500, tpm=200_000, initial_concurrency=10),
+}
+
+
+def limit_config_for(provider: str) -> LimitConfig:
+    config = DEFAULT_LIMITS.get(provider, LimitConfig())
+    prefix = f"LLM_LIMIT_{provider.upper()}_"
+    overrides = {}
+    for name, field, cast in (
+        ("RPM", "rpm", float),
+        ("TPM", "tpm", float),
+        ("CONCURRENCY", "initial_concurrency", int),
+        ("MAX_CONCURRENCY", "max_concurrency", int),
+    ):
+        value = os.environ.get(prefix + name)
+        if value:
+            overrides[field] = cast(value)
+    return replace(config, **overrides)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 并发控制：成功时加性增大，遇到 429 时减半，延迟明显变长时小幅回退
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_factor: float):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.avg_latency: Optional[float] = None
+        self.samples = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    async def acquire(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self, latency: Optional[float] = None) -> None:
+        if latency is not None:
+            self.samples += 1
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            else:
+                # 延迟明显高于均值说明服务端开始排队，乘性回退
+                if self.samples > 10 and latency > self.avg_latency * self.latency_factor:
+                    self.limit = max(self.minimum, self.limit * 0.9)
+                    self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+                    return
+                self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+        # 加性增大：每个"窗口"（约 limit 次成功）增加 1
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_rate_limited(self) -> None:
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class RateLimiter:
+    """
+    单个服务商/模型的限流器
+
+    - RPM、TPM 两个漏桶（aiolimiter），TPM 按请求前估算的 token 数扣减
+    - 收到 429 时按 Retry-After 暂停该服务商/模型的所有请求
+    - AdaptiveConcurrency 按 429 与延迟信号自动调整并发数
+    """
+
+    def __init__(self, name: str, config: LimitConfig):
+        self.name = name
+        self.config = config
+        self.requests = AsyncLimiter(config.rpm, 60)
+        self.tokens = AsyncLimiter(config.tpm, 60)
+        self.concurrency = AdaptiveConcurrency(
+            config.initial_concurrency,
+            config.min_concurrency,
+            config.max_concurrency,
+            config.latency_factor,
+        )
+        self.blocked_until = 0.0
+        self.rate_limited = 0
+        self._consecutive_rate_limited = 0
+
+    @property
+    def concurrency_limit(self) -> int:
+        """当前的并发上限"""
+        return int(self.concurrency.limit)
+
+    async def _wait_unblocked(self) -> None:
+        while True:
+            delay = self.blocked_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0) -> AsyncIterator[None]:
+        """
+        获取一次请求的配额，退出时根据结果反馈给并发控制
+
+        Args:
+            estimated_tokens: 请求前估算的 prompt token 数
+        """
+        await self._wait_unblocked()
+        await self.concurrency.acquire()
+        try:
+            await self.requests.acquire(1)
+            amount = min(estimated_tokens + self.config.completion_tokens, self.config.tpm)
+            await self.tokens.acquire(amount)
+            # 排队期间可能收到了其他请求的 429
+            await self._wait_unblocked()
+            start = time.monotonic()
+            yield
+            self.concurrency.on_success(time.monotonic() - start)
+            self._consecutive_rate_limited = 0
+        finally:
+            await self.concurrency.release()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> float:
+        """
+        记录一次 429，暂停后续请求并减小并发
+
+        Returns:
+            float: 本次需要等待的秒数
+        """
+        self.rate_limited += 1
+        self._consecutive_rate_limited += 1
+        # 没有 Retry-After 时按连续 429 次数指数退避
+        delay = retry_after if retry_after is not None else min(60.0, 2.0 ** self._consecutive_rate_limited)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.concurrency.on_rate_limited()
+        logger.warning(
+            f"Rate limited by {self.name}, pausing {delay:.1f}s, concurrency -> {self.concurrency_limit}"
+        )
+        return delay
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": self.concurrency_limit,
+            "in_flight": self.concurrency.in_flight,
+            "avg_latency": self.concurrency.avg_latency,
+            "rate_limited": self.rate_limited,
+        }
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """从响应头中读取 Retry-After（秒）；也支持 retry-after-ms"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP 日期格式
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """返回模型对应的（服务商, 模型）限流器"""
+    provider = resolve_provider(model).name
+    key = (provider, model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = RateLimiter(f"{provider}/{model}", limit_config_for(provider))
+                _limiters[key] = limiter
+    return limiter
+
+
+def rate_limiter_stats() -> Dict[str, dict]:
+    return {limiter.name: limiter.stats() for limiter in list(_limiters.values())}
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from .broadcaster import Broadcaster
+from .cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发请求
+
+    - do(): 同一时刻相同 key 的调用只执行一次，其余调用等待同一个结果；
+      某个等待者被取消不影响其他等待者，全部取消后才取消底层任务
+    - stream(): 相同 key 的流式任务共享一次生成，由 Broadcaster 分发给每个订阅者
+    - streaming(): 查询流式任务是否正在进行，供只旁观、不启动任务的订阅者使用
+
+    任务结束后立即移除，之后的相同请求会重新执行（结果复用交给补全缓存）。
+    asyncio 对象与事件循环绑定，因此按事件循环分别记录。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], _Call] = {}
+        self._streams: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], Broadcaster] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.streams_started = 0
+        self.streams_joined = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行 fn，或等待正在执行的相同 key 的调用
+
+        Args:
+            key: 请求的唯一标识
+            fn: 实际发起请求的协程函数
+
+        Returns:
+            fn 的返回值
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        call = self._calls.get(flight_key)
+        if call is None:
+            call = _Call(loop.create_task(fn()))
+            self._calls[flight_key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, flight_key, call))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stream(self, key: Hashable, factory: Callable[[], Awaitable[AsyncIterator[str]]],
+               cancel_token: Optional[CancellationToken] = None) -> AsyncIterator[str]:
+        """
+        订阅相同 key 的流式任务；没有正在进行的任务时用 factory 启动一个
+
+        Args:
+            key: 任务的唯一标识
+            factory: 返回异步流的协程函数，例如 lambda: generate_doc_async(...)
+            cancel_token: factory 使用的取消令牌；只有本次调用启动了任务时才生效，
+                所有订阅者离开后被取消。加入已有任务时忽略（由该任务自己的令牌负责）
+
+        Returns:
+            AsyncIterator[str]: 本订阅者的输出流
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        shared = self._streams.get(flight_key)
+        if shared is None or shared.done:
+            shared = Broadcaster(factory, cancel_token=cancel_token)
+            self._streams[flight_key] = shared
+            shared.add_done_callback(lambda _: self._forget(self._streams, flight_key, shared))
+            self.streams_started += 1
+        else:
+            logger.info(f"Joining in-flight stream {key}")
+            self.streams_joined += 1
+        return shared.subscribe()
+
+    def streaming(self, key: Hashable) -> bool:
+        """是否有相同 key 的流式任务正在进行"""
+        shared = self._streams.get((asyncio.get_running_loop(), key))
+        return shared is not None and not shared.done
+
+    @staticmethod
+    def _forget(registry: dict, flight_key, value) -> None:
+        if registry.get(flight_key) is value:
+            del registry[flight_key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "streams_in_flight": len(self._streams),
+            "streams_started": self.streams_started,
+            "streams_joined": self.streams_joined,
+            "subscribers": sum(shared.subscribers for shared in list(self._streams.values())),
+            "dropped_subscribers": sum(shared.dropped for shared in list(self._streams.values())),
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """返回进程级共享的请求合并器"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
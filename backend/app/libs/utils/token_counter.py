@@ -0,0 +1,231 @@
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+DEFAULT_CACHE_SIZE = 65536
+
+# CJK 字符（汉字、全角标点等）在 cl100k_base 下通常每个字符占 1 个以上 token，
+# 其余字符（英文、数字、ASCII 标点）大约 4 个字符 1 个 token
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]')
+DEFAULT_TOKENS_PER_CJK_CHAR = 1.3
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# 校准快速估算用的固定样本：与导出格式一致的中英文聊天消息。
+# 样本固定，校准结果只取决于编码器，不取决于进程里先处理了哪份上传
+CALIBRATION_SAMPLE = (
+    "2023-05-11 19:33:39 张三 - 明天下午三点在会议室讨论一下方案，大家有时间吗？",
+    "2023-05-11 19:34:02 李四 - 收到",
+    "2023-05-11 19:35:17 王五 - 我可能要晚到十分钟，先把上次的会议纪要发群里了",
+    "2023-05-11 19:36:40 Alice - Sounds good, I'll bring the deployment checklist.",
+    "2023-05-11 19:40:05 赵六 - [图片]",
+    "2023-05-11 20:02:11 张三 - 这个问题我之前也遇到过，解决办法是先清理缓存再重新构建，然后重启服务。",
+    "2023-05-11 20:05:48 Bob - The build failed on CI again: `npm ERR! code ERESOLVE`, see https://example.com/ci/1234",
+    "2023-05-12 09:15:23 李四 - 早上好！今天的日报：1. 完成登录页改版 2. 修复导出乱码 3. 和产品对齐需求",
+    "2023-05-12 09:16:01 王五 - 👍👍",
+    "2023-05-12 10:30:44 Alice - Can someone review PR #42 before lunch? It touches the payment module.",
+    "2023-05-12 10:31:30 赵六 - 我来看，顺便问一下 v2.3.1 的发布时间定了吗？",
+    "2023-05-12 14:20:09 张三 - 定在周五晚上八点，发布前一小时冻结代码，有问题在群里@我",
+    "2023-05-12 14:22:56 Bob - OK. I'll update the release notes and ping QA.",
+    "2023-05-13 21:47:12 李四 - 周末有人去爬山吗？天气预报说周日晴，气温 18~25℃",
+    "2023-05-13 21:50:38 王五 - 去！早上七点地铁站集合？",
+)
+
+
+class TokenCounter:
+    """
+    常驻内存的 token 计数服务
+
+    - 编码器只加载一次
+    - 批量计数走 encode_ordinary_batch（tiktoken 内部多线程）
+    - 按内容哈希缓存计数结果，LRU 淘汰
+    - 提供按字符类别校准的快速估算，用于预算检查
+    """
+
+    def __init__(self,
+                 encoding_name: str = DEFAULT_ENCODING,
+                 cache_size: int = DEFAULT_CACHE_SIZE,
+                 tokens_per_cjk_char: float = DEFAULT_TOKENS_PER_CJK_CHAR,
+                 chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        self.encoding_name = encoding_name
+        self.cache_size = cache_size
+        self.tokens_per_cjk_char = tokens_per_cjk_char
+        self.chars_per_token = chars_per_token
+        self.calibrated = False
+        self._encoding = None
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+    def _get_cached(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._cache.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def _put_cached(self, key: bytes, count: int) -> None:
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        """精确计算单个文本的 token 数"""
+        key = self._key(text)
+        count = self._get_cached(key)
+        if count is None:
+            count = len(self.encoding.encode_ordinary(text))
+            self._put_cached(key, count)
+        return count
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断到最多 max_tokens 个 token；未超出时原样返回"""
+        if self.count(text) <= max_tokens:
+            return text
+        return self.encoding.decode(self.encoding.encode_ordinary(text)[:max_tokens])
+
+    def count_batch(self, texts: Iterable[str], num_threads: int = 8) -> List[int]:
+        """
+        批量精确计算 token 数，未命中缓存的文本一次性交给 encode_ordinary_batch
+
+        Args:
+            texts: 文本列表
+            num_threads: tiktoken 批量编码使用的线程数
+
+        Returns:
+            List[int]: 与输入顺序一致的 token 数列表
+        """
+        texts = list(texts)
+        counts: List[Optional[int]] = [None] * len(texts)
+        missing: Dict[bytes, List[int]] = {}
+
+        for i, text in enumerate(texts):
+            key = self._key(text)
+            count = self._get_cached(key)
+            if count is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                counts[i] = count
+
+        if missing:
+            keys = list(missing)
+            encoded = self.encoding.encode_ordinary_batch(
+                [texts[missing[key][0]] for key in keys],
+                num_threads=num_threads
+            )
+            for key, tokens in zip(keys, encoded):
+                self._put_cached(key, len(tokens))
+                for i in missing[key]:
+                    counts[i] = len(tokens)
+
+        return counts
+
+    def estimate(self, text: str) -> int:
+        """
+        不做编码的快速估算，CJK 字符与其他字符分开计费
+
+        Args:
+            text: 文本
+
+        Returns:
+            int: 估算的 token 数（向上取整）
+        """
+        cjk_chars = len(CJK_PATTERN.findall(text))
+        other_chars = len(text) - cjk_chars
+        return int(cjk_chars * self.tokens_per_cjk_char + other_chars / self.chars_per_token + 0.999)
+
+    def calibrate(self, samples: Iterable[str], counts: Optional[Iterable[int]] = None) -> Tuple[float, float]:
+        """
+        用样本文本的精确 token 数拟合估算系数（最小二乘，无截距）
+
+        Args:
+            samples: 有代表性的样本文本
+            counts: 与 samples 一一对应的已知精确 token 数；为空时重新计数
+
+        Returns:
+            Tuple[float, float]: (每个 CJK 字符的 token 数, 每个 token 的其他字符数)
+        """
+        samples = list(samples)
+        counts = self.count_batch(samples) if counts is None else list(counts)
+        pairs = [(text, tokens) for text, tokens in zip(samples, counts) if text]
+        if not pairs:
+            return self.tokens_per_cjk_char, self.chars_per_token
+
+        sxx = sxy = syy = sxt = syt = 0.0
+        for text, tokens in pairs:
+            x = len(CJK_PATTERN.findall(text))
+            y = len(text) - x
+            sxx += x * x
+            sxy += x * y
+            syy += y * y
+            sxt += x * tokens
+            syt += y * tokens
+
+        det = sxx * syy - sxy * sxy
+        if det:
+            cjk_rate = (sxt * syy - syt * sxy) / det
+            other_rate = (syt * sxx - sxt * sxy) / det
+        elif sxx:
+            cjk_rate, other_rate = sxt / sxx, 1 / self.chars_per_token
+        else:
+            cjk_rate, other_rate = self.tokens_per_cjk_char, syt / syy
+
+        if cjk_rate > 0:
+            self.tokens_per_cjk_char = cjk_rate
+        if other_rate > 0:
+            self.chars_per_token = 1 / other_rate
+        self.calibrated = True
+        return self.tokens_per_cjk_char, self.chars_per_token
+
+    def cache_info(self) -> Dict[str, int]:
+        """返回缓存命中统计"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "max_size": self.cache_size,
+            }
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> TokenCounter:
+    """返回进程内共享的 TokenCounter（每种编码一个）"""
+    counter = _counters.get(encoding_name)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(encoding_name, TokenCounter(encoding_name))
+    return counter
+
+
+def calibrate_token_estimate(encoding_name: str = DEFAULT_ENCODING) -> Tuple[float, float]:
+    """
+    用固定样本 CALIBRATION_SAMPLE 校准共享计数器的快速估算系数，进程启动时调用一次
+
+    Returns:
+        Tuple[float, float]: (每个 CJK 字符的 token 数, 每个 token 的其他字符数)
+    """
+    return get_token_counter(encoding_name).calibrate(CALIBRATION_SAMPLE)
@@ -22,6 +22,14 @@ class OutputDocumentStatus(str, PyEnum):
     PROCESSING = 'processing'
     COMPLETED = 'completed'
     FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+class GenerationJobStatus(str, PyEnum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
 
 # 项目模型
 class Project(SQLModel, table=True):
@@ -110,4 +118,37 @@ class OutputDocument(SQLModel, table=True):
             'progress': self.progress,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
+        } 
+
+# 文档生成任务（后台任务队列）
+class GenerationJob(SQLModel, table=True):
+    __tablename__ = 'generation_jobs'
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    project_id: str = Field(foreign_key="projects.id", index=True)
+    output_document_id: str = Field(foreign_key="output_documents.id")
+    doc_type: str = Field(max_length=100)
+    model: Optional[str] = Field(default=None, max_length=200)
+    status: str = Field(default=GenerationJobStatus.QUEUED, max_length=20, index=True)
+    attempts: int = Field(default=0)
+    error: Optional[str] = Field(default=None)
+    worker_id: Optional[str] = Field(default=None, max_length=100)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = Field(default=None)
+    heartbeat_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'output_document_id': self.output_document_id,
+            'doc_type': self.doc_type,
+            'model': self.model,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -1,7 +1,7 @@
 import logging
 import os
-import re
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Dict, List, Optional
 from concurrent.futures import Future, ThreadPoolExecutor
 from sqlalchemy.orm import Session
@@ -9,10 +9,34 @@ from fastapi import BackgroundTasks, UploadFile, HTTPException
 
 from app.models.project import InputDocument, OutputDocument, Project
 from app.utils.file_handler import FileHandler
-from app.libs.preprocessing.reader import read_file
+from app.libs.preprocessing.reader import map_message_table, read_file
+from app.libs.preprocessing.message_table import MessageTable
+from app.libs.preprocessing.message_index import load_message_index, write_message_index
 
 logger = logging.getLogger(__name__)
 
+
+@lru_cache(maxsize=2)
+def _load_message_table(file_path: str, mtime: float, size: int) -> MessageTable:
+    """Load an input file's message index once; mtime/size are part of the key so re-uploads invalidate it"""
+    try:
+        table = load_message_index(file_path)
+    except OSError as e:
+        logger.warning(f"Failed to load message index for {file_path}: {str(e)}")
+        table = None
+    if table is None:
+        # Files uploaded before sidecar indexes existed get one on first use
+        try:
+            write_message_index(file_path)
+            table = load_message_index(file_path)
+        except Exception as e:
+            logger.warning(f"Failed to build message index for {file_path}: {str(e)}")
+    if table is None:
+        # Without an index (e.g. the sidecar can't be written) still avoid reading the whole file into memory
+        table = map_message_table(file_path)
+    return table
+
+
 class DocumentService:
     def __init__(self):
         self.file_handler = FileHandler()
@@ -95,20 +119,14 @@ class DocumentService:
         if not document:
             raise HTTPException(status_code=404, detail="Project not found")
             
-        # Read document content
-        with open(document.file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Count messages (match timestamp-prefixed lines)
-        messages = re.findall(r'\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}.*', content)
-        message_count = len(messages)
+        table = self._get_message_table(document.file_path)
+        message_count = len(table)
         
         # Calculate conversation time range
-        timestamps = re.findall(r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})', content)
-        if timestamps:
+        if message_count:
             try:
-                earliest = datetime.strptime(timestamps[0], '%Y-%m-%d %H:%M:%S')
-                latest = datetime.strptime(timestamps[-1], '%Y-%m-%d %H:%M:%S')
+                earliest = datetime.fromtimestamp(table.timestamps[0], tz=timezone.utc)
+                latest = datetime.fromtimestamp(table.timestamps[-1], tz=timezone.utc)
                 total_time = f"{earliest.strftime('%Y年%m月%d日')} - {latest.strftime('%Y年%m月%d日')}"
             except Exception as e:
                 logger.error(f"Error calculating duration: {str(e)}")
@@ -129,13 +147,12 @@ class DocumentService:
             raise HTTPException(status_code=404, detail="No input document found for this project")
         return read_file(document.file_path)
 
-    def get_project_chat_content(self, db: Session, project_id: str) -> str:
-        """Get project chat content"""
+    def _get_latest_input_document(self, db: Session, project_id: str) -> InputDocument:
+        """Get the project's latest input document"""
         project = db.query(Project).filter(Project.id == project_id).first()
         if not project:
             raise HTTPException(status_code=404, detail="Project not found")
         
-        # Get latest input document
         input_doc = db.query(InputDocument)\
             .filter(InputDocument.project_id == project_id)\
             .order_by(InputDocument.created_at.desc())\
@@ -143,6 +160,11 @@ class DocumentService:
         
         if not input_doc:
             raise HTTPException(status_code=404, detail="Project has no available chat records")
+        return input_doc
+
+    def get_project_chat_content(self, db: Session, project_id: str) -> str:
+        """Get project chat content"""
+        input_doc = self._get_latest_input_document(db, project_id)
         
         # Read file content
         try:
@@ -153,4 +175,20 @@ class DocumentService:
         except Exception as e:
             logger.error(f"Failed to read file: {str(e)}")
             raise HTTPException(status_code=500, detail="Cannot read chat record file")
-    
\ No newline at end of file
+
+    def get_project_message_table(self, db: Session, project_id: str) -> MessageTable:
+        """Get the parsed message index of the project's latest chat records"""
+        input_doc = self._get_latest_input_document(db, project_id)
+        try:
+            return self._get_message_table(input_doc.file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Chat record file doesn't exist")
+        except Exception as e:
+            logger.error(f"Failed to read file: {str(e)}")
+            raise HTTPException(status_code=500, detail="Cannot read chat record file")
+
+    @staticmethod
+    def _get_message_table(file_path: str) -> MessageTable:
+        stat = os.stat(file_path)
+        return _load_message_table(file_path, stat.st_mtime, stat.st_size)
+
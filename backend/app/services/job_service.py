@@ -0,0 +1,466 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Any, Dict, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+
+from app.core.db import engine
+from app.libs.core.worker import generate_doc_async
+from app.libs.utils.cancellation import CancellationToken
+from app.libs.utils.token_counter import calibrate_token_estimate
+from app.models.project import (
+    GenerationJob,
+    GenerationJobStatus,
+    OutputDocument,
+    OutputDocumentStatus,
+    Project,
+)
+from app.services.document_service import DocumentService
+from app.utils.file_handler import FileHandler
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = (GenerationJobStatus.COMPLETED, GenerationJobStatus.FAILED, GenerationJobStatus.CANCELLED)
+
+
+@dataclass
+class JobQueueConfig:
+    """
+    后台文档生成任务队列配置，默认值可通过环境变量覆盖
+
+    Attributes:
+        workers: 本进程同时执行的任务数，0 表示本进程只接收任务、不执行（LLM_JOB_WORKERS）
+        poll_interval: 队列为空时轮询数据库的间隔秒数（LLM_JOB_POLL_INTERVAL）
+        heartbeat_interval: 执行中的任务写入进度、检查取消请求的间隔秒数（LLM_JOB_HEARTBEAT）
+        lease: 执行中的任务超过该秒数没有心跳时，视为所在进程已退出，由其他 worker 接手（LLM_JOB_LEASE）
+        max_attempts: 每个任务最多执行的次数（LLM_JOB_MAX_ATTEMPTS）
+    """
+    workers: int = 2
+    poll_interval: float = 2.0
+    heartbeat_interval: float = 2.0
+    lease: float = 120.0
+    max_attempts: int = 3
+
+    @classmethod
+    def from_env(cls) -> "JobQueueConfig":
+        return cls(
+            workers=int(os.environ.get("LLM_JOB_WORKERS", cls.workers)),
+            poll_interval=float(os.environ.get("LLM_JOB_POLL_INTERVAL", cls.poll_interval)),
+            heartbeat_interval=float(os.environ.get("LLM_JOB_HEARTBEAT", cls.heartbeat_interval)),
+            lease=float(os.environ.get("LLM_JOB_LEASE", cls.lease)),
+            max_attempts=int(os.environ.get("LLM_JOB_MAX_ATTEMPTS", cls.max_attempts)),
+        )
+
+
+class JobService:
+    """任务的提交、查询与取消（由 API 调用，只读写数据库）"""
+
+    @staticmethod
+    def submit_job(db: Session, project_id: str, doc_type: str, model: Optional[str] = None) -> Dict[str, Any]:
+        """创建输出文档和排队中的生成任务"""
+        project = db.get(Project, project_id)
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        try:
+            output_doc = OutputDocument(
+                project_id=project_id,
+                title=doc_type,
+                status=OutputDocumentStatus.PENDING
+            )
+            db.add(output_doc)
+            db.flush()
+            job = GenerationJob(
+                project_id=project_id,
+                output_document_id=output_doc.id,
+                doc_type=doc_type,
+                model=model
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+        except Exception:
+            db.rollback()
+            raise
+        logger.info(f"Queued generation job {job.id} for project {project_id} ({doc_type})")
+        return JobService._describe(db, job)
+
+    @staticmethod
+    def get_job(db: Session, project_id: str, job_id: str) -> GenerationJob:
+        job = db.get(GenerationJob, job_id)
+        if not job or job.project_id != project_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    @staticmethod
+    def get_job_status(db: Session, project_id: str, job_id: str) -> Dict[str, Any]:
+        return JobService._describe(db, JobService.get_job(db, project_id, job_id))
+
+    @staticmethod
+    def get_job_result(db: Session, project_id: str, job_id: str) -> Dict[str, Any]:
+        """已完成任务生成的文档；未完成时返回 409"""
+        job = JobService.get_job(db, project_id, job_id)
+        if job.status != GenerationJobStatus.COMPLETED:
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+        return db.get(OutputDocument, job.output_document_id).to_dict()
+
+    @staticmethod
+    def cancel_job(db: Session, project_id: str, job_id: str) -> Dict[str, Any]:
+        """
+        取消任务：排队中的任务直接取消；执行中的任务标记为取消，
+        执行它的 worker 在下一次心跳时停止（在本进程中执行时立即停止）
+        """
+        job = JobService.get_job(db, project_id, job_id)
+        if job.status not in FINISHED_STATUSES:
+            now = datetime.utcnow()
+            job.status = GenerationJobStatus.CANCELLED
+            job.finished_at = now
+            output_doc = db.get(OutputDocument, job.output_document_id)
+            if output_doc:
+                output_doc.status = OutputDocumentStatus.CANCELLED
+                output_doc.updated_at = now
+            db.commit()
+            get_job_pool().cancel_local(job_id)
+            logger.info(f"Cancelled generation job {job_id}")
+        return JobService._describe(db, job)
+
+    @staticmethod
+    def delete_project_jobs(db: Session, project_id: str) -> int:
+        """
+        删除项目的全部生成任务（删除项目前调用，不提交事务）
+
+        本进程中执行的任务立即停止；其他进程中执行的任务在下一次心跳发现任务行已删除后停止，
+        也不会再写入结果文件。
+        """
+        jobs = db.exec(select(GenerationJob).where(GenerationJob.project_id == project_id)).all()
+        pool = get_job_pool()
+        for job in jobs:
+            if job.status not in FINISHED_STATUSES:
+                pool.cancel_local(job.id)
+                logger.info(f"Cancelled generation job {job.id} of deleted project {project_id}")
+            db.delete(job)
+        db.flush()
+        return len(jobs)
+
+    @staticmethod
+    def _describe(db: Session, job: GenerationJob) -> Dict[str, Any]:
+        output_doc = db.get(OutputDocument, job.output_document_id)
+        result = job.to_dict()
+        result['progress'] = output_doc.progress if output_doc else 0.0
+        return result
+
+
+class JobWorkerPool:
+    """
+    有界的 asyncio worker 池，从 generation_jobs 表中领取任务执行
+
+    - 领取时用带条件的 UPDATE 检查影响行数，多个 API 进程或独立的 worker 进程可以共享同一个队列（PostgreSQL 与 SQLite 均适用）
+    - 执行中按心跳间隔把进度写入 OutputDocument，同时发现其他进程发出的取消请求
+    - 超过 lease 没有心跳的任务（所在进程崩溃或被重新部署）会被重新领取；
+      任务 ID 同时作为检查点的 job_id，重新执行时跳过已完成的片段和汇总
+    - 进程关闭时执行中的任务放回队列
+    """
+
+    def __init__(self, config: Optional[JobQueueConfig] = None):
+        self.config = config or JobQueueConfig.from_env()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: Set[asyncio.Task] = set()
+        self._running: Dict[str, asyncio.Task] = {}
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._cancelled: Set[str] = set()
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """在当前事件循环中启动 worker"""
+        if self._workers or self.config.workers <= 0:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for _ in range(self.config.workers):
+            self._workers.add(loop.create_task(self._worker()))
+        logger.info(f"Started {self.config.workers} generation job workers ({self.worker_id})")
+
+    async def stop(self) -> None:
+        """停止 worker，执行中的任务放回队列"""
+        self._stopping = True
+        for task in list(self._workers):
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def notify(self) -> None:
+        """有新任务入队，唤醒空闲的 worker"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel_local(self, job_id: str) -> None:
+        """任务在本进程执行时立即停止"""
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancelled.add(job_id)
+            token = self._tokens.get(job_id)
+            if token is not None:
+                token.cancel("job cancelled")
+            task.cancel()
+
+    async def _worker(self) -> None:
+        while True:
+            # 先清除再领取，领取期间入队的任务不会错过唤醒
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Failed to claim generation job: {str(e)}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.config.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._running[job['id']] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # 用户取消只结束该任务；关闭进程时 worker 本身也退出
+                if self._stopping:
+                    raise
+            finally:
+                self._running.pop(job['id'], None)
+                self._cancelled.discard(job['id'])
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.config.lease)
+        claimable = or_(
+            GenerationJob.status == GenerationJobStatus.QUEUED,
+            and_(GenerationJob.status == GenerationJobStatus.RUNNING, GenerationJob.heartbeat_at < stale)
+        )
+        while True:
+            with Session(engine) as db:
+                job = db.exec(
+                    select(GenerationJob)
+                    .where(claimable)
+                    .order_by(GenerationJob.created_at)
+                    .limit(1)
+                ).first()
+                if job is None:
+                    return None
+                # 条件更新领取：只有任务仍可领取、且 attempts 与读到的一致时才会改到这一行，
+                # 同时读到同一任务的其他 worker 更新 0 行后去看下一个任务。
+                # 不依赖 SELECT ... FOR UPDATE SKIP LOCKED，SQLite 上同样不会重复领取
+                claimed = and_(GenerationJob.id == job.id, GenerationJob.attempts == job.attempts, claimable)
+                if job.attempts >= self.config.max_attempts:
+                    values = dict(
+                        status=GenerationJobStatus.FAILED,
+                        error=job.error or f"Gave up after {job.attempts} attempts",
+                        finished_at=now,
+                    )
+                    output_status = OutputDocumentStatus.FAILED
+                else:
+                    values = dict(
+                        status=GenerationJobStatus.RUNNING,
+                        attempts=job.attempts + 1,
+                        worker_id=self.worker_id,
+                        started_at=now,
+                        heartbeat_at=now,
+                    )
+                    output_status = OutputDocumentStatus.PROCESSING
+                # UPDATE 会同步会话中的 job，先记下领取前的状态
+                previous = (job.status, job.worker_id, job.heartbeat_at)
+                if db.exec(update(GenerationJob).where(claimed).values(**values)).rowcount != 1:
+                    db.rollback()
+                    continue
+                output_doc = db.get(OutputDocument, job.output_document_id)
+                if output_doc:
+                    output_doc.status = output_status
+                    output_doc.updated_at = now
+                db.commit()
+                if values['status'] == GenerationJobStatus.FAILED:
+                    # 立即看下一个任务
+                    continue
+                status, worker_id, heartbeat_at = previous
+                if status == GenerationJobStatus.RUNNING:
+                    logger.warning(f"Reclaimed generation job {job.id} from {worker_id} (no heartbeat since {heartbeat_at})")
+                return {
+                    'id': job.id,
+                    'project_id': job.project_id,
+                    'output_document_id': job.output_document_id,
+                    'doc_type': job.doc_type,
+                    'model': job.model,
+                }
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        progress = {'value': 0.0}
+        cancel_token = self._tokens[job_id] = CancellationToken()
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job, progress))
+        logger.info(f"Running generation job {job_id} ({job['doc_type']}) on {self.worker_id}")
+        try:
+            chat_content = await asyncio.to_thread(self._load_chat_content, job['project_id'])
+            stream = await generate_doc_async(
+                chat_content,
+                job['doc_type'],
+                model=job['model'],
+                job_id=job_id,
+                progress_callback=lambda value: progress.__setitem__('value', value),
+                cancel_token=cancel_token
+            )
+            chunks = []
+            async for chunk in stream:
+                chunks.append(chunk)
+            await asyncio.to_thread(self._complete, job, ''.join(chunks))
+            self.completed += 1
+        except asyncio.CancelledError:
+            if job_id in self._cancelled:
+                logger.info(f"Generation job {job_id} cancelled")
+            else:
+                await asyncio.shield(asyncio.to_thread(self._requeue, job_id))
+            raise
+        except Exception as e:
+            logger.exception(f"Generation job {job_id} failed: {str(e)}")
+            await asyncio.to_thread(self._fail, job, str(e))
+            self.failed += 1
+        finally:
+            heartbeat.cancel()
+            self._tokens.pop(job_id, None)
+
+    async def _heartbeat(self, job: Dict[str, Any], progress: Dict[str, float]) -> None:
+        while True:
+            await asyncio.sleep(self.config.heartbeat_interval)
+            try:
+                status = await asyncio.to_thread(self._touch, job, progress['value'])
+            except Exception as e:
+                logger.warning(f"Heartbeat for generation job {job['id']} failed: {str(e)}")
+                continue
+            if status == GenerationJobStatus.CANCELLED:
+                self.cancel_local(job['id'])
+                return
+
+    @staticmethod
+    def _load_chat_content(project_id: str):
+        with Session(engine) as db:
+            chat_content = DocumentService().get_project_message_table(db, project_id)
+        if not chat_content.size:
+            raise ValueError("No chat records found")
+        return chat_content
+
+    def _touch(self, job: Dict[str, Any], progress: float) -> str:
+        """写入心跳与进度，返回任务当前状态；任务已被其他 worker 接手时返回 CANCELLED"""
+        now = datetime.utcnow()
+        with Session(engine) as db:
+            db_job = db.get(GenerationJob, job['id'])
+            if db_job is None:
+                return GenerationJobStatus.CANCELLED
+            if db_job.worker_id != self.worker_id:
+                # 心跳中断超过 lease 后任务被重新领取（或已放回队列），本进程不能再写入进度和结果
+                logger.warning(f"Generation job {job['id']} is now owned by {db_job.worker_id}, stopping")
+                return GenerationJobStatus.CANCELLED
+            if db_job.status == GenerationJobStatus.RUNNING:
+                db_job.heartbeat_at = now
+                output_doc = db.get(OutputDocument, job['output_document_id'])
+                if output_doc:
+                    output_doc.progress = round(progress, 1)
+                    output_doc.updated_at = now
+                db.commit()
+            return db_job.status
+
+    def _complete(self, job: Dict[str, Any], content: str) -> None:
+        with Session(engine) as db:
+            db_job = db.get(GenerationJob, job['id'])
+            if db_job is None or db_job.status != GenerationJobStatus.RUNNING or db_job.worker_id != self.worker_id:
+                # 结束前的一刻被取消、所属项目已删除，或已被其他 worker 接手；不写入结果文件
+                return
+            file_path = FileHandler.save_output_file(content, f"{job['doc_type']}_{job['id']}.md", job['project_id'])
+            now = datetime.utcnow()
+            db_job.status = GenerationJobStatus.COMPLETED
+            db_job.finished_at = now
+            output_doc = db.get(OutputDocument, job['output_document_id'])
+            if output_doc:
+                output_doc.file_path = file_path
+                output_doc.status = OutputDocumentStatus.COMPLETED
+                output_doc.progress = 100.0
+                output_doc.updated_at = now
+            db.commit()
+        logger.info(f"Generation job {job['id']} completed: {file_path}")
+
+    def _fail(self, job: Dict[str, Any], error: str) -> None:
+        now = datetime.utcnow()
+        with Session(engine) as db:
+            db_job = db.get(GenerationJob, job['id'])
+            if db_job is None or db_job.status != GenerationJobStatus.RUNNING or db_job.worker_id != self.worker_id:
+                return
+            db_job.status = GenerationJobStatus.FAILED
+            db_job.error = error
+            db_job.finished_at = now
+            output_doc = db.get(OutputDocument, job['output_document_id'])
+            if output_doc:
+                output_doc.status = OutputDocumentStatus.FAILED
+                output_doc.updated_at = now
+            db.commit()
+
+    def _requeue(self, job_id: str) -> None:
+        with Session(engine) as db:
+            db_job = db.get(GenerationJob, job_id)
+            if db_job is not None and db_job.status == GenerationJobStatus.RUNNING and db_job.worker_id == self.worker_id:
+                db_job.status = GenerationJobStatus.QUEUED
+                db_job.worker_id = None
+                db.commit()
+                logger.info(f"Generation job {job_id} returned to the queue")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "workers": len(self._workers),
+            "running": list(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+_pool: Optional[JobWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_job_pool() -> JobWorkerPool:
+    """返回进程级共享的任务 worker 池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = JobWorkerPool()
+    return _pool
+
+
+async def _serve() -> None:
+    try:
+        await asyncio.to_thread(calibrate_token_estimate)
+    except Exception as e:
+        logger.warning(f"Token estimate calibration failed, keeping defaults: {str(e)}")
+    pool = get_job_pool()
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    # 独立的 worker 进程：python -m app.services.job_service（API 进程可设置 LLM_JOB_WORKERS=0）
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
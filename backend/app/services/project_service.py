@@ -7,6 +7,7 @@ import os
 import shutil
 
 from app.models.project import Project, ProjectStatus, InputDocument, OutputDocument
+from app.services.job_service import JobService
 from app.utils.file_handler import FileHandler
 
 logger = logging.getLogger(__name__)
@@ -112,8 +113,12 @@ class ProjectService:
     def delete_project(db: Session, project_id: str) -> bool:
         """
         删除项目及关联的文件夹和数据库记录
+
+        先取消并删除项目的生成任务：任务行引用输出文档和项目，且执行中的任务不能再写入已删除的目录
         """
         try:
+            JobService.delete_project_jobs(db, project_id)
+
             input_docs = db.exec(select(InputDocument).where(InputDocument.project_id == project_id)).all()
             output_docs = db.exec(select(OutputDocument).where(OutputDocument.project_id == project_id)).all()
             
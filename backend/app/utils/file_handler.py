@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import os
 from typing import Tuple
 import json
@@ -5,6 +7,9 @@ from fastapi import UploadFile
 import shutil
 from pathlib import Path
 from ..core.config import settings
+from ..libs.preprocessing.message_index import write_message_index
+
+logger = logging.getLogger(__name__)
 
 class FileHandler:
     ALLOWED_EXTENSIONS = {'txt'}
@@ -48,6 +53,12 @@ class FileHandler:
         
         file_size = os.path.getsize(file_path)
         
+        # Build the binary message index next to the file so later requests can mmap it
+        try:
+            await asyncio.to_thread(write_message_index, file_path)
+        except Exception as e:
+            logger.warning(f"Failed to build message index for {file_path}: {str(e)}")
+        
         return file_path, file_size
     
     @staticmethod
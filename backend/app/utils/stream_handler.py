@@ -1,17 +1,33 @@
 import json
-from typing import Callable, Generator, AsyncGenerator, Any, Dict
+from typing import Callable, Generator, AsyncGenerator, Any, Dict, Hashable, Optional
 from fastapi.responses import StreamingResponse
 import asyncio
-from fastapi import Request
+from fastapi import HTTPException, Request
 import logging
 
+from app.libs.utils.cancellation import CancellationToken
+from app.libs.utils.singleflight import get_single_flight
+
 logger = logging.getLogger(__name__)
 
+_END = object()
+
+
+def _offer_end(queue: asyncio.Queue) -> None:
+    """生成结束后放入结束标记；队列已满时消费者取完剩余片段后会发现生成已结束"""
+    try:
+        queue.put_nowait(_END)
+    except asyncio.QueueFull:
+        pass
+
+
 async def ai_stream_endpoint(
     request: Request,
     stream_generator: Callable,  
     stream_params: dict,
-    model: str
+    model: str,
+    share_key: Optional[Hashable] = None,
+    cancel_token: Optional[CancellationToken] = None
 ):
     """
     统一的AI流式端点处理函数
@@ -21,6 +37,9 @@ async def ai_stream_endpoint(
         stream_generator: 异步生成器函数 (如generate_doc_async)
         stream_params: 传递给生成器的参数
         model: 使用的模型名称
+        share_key: 任务标识；相同标识的并发请求共享一次生成，输出分发给每个请求
+        cancel_token: stream_params 中传给生成器的取消令牌。客户端断开时：不共享的任务立即取消令牌；
+            共享的任务只退订，最后一个订阅者离开时由 Broadcaster 取消令牌
     
     Returns:
         StreamingResponse: SSE流式响应
@@ -29,47 +48,62 @@ async def ai_stream_endpoint(
     
     # 客户端断开连接标志
     disconnect = asyncio.Event()
-    
-    # 监控客户端连接状态
-    async def monitor_client():
-        while not disconnect.is_set():
+
+    async def pump(queue: asyncio.Queue):
+        """在单独的任务中消费生成器，片段逐个放入队列；客户端断开时由监控任务取消"""
+        if share_key is not None:
+            stream = get_single_flight().stream(
+                share_key, lambda: stream_generator(**stream_params), cancel_token=cancel_token
+            )
+        else:
+            stream = await stream_generator(**stream_params)
+        try:
+            if hasattr(stream, '__aiter__'):
+                # 如果是异步迭代器(AsyncGenerator)
+                async for chunk in stream:
+                    await queue.put(chunk)
+            else:
+                # 如果是同步生成器
+                for chunk in stream:
+                    await queue.put(chunk)
+        finally:
+            if hasattr(stream, 'aclose'):
+                # 及时退订，所有订阅者都离开时共享任务会被取消
+                await stream.aclose()
+
+    # 监控客户端连接状态：整个请求只有这一个监控任务。生成第一个片段之前（map、汇总阶段）可能要等很久，
+    # 断开后直接取消消费任务，不需要每次等待都与断开检测赛跑
+    async def monitor_client(pump_task: asyncio.Task):
+        while not pump_task.done():
             if await request.is_disconnected():
                 logger.info("客户端断开连接")
                 disconnect.set()
+                pump_task.cancel()
                 break
             await asyncio.sleep(1)
-
-    # 创建监控任务
-    monitor_task = asyncio.create_task(monitor_client())
     
     # 创建处理流的异步生成器
     async def stream_generator_wrapper():
+        # 容量为 1：客户端读取慢时生成也随之放慢，共享任务按订阅者各自的读取速度分发
+        queue = asyncio.Queue(maxsize=1)
+        pump_task = asyncio.create_task(pump(queue))
+        pump_task.add_done_callback(lambda _: _offer_end(queue))
+        monitor_task = asyncio.create_task(monitor_client(pump_task))
         try:
-            # 调用生成器函数
-            async_stream = await stream_generator(**stream_params)
-            
-            # 处理不同类型的返回值
-            if hasattr(async_stream, '__aiter__'):
-                # 如果是异步迭代器(AsyncGenerator)
-                async for chunk in async_stream:
-                    if disconnect.is_set():
-                        logger.info("检测到客户端断开，停止生成")
-                        break
-                    
-                    # 构造SSE消息，确保以JSON格式发送
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
+            while not (pump_task.done() and queue.empty()):
+                chunk = await queue.get()
+                if chunk is _END:
+                    break
+                
+                # 构造SSE消息，确保以JSON格式发送
+                yield f"data: {json.dumps({'content': chunk})}\n\n"
+
+            if disconnect.is_set() or pump_task.cancelled():
+                logger.info("检测到客户端断开，停止生成")
+            elif pump_task.exception() is not None:
+                raise pump_task.exception()
             else:
-                # 如果是同步生成器
-                for chunk in async_stream:
-                    if disconnect.is_set():
-                        logger.info("检测到客户端断开，停止生成")
-                        break
-                    
-                    # 构造SSE消息，确保以JSON格式发送
-                    yield f"data: {json.dumps({'content': chunk})}\n\n"
-                    
-            # 发送完成信号
-            if not disconnect.is_set():
+                # 发送完成信号
                 yield "data: [DONE]\n\n"
                 
         except Exception as e:
@@ -78,8 +112,12 @@ async def ai_stream_endpoint(
             yield f"data: {error_message}\n\n"
             yield "data: [ERROR]\n\n"
         finally:
-            # 确保监控任务被取消
+            # 确保监控任务与消费任务被取消（消费任务取消时自行退订共享任务）
             monitor_task.cancel()
+            pump_task.cancel()
+            if share_key is None and cancel_token is not None:
+                # 任务只属于本请求：停止仍在进行的 map / 汇总调用（正常结束时没有待取消的任务）
+                cancel_token.cancel("client disconnected")
     
     # 返回流式响应
     return StreamingResponse(
@@ -91,4 +129,38 @@ async def ai_stream_endpoint(
             "Content-Type": "text/event-stream",
             "X-Accel-Buffering": "no",  # 禁用Nginx缓冲
         }
-    )
\ No newline at end of file
+    )
+
+
+async def watch_stream_endpoint(
+    request: Request,
+    share_key: Hashable,
+    model: Optional[str] = None
+):
+    """
+    旁观正在进行的共享生成任务（例如团队看板），不会启动新的生成
+
+    订阅者先收到已经生成的片段，再接收后续片段；读取太慢的订阅者会被单独断开。
+
+    Args:
+        request: FastAPI请求对象
+        share_key: 生成任务的标识，与发起任务时的 share_key 相同
+        model: 使用的模型名称（仅用于日志）
+
+    Returns:
+        StreamingResponse: SSE流式响应
+    """
+    if not get_single_flight().streaming(share_key):
+        raise HTTPException(status_code=404, detail="No generation in progress")
+
+    async def finished():
+        # 检查之后任务恰好结束时，不重新生成
+        raise ValueError("The generation has already finished")
+
+    return await ai_stream_endpoint(
+        request=request,
+        stream_generator=finished,
+        stream_params={},
+        model=model,
+        share_key=share_key
+    )
@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -10,6 +12,17 @@ from sqlmodel import SQLModel
 from app.core.config import settings
 from app.api.routers import router as api_router
 from app.core.db import engine, create_db_and_tables
+from app.libs.utils.client_pool import close_client_pool, get_client_pool
+from app.libs.utils.completion_cache import get_completion_cache
+from app.libs.utils.hedging import hedge_stats
+from app.libs.utils.model_registry import get_model_registry
+from app.libs.utils.circuit_breaker import circuit_breaker_stats
+from app.libs.utils.singleflight import get_single_flight
+from app.libs.utils.cassette import get_cassette
+from app.libs.utils.job_store import get_job_store
+from app.libs.utils.chunk_cache import get_chunk_cache
+from app.libs.utils.token_counter import calibrate_token_estimate
+from app.services.job_service import get_job_pool
 
 # Configure logging
 logging.basicConfig(
@@ -25,10 +38,40 @@ logger = logging.getLogger(__name__)
 # Create database tables
 create_db_and_tables()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        create_db_and_tables()
+        logger.info("数据库初始化完成并创建了表结构")
+    except Exception as e:
+        logger.error(f"数据库初始化失败: {str(e)}")
+
+    # 用固定样本校准 token 快速估算（预算检查与路由时的 prompt 大小），失败时保留默认系数
+    try:
+        cjk_rate, chars_per_token = await asyncio.to_thread(calibrate_token_estimate)
+        logger.info(f"token 估算已校准: {cjk_rate:.2f} token/CJK 字符, {chars_per_token:.2f} 字符/token")
+    except Exception as e:
+        logger.warning(f"token 估算校准失败，使用默认系数: {str(e)}")
+
+    # LLM 客户端连接池在进程生命周期内复用，关闭时释放所有连接
+    pool = get_client_pool()
+    logger.info(f"LLM 客户端连接池已就绪: {pool.config}")
+    # 后台文档生成任务的 worker；执行中的任务在关闭时放回队列
+    job_pool = get_job_pool()
+    job_pool.start()
+    yield
+    await job_pool.stop()
+    await close_client_pool()
+    logger.info("LLM 客户端连接池已关闭")
+    cache = get_completion_cache()
+    logger.info(f"LLM 补全缓存统计: {cache.stats()}")
+    cache.close()
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -40,15 +83,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Add startup event processor
-@app.on_event("startup")
-async def startup_db_client():
-    try:
-        create_db_and_tables()
-        logger.info("数据库初始化完成并创建了表结构")
-    except Exception as e:
-        logger.error(f"数据库初始化失败: {str(e)}")
-
 # Include API routers
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -57,7 +91,16 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 async def health_check():
     return {
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': datetime.utcnow().isoformat(),
+        'completion_cache': get_completion_cache().stats(),
+        'hedging': hedge_stats(),
+        'models': get_model_registry().stats(),
+        'circuit_breakers': circuit_breaker_stats(),
+        'single_flight': get_single_flight().stats(),
+        'cassette': get_cassette().stats(),
+        'job_store': get_job_store().stats(),
+        'chunk_cache': get_chunk_cache().stats(),
+        'jobs': get_job_pool().stats()
     }
 
 # Exception handler
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 将项目根目录添加到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from app.libs.utils.client_pool import ClientPool, PoolConfig
+
+MODEL = "gpt-4o-mini"
+COMPLETION = json.dumps({
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": MODEL,
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode('utf-8')
+
+
+class StubServer:
+    """在后台线程里运行的最小 OpenAI 兼容服务，支持 keep-alive，并统计建立的连接数"""
+
+    def __init__(self, ssl_context=None, latency: float = 0.0):
+        self.ssl_context = ssl_context
+        self.latency = latency
+        self.connections = 0
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                await reader.readexactly(length)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: ' + str(len(COMPLETION)).encode() + b'\r\n\r\n' + COMPLETION
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, '127.0.0.1', 0, ssl=self.ssl_context, backlog=1024)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self) -> str:
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        scheme = 'https' if self.ssl_context else 'http'
+        return f"{scheme}://127.0.0.1:{self.port}/v1"
+
+
+def make_ssl_context(tmp_dir: str) -> ssl.SSLContext:
+    """用 openssl 生成自签名证书"""
+    cert = os.path.join(tmp_dir, "cert.pem")
+    key = os.path.join(tmp_dir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def run_fresh_clients(base_url: str, requests: int, concurrency: int, verify: bool) -> None:
+    """旧的行为：每次调用创建并关闭一个客户端"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            client = AsyncOpenAI(api_key="stub", base_url=base_url, http_client=DefaultAsyncHttpxClient(verify=verify))
+            try:
+                await client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": "hi"}])
+            finally:
+                await client.close()
+
+    await asyncio.gather(*(call() for _ in range(requests)))
+
+
+async def run_pooled_client(pool: ClientPool, requests: int, concurrency: int) -> None:
+    """新的行为：所有调用共享连接池"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            client = pool.get_async(MODEL)
+            await client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": "hi"}])
+
+    await asyncio.gather(*(call() for _ in range(requests)))
+    await pool.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较每次新建客户端与共享连接池的请求耗时和连接数")
+    parser.add_argument("--requests", type=int, default=200, help="请求总数（相当于 map 阶段的片段数）")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发数")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务每个请求的模拟处理时间（秒）")
+    parser.add_argument("--tls", action="store_true", help="桩服务使用 TLS（需要 openssl 命令）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ssl_context = make_ssl_context(tmp_dir) if args.tls else None
+
+        for name in ("新建客户端", "共享连接池"):
+            server = StubServer(ssl_context, args.latency)
+            base_url = server.start()
+            start = time.perf_counter()
+            if name == "新建客户端":
+                asyncio.run(run_fresh_clients(base_url, args.requests, args.concurrency, verify=not args.tls))
+            else:
+                os.environ["OPENAI_API_KEY"] = "stub"
+                os.environ["OPENAI_API_BASE"] = base_url
+                pool = ClientPool(PoolConfig(max_keepalive_connections=args.concurrency, verify=not args.tls))
+                asyncio.run(run_pooled_client(pool, args.requests, args.concurrency))
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {elapsed:.2f}s, {args.requests / elapsed:.0f} req/s, 建立连接 {server.connections} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from pathlib import Path
+
+# 将项目根目录添加到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from bench_split_parallel import generate_chat_file
+
+from app.libs.utils.cassette import CassetteConfig, configure_cassette, get_cassette
+from app.libs.utils.hedging import hedge_stats
+from app.libs.utils.mock_llm import PROFILES, MockLLMServer
+
+
+async def run_pipeline(chat_records: str, doc_type: str, max_tokens: int) -> tuple:
+    from app.libs.core.worker import generate_doc_async
+
+    start = time.perf_counter()
+    stream = await generate_doc_async(chat_records, doc_type, max_tokens=max_tokens)
+    first_chunk = None
+    size = 0
+    async for chunk in stream:
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        size += len(chunk)
+    return time.perf_counter() - start, first_chunk, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地模拟 LLM 服务压测 generate_doc_async，不消耗真实配额")
+    parser.add_argument("--messages", type=int, default=50_000, help="合成消息条数")
+    parser.add_argument("--file", help="使用已有的聊天记录文件，而不是生成合成数据")
+    parser.add_argument("--doc-type", default="summary")
+    parser.add_argument("--max-tokens", type=int, default=50000, help="每个片段最大token数")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="模拟服务的延迟与故障配置")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="保留补全缓存、任务检查点和 map 结果缓存（默认关闭，保证每次都请求模拟服务）")
+    parser.add_argument("--live", action="store_true", help="请求真实服务商而不是模拟服务（配合 --cassette record 录制）")
+    parser.add_argument("--cassette", choices=["record", "replay", "auto"], help="录制或回放 LLM 请求")
+    parser.add_argument("--cassette-path", default=os.path.join(tempfile.gettempdir(), "bench_doc_pipeline.jsonl"))
+    parser.add_argument("--speed", default="1", help="回放速度，1 为录制时的节奏，instant 为立即返回")
+    parser.add_argument("--hedge", action="store_true", help="map 阶段启用对冲请求（与 long_tail 配置一起评估尾延迟）")
+    parser.add_argument("--cprofile", help="把管线的 cProfile 结果写入该文件，并打印耗时最多的函数")
+    args = parser.parse_args()
+
+    server = None
+    if not args.live:
+        server = MockLLMServer(replace(PROFILES[args.profile], seed=args.seed))
+        os.environ["LLM_MOCK_BASE"] = server.start()
+    if not args.cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["LLM_JOB_STORE_ENABLED"] = "false"
+        os.environ["LLM_CHUNK_CACHE_ENABLED"] = "false"
+    if args.hedge:
+        os.environ["LLM_HEDGE_ENABLED"] = "true"
+    if args.cassette:
+        speed = 0.0 if args.speed == "instant" else float(args.speed)
+        configure_cassette(CassetteConfig(mode=args.cassette, path=args.cassette_path, speed=speed))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp_dir, "chat.txt")
+            generate_chat_file(path, args.messages, seed=args.seed)
+        with open(path, encoding='utf-8') as f:
+            chat_records = f.read()
+
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    elapsed, first_chunk, size = asyncio.run(run_pipeline(chat_records, args.doc_type, args.max_tokens))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+    print(f"配置: {'live' if args.live else args.profile}, 聊天记录 {len(chat_records) / (1 << 20):.1f} MB")
+    print(f"总耗时: {elapsed:.2f}s, 首个输出片段: {first_chunk or 0:.2f}s, 输出 {size} 字符")
+    if args.hedge:
+        print(f"对冲: {hedge_stats()}")
+    if args.cassette:
+        print(f"磁带 {args.cassette_path}: {get_cassette().stats()}")
+    if server:
+        print(f"模拟服务: {server.stats}, 建立连接 {server.connections} 次")
+
+
+if __name__ == "__main__":
+    main()
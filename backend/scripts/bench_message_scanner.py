@@ -0,0 +1,66 @@
+import argparse
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 将项目根目录添加到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from app.libs.preprocessing.message_table import iter_message_spans
+
+# 之前 split.py / reader.py 中使用的惰性 DOTALL 前瞻正则
+LEGACY_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (.*?)(?=\n\d{4}-\d{2}-\d{2}|\Z)', re.DOTALL)
+
+
+def generate_chat_text(messages: int, multiline_ratio: float, seed: int = 0) -> str:
+    """生成合成聊天记录，其中一部分是包含日期开头行的多行长消息"""
+    rng = random.Random(seed)
+    current = datetime(2023, 1, 1)
+    lines = []
+    for i in range(messages):
+        current += timedelta(seconds=rng.choice([5, 60, 600, 3600]))
+        if rng.random() < multiline_ratio:
+            body = '\n'.join(
+                f"{(current + timedelta(days=d)):%Y-%m-%d} 安排：第 {d} 项议程的详细说明，" + "补充内容" * rng.randint(5, 40)
+                for d in range(rng.randint(3, 12))
+            )
+        else:
+            body = rng.choice(["收到", "好的，我看一下", "这个问题明天再讨论吧"])
+        lines.append(f"{current:%Y-%m-%d %H:%M:%S} 用户{rng.randint(0, 99)} {body}")
+    return '\n'.join(lines) + '\n'
+
+
+def bench(name: str, func, repeat: int) -> int:
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<12} {best * 1000:9.1f} ms  {count} 条消息")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较逐行消息扫描器与旧正则的速度")
+    parser.add_argument("--messages", type=int, default=200_000, help="合成消息条数")
+    parser.add_argument("--multiline-ratio", type=float, default=0.3, help="多行长消息占比")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式重复次数，取最好成绩")
+    args = parser.parse_args()
+
+    text = generate_chat_text(args.messages, args.multiline_ratio)
+    data = text.encode('utf-8')
+    print(f"文本大小: {len(data) / (1 << 20):.1f} MB, 行数: {text.count(chr(10))}")
+
+    bench("legacy regex", lambda: sum(1 for _ in LEGACY_PATTERN.finditer(text)), args.repeat)
+    bench("scanner str", lambda: sum(1 for _ in iter_message_spans(text)), args.repeat)
+    bench("scanner bytes", lambda: sum(1 for _ in iter_message_spans(data)), args.repeat)
+    print("注意：旧正则遇到正文中以日期开头的行就会结束当前消息，之后的正文被丢弃")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 将项目根目录添加到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from app.libs.preprocessing.parallel import split_by_tokens_parallel
+from app.libs.preprocessing.reader import read_file
+from app.libs.preprocessing.split import split_by_tokens
+
+
+def generate_chat_file(path: str, messages: int, seed: int = 0, newline: str = '\n') -> None:
+    """生成一份合成的聊天记录文件，newline 为 '\\r\\n' 时模拟 Windows 导出"""
+    rng = random.Random(seed)
+    senders = [f"用户{i}" for i in range(200)]
+    bodies = [
+        "收到",
+        "[图片]",
+        "明天下午三点在会议室讨论一下方案，大家有时间吗？",
+        "This is a longer English message about the deployment schedule. " * 3,
+        "第一行\n第二行里提到了 2023-05-11 这个日期\n第三行",
+        "这个问题我之前也遇到过，解决办法是先清理缓存再重新构建。" * 5,
+    ]
+    current = datetime(2023, 1, 1)
+    with open(path, 'w', encoding='utf-8', newline=newline) as f:
+        for _ in range(messages):
+            current += timedelta(seconds=rng.choice([3, 30, 300, 3600, 86400]))
+            f.write(f"{current:%Y-%m-%d %H:%M:%S} {rng.choice(senders)} {rng.choice(bodies)}\n")
+
+
+def check_crlf_equivalence(tmp_dir: str, max_tokens: int, messages: int = 20000) -> bool:
+    """CRLF 换行的导出：多进程结果必须与按文本模式读取（通用换行）后的单进程结果一致"""
+    path = os.path.join(tmp_dir, "chat_crlf.txt")
+    generate_chat_file(path, messages, seed=1, newline='\r\n')
+    baseline = split_by_tokens(read_file(path), max_tokens=max_tokens)
+    matched = True
+    for workers in (1, 2, 4):
+        segments = split_by_tokens_parallel(path, max_tokens=max_tokens, workers=workers)
+        status = "一致" if segments == baseline else "不一致"
+        matched = matched and segments == baseline
+        print(f"CRLF {workers} 进程: {len(segments)} 个片段, 结果{status}")
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较单进程与多进程 split_by_tokens 的耗时")
+    parser.add_argument("--messages", type=int, default=1_000_000, help="合成消息条数")
+    parser.add_argument("--max-tokens", type=int, default=8000, help="每个片段最大token数")
+    parser.add_argument("--file", help="使用已有的聊天记录文件，而不是生成合成数据")
+    parser.add_argument("--crlf", action="store_true", help="合成数据使用 CRLF 换行")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_crlf_equivalence(tmp_dir, args.max_tokens)
+
+        path = args.file
+        if not path:
+            path = os.path.join(tmp_dir, "chat.txt")
+            generate_chat_file(path, args.messages, newline='\r\n' if args.crlf else '\n')
+        print(f"文件大小: {os.path.getsize(path) / (1 << 20):.1f} MB")
+
+        start = time.perf_counter()
+        baseline = split_by_tokens(read_file(path), max_tokens=args.max_tokens)
+        baseline_time = time.perf_counter() - start
+        print(f"单进程 split_by_tokens: {baseline_time:.2f}s, {len(baseline)} 个片段")
+
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            segments = split_by_tokens_parallel(path, max_tokens=args.max_tokens, workers=workers)
+            elapsed = time.perf_counter() - start
+            status = "一致" if segments == baseline else "不一致"
+            print(f"{workers:>3} 进程: {elapsed:.2f}s, 加速比 {baseline_time / elapsed:.2f}x, 结果{status}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
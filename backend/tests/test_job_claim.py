@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.models.project import (
+    GenerationJob,
+    GenerationJobStatus,
+    OutputDocument,
+    OutputDocumentStatus,
+    Project,
+)
+from app.services import job_service
+from app.services.job_service import JobQueueConfig, JobService, JobWorkerPool
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """文件型 SQLite 数据库，多个线程各自打开连接，模拟共享同一队列的多个进程"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'jobs.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(job_service, "engine", engine)
+    return engine
+
+
+@pytest.fixture
+def saved_files(monkeypatch):
+    saved = []
+
+    def save_output_file(content, filename, project_id):
+        saved.append((project_id, filename, content))
+        return f"{project_id}/{filename}"
+
+    monkeypatch.setattr(job_service.FileHandler, "save_output_file", staticmethod(save_output_file))
+    return saved
+
+
+def submit_jobs(engine, count: int) -> str:
+    with Session(engine) as db:
+        project = Project(name="test")
+        db.add(project)
+        db.commit()
+        for _ in range(count):
+            JobService.submit_job(db, project.id, "summary")
+        return project.id
+
+
+def make_pool(**config) -> JobWorkerPool:
+    # workers=0：只调用领取与回写方法，不启动 worker
+    return JobWorkerPool(JobQueueConfig(workers=0, **config))
+
+
+def load_job(engine, job_id: str) -> GenerationJob:
+    with Session(engine) as db:
+        return db.get(GenerationJob, job_id)
+
+
+def test_each_job_is_claimed_exactly_once(engine):
+    submit_jobs(engine, 20)
+    pools = [make_pool() for _ in range(4)]
+
+    def drain(pool):
+        claimed = []
+        while (job := pool._claim()) is not None:
+            claimed.append(job['id'])
+        return claimed
+
+    with ThreadPoolExecutor(len(pools)) as executor:
+        results = list(executor.map(drain, pools))
+
+    claimed = [job_id for result in results for job_id in result]
+    assert len(claimed) == len(set(claimed)) == 20
+    with Session(engine) as db:
+        jobs = db.exec(select(GenerationJob)).all()
+        owners = {pool.worker_id: set(result) for pool, result in zip(pools, results)}
+        for job in jobs:
+            assert job.status == GenerationJobStatus.RUNNING
+            assert job.attempts == 1
+            assert job.id in owners[job.worker_id]
+            assert db.get(OutputDocument, job.output_document_id).status == OutputDocumentStatus.PROCESSING
+
+
+def test_running_job_with_fresh_heartbeat_is_not_reclaimed(engine):
+    submit_jobs(engine, 1)
+    assert make_pool(lease=60)._claim() is not None
+    assert make_pool(lease=60)._claim() is None
+
+
+def test_stale_job_is_reclaimed_and_previous_owner_stops(engine, saved_files):
+    submit_jobs(engine, 1)
+    first, second = make_pool(lease=60), make_pool(lease=60)
+
+    job = first._claim()
+    assert first._touch(job, 10.0) == GenerationJobStatus.RUNNING
+
+    # 心跳中断超过 lease
+    with Session(engine) as db:
+        db_job = db.get(GenerationJob, job['id'])
+        db_job.heartbeat_at = datetime.utcnow() - timedelta(seconds=120)
+        db.commit()
+
+    reclaimed = second._claim()
+    assert reclaimed['id'] == job['id']
+    db_job = load_job(engine, job['id'])
+    assert (db_job.worker_id, db_job.attempts) == (second.worker_id, 2)
+
+    # 原来的 worker 在下一次心跳时停止，结束时也不写入结果
+    assert first._touch(job, 50.0) == GenerationJobStatus.CANCELLED
+    first._complete(job, "stale result")
+    first._fail(job, "stale failure")
+    first._requeue(job['id'])
+    db_job = load_job(engine, job['id'])
+    assert db_job.status == GenerationJobStatus.RUNNING
+    assert db_job.worker_id == second.worker_id
+    assert saved_files == []
+
+    second._complete(reclaimed, "fresh result")
+    assert load_job(engine, job['id']).status == GenerationJobStatus.COMPLETED
+    assert [content for _, _, content in saved_files] == ["fresh result"]
+    with Session(engine) as db:
+        output_doc = db.get(OutputDocument, job['output_document_id'])
+        assert output_doc.status == OutputDocumentStatus.COMPLETED
+        assert output_doc.progress == 100.0
+
+
+def test_cancelled_job_is_not_completed(engine, saved_files):
+    project_id = submit_jobs(engine, 1)
+    pool = make_pool()
+    job = pool._claim()
+
+    with Session(engine) as db:
+        JobService.cancel_job(db, project_id, job['id'])
+
+    assert pool._touch(job, 10.0) == GenerationJobStatus.CANCELLED
+    pool._complete(job, "late result")
+    assert load_job(engine, job['id']).status == GenerationJobStatus.CANCELLED
+    assert saved_files == []
+
+
+def test_job_fails_after_max_attempts(engine):
+    submit_jobs(engine, 1)
+    pools = [make_pool(lease=60, max_attempts=2) for _ in range(3)]
+
+    for pool in pools[:2]:
+        job = pool._claim()
+        assert job is not None
+        with Session(engine) as db:
+            db_job = db.get(GenerationJob, job['id'])
+            db_job.heartbeat_at = datetime.utcnow() - timedelta(seconds=120)
+            db.commit()
+
+    # 第三次领取时发现已执行 max_attempts 次，标记为失败，不再返回
+    assert pools[2]._claim() is None
+    db_job = load_job(engine, job['id'])
+    assert db_job.status == GenerationJobStatus.FAILED
+    assert db_job.attempts == 2
+    assert db_job.error == "Gave up after 2 attempts"
+    with Session(engine) as db:
+        assert db.get(OutputDocument, db_job.output_document_id).status == OutputDocumentStatus.FAILED
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from app.libs.preprocessing.message_index import (
+    INDEX_HEADER,
+    index_path_for,
+    load_message_index,
+    write_message_index,
+)
+from app.libs.preprocessing.message_table import MessageTable
+from app.libs.utils.token_counter import get_token_counter
+from app.services.document_service import _load_message_table
+
+
+def assert_same_table(table: MessageTable, expected: MessageTable) -> None:
+    assert len(table) == len(expected)
+    assert list(table.messages()) == list(expected.messages())
+    assert list(table.timestamps) == list(expected.timestamps)
+    assert [table.sender(i) for i in range(len(table))] == [expected.sender(i) for i in range(len(expected))]
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "gbk"])
+def test_index_round_trip(make_chat, write_chat, encoding):
+    text = make_chat(1500, seed=7)
+    path = write_chat(text, encoding=encoding)
+
+    assert write_message_index(path) == index_path_for(path)
+    table = load_message_index(path)
+
+    assert table is not None
+    assert table.encoding == encoding
+    assert_same_table(table, MessageTable.from_text(text))
+    assert list(table.token_counts) == get_token_counter().count_batch(table.messages())
+
+
+def test_empty_file_has_no_index(write_chat):
+    path = write_chat("")
+    assert write_message_index(path) is None
+    assert load_message_index(path) is None
+
+
+def corrupt(path: str, how: str) -> None:
+    index_path = index_path_for(path)
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    if how == "truncated":
+        data = data[:len(data) // 2]
+    elif how == "header_only":
+        data = data[:INDEX_HEADER.size - 1]
+    elif how == "bad_magic":
+        data = b"NOTANIDX" + data[8:]
+    elif how == "bad_senders":
+        data = data[:-2] + b"\xff\xff"
+    with open(index_path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize("how", ["truncated", "header_only", "bad_magic", "bad_senders"])
+def test_corrupt_index_is_ignored(make_chat, write_chat, how):
+    path = write_chat(make_chat(300, seed=8))
+    write_message_index(path)
+    corrupt(path, how)
+    assert load_message_index(path) is None
+
+
+def test_stale_index_is_ignored(make_chat, write_chat):
+    path = write_chat(make_chat(300, seed=9))
+    write_message_index(path)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("2024-01-01 00:00:00 张三 新消息\n")
+    assert load_message_index(path) is None
+
+
+def test_corrupt_index_falls_back_to_rebuilding(make_chat, write_chat):
+    text = make_chat(400, seed=10)
+    path = write_chat(text)
+    write_message_index(path)
+    corrupt(path, "truncated")
+
+    stat = os.stat(path)
+    table = _load_message_table(path, stat.st_mtime, stat.st_size)
+
+    assert_same_table(table, MessageTable.from_text(text))
+    # 损坏的索引被重新生成
+    assert load_message_index(path) is not None
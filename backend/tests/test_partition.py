@@ -0,0 +1,96 @@
+import random
+from datetime import datetime
+from functools import lru_cache
+
+import pytest
+
+from app.libs.preprocessing.message_table import MessageTable
+from app.libs.preprocessing.partition import (
+    anchored_split_by_tokens,
+    balanced_partition,
+    balanced_split_by_tokens,
+)
+from app.libs.utils.token_counter import get_token_counter
+
+
+def optimal_max_weight(weights, chunks: int) -> int:
+    """穷举所有切分方式得到的最优最大片段权重"""
+    @lru_cache(maxsize=None)
+    def best(start: int, parts: int) -> int:
+        if start == len(weights):
+            return 0
+        if parts == 1:
+            return sum(weights[start:])
+        return min(
+            max(sum(weights[start:stop]), best(stop, parts - 1))
+            for stop in range(start + 1, len(weights) + 1)
+        )
+    return best(0, chunks)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_balanced_partition_is_optimal(seed):
+    rng = random.Random(seed)
+    weights = tuple(rng.randint(0, 50) for _ in range(rng.randint(1, 12)))
+    chunks = rng.randint(1, 6)
+
+    ranges = balanced_partition(weights, chunks)
+
+    assert len(ranges) <= chunks
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(weights)
+    assert all(stop == next_start for (_, stop), (next_start, _) in zip(ranges, ranges[1:]))
+    assert all(start < stop for start, stop in ranges)
+    assert max(sum(weights[start:stop]) for start, stop in ranges) == optimal_max_weight(weights, chunks)
+
+
+def test_balanced_partition_empty():
+    assert balanced_partition([], 4) == []
+
+
+@pytest.mark.parametrize("split", [balanced_split_by_tokens, anchored_split_by_tokens])
+@pytest.mark.parametrize("max_tokens", [300, 3000])
+def test_chunks_fit_max_tokens_and_keep_every_message(make_chat, split, max_tokens):
+    text = make_chat(2000, seed=11)
+    table = MessageTable.from_text(text)
+
+    chunks = split(text, max_tokens=max_tokens)
+
+    # 片段按换行符拼接后的 token 数（包括拼接用的换行符）不超过上限
+    assert max(get_token_counter().count_batch(chunks)) <= max_tokens
+    assert '\n'.join(chunks) == table.join()
+
+
+def test_balanced_split_rounds_chunk_count_to_concurrency(make_chat):
+    text = make_chat(2000, seed=12)
+    chunks = balanced_split_by_tokens(text, max_tokens=3000, concurrency=8)
+    assert len(chunks) % 8 == 0
+
+
+def test_anchored_split_is_stable_when_days_are_appended(make_chat):
+    text = make_chat(3000, seed=13)
+    extended = text + make_chat(300, seed=14, start=datetime(2030, 1, 1))
+
+    before = anchored_split_by_tokens(text, max_tokens=3000)
+    after = anchored_split_by_tokens(extended, max_tokens=3000)
+
+    # 新增的天只影响最后一个片段，之前的片段逐字不变
+    assert after[:len(before) - 1] == before[:-1]
+    assert after[len(before) - 1].startswith(before[-1])
+
+
+def test_anchored_split_recovers_when_early_days_are_dropped(make_chat):
+    text = make_chat(3000, seed=15)
+    table = MessageTable.from_text(text)
+    # 去掉开头大约一周的消息（从某一天的第一条消息开始保留）
+    days = table.timestamp_array().astype('datetime64[D]')
+    first_kept = int((days > days[0] + 7).argmax())
+    trimmed = table.take(range(first_kept, len(table)))
+
+    before = anchored_split_by_tokens(table, max_tokens=3000)
+    after = anchored_split_by_tokens(trimmed, max_tokens=3000)
+
+    # 在某个自然锚点之后两次切分重新对齐，此后的片段完全相同
+    shared = next(i for i, chunk in enumerate(after) if chunk in before)
+    offset = before.index(after[shared])
+    assert after[shared:] == before[offset:]
+    assert len(before) - offset >= 0.8 * len(before)
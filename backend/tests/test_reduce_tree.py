@@ -0,0 +1,108 @@
+import asyncio
+import random
+
+import pytest
+
+from app.libs.core.reduce_tree import ReduceTree, plan_reduce_tree
+from app.libs.utils.token_counter import get_token_counter
+
+
+def make_doc(index: int, words: int) -> str:
+    return ' '.join(f"doc{index}" for _ in range(words))
+
+
+def run_tree(docs, merge, budget: int, max_depth: int, order=None):
+    """按给定顺序把 map 输出交给汇总树，返回 (最终汇总的输入, 汇总树)"""
+    async def main():
+        tree = ReduceTree(merge, budget=budget, max_depth=max_depth)
+        for index in order or range(len(docs)):
+            tree.add(index, docs[index])
+            await asyncio.sleep(0)
+        tree.close(len(docs))
+        return await tree.result(), tree
+    return asyncio.run(main())
+
+
+def test_plan_fits_in_one_level_when_under_budget():
+    assert plan_reduce_tree([100] * 5, budget=1000, merge_output_tokens=200) == [5]
+    assert plan_reduce_tree([5000], budget=1000, merge_output_tokens=200) == [1]
+    assert plan_reduce_tree([], budget=1000, merge_output_tokens=200) == [0]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_plan_levels_shrink_until_final_merge_fits(seed):
+    rng = random.Random(seed)
+    tokens = [rng.randint(1, 4000) for _ in range(rng.randint(2, 300))]
+
+    levels = plan_reduce_tree(tokens, budget=8000, merge_output_tokens=2000)
+
+    assert levels[0] == len(tokens)
+    # 每层至少减半
+    assert all(upper <= (lower + 1) // 2 for lower, upper in zip(levels, levels[1:]))
+    assert levels[-1] * 2000 <= 8000 or levels[-1] == 1
+
+
+def test_shrinking_merge_reduces_to_budget():
+    docs = [make_doc(i, 60) for i in range(40)]
+    calls = []
+
+    async def merge(group, depth, index):
+        calls.append(depth)
+        return make_doc(1000 + len(calls), 10)
+
+    result, tree = run_tree(docs, merge, budget=300, max_depth=5)
+
+    assert sum(get_token_counter().count_batch(result)) <= 300
+    assert tree.merges == len(calls) > 0
+    assert max(calls) <= 5
+
+
+def test_depth_cap_with_non_shrinking_merge():
+    docs = [make_doc(i, 60) for i in range(40)]
+    depths = []
+
+    async def merge(group, depth, index):
+        depths.append(depth)
+        # 汇总结果不比输入短：没有深度上限时会无限向上分组
+        return '\n'.join(group)
+
+    result, tree = run_tree(docs, merge, budget=300, max_depth=2)
+
+    assert depths and max(depths) <= 2
+    assert tree.depth <= 3
+    # 到达最高层后不再分组，最终汇总的输入按比例截断到预算内
+    assert sum(get_token_counter().count_batch(result)) <= 300
+
+
+def test_out_of_order_arrival_matches_in_order():
+    docs = [make_doc(i, 40) for i in range(30)]
+
+    async def merge(group, depth, index):
+        return f"L{depth}:" + '|'.join(doc.split()[0] for doc in group)
+
+    in_order, _ = run_tree(docs, merge, budget=200, max_depth=4)
+    order = list(range(len(docs)))
+    random.Random(0).shuffle(order)
+    shuffled, _ = run_tree(docs, merge, budget=200, max_depth=4, order=order)
+
+    assert shuffled == in_order
+
+
+def test_failed_documents_and_merges_are_dropped():
+    docs = [make_doc(i, 40) if i % 3 else None for i in range(30)]
+    failed = []
+
+    async def merge(group, depth, index):
+        names = [doc.split(':')[-1] if doc.startswith('L') else doc.split()[0] for doc in group]
+        if depth == 1 and index == 0:
+            failed.extend(names)
+            raise RuntimeError("merge failed")
+        return f"L{depth}:" + '|'.join(names)
+
+    result, _ = run_tree(docs, merge, budget=200, max_depth=4)
+
+    final = '|'.join(doc.split(':', 1)[-1] if doc.startswith('L') else doc.split()[0] for doc in result)
+    names = set(final.split('|'))
+    # 失败的片段（None）和失败汇总的输入都不出现在结果里，其余片段都在
+    assert failed
+    assert names == {f"doc{i}" for i in range(30) if i % 3} - set(failed)
@@ -0,0 +1,272 @@
+import asyncio
+
+import pytest
+
+from app.libs.utils import circuit_breaker, rate_limiter
+from app.libs.utils.circuit_breaker import BreakerConfig, CircuitBreaker, CircuitOpenError, CircuitState
+from app.libs.utils.rate_limiter import AdaptiveConcurrency, LimitConfig, RateLimiter
+from app.libs.utils.singleflight import SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", fake)
+    return fake
+
+
+def make_breaker(**overrides) -> CircuitBreaker:
+    config = BreakerConfig(window=10, min_calls=4, failure_rate=0.5, open_duration=30.0, half_open_probes=2)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return CircuitBreaker("test/model", config)
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.config.min_calls):
+        breaker.before_call()
+        breaker.on_failure()
+    assert breaker.state is CircuitState.OPEN
+
+
+# ---------- 熔断器 ----------
+
+def test_breaker_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.before_call()
+        breaker.on_failure()
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_breaker_opens_on_failure_rate(clock):
+    breaker = make_breaker()
+    for ok in (True, True, False, True, False, False):
+        breaker.before_call()
+        if ok:
+            breaker.on_success()
+        else:
+            breaker.on_failure()
+    # 6 次中 3 次失败，错误率达到 0.5
+    assert breaker.state is CircuitState.OPEN
+    assert breaker.opened == 1
+
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == pytest.approx(30.0)
+    assert breaker.rejected == 1
+    assert not breaker.available
+
+
+def test_breaker_half_opens_after_open_duration_and_closes_on_probe_success(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+
+    clock.now += 29.9
+    assert not breaker.available
+    clock.now += 0.1
+    assert breaker.available
+    assert breaker.state is CircuitState.HALF_OPEN
+
+    # 同时只放行 half_open_probes 个探测请求
+    breaker.before_call()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.on_success()
+    assert breaker.state is CircuitState.HALF_OPEN
+    breaker.on_success()
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.failure_rate == 0.0
+
+
+def test_breaker_reopens_on_probe_failure(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock.now += 30.0
+
+    breaker.before_call()
+    breaker.on_failure()
+
+    assert breaker.state is CircuitState.OPEN
+    assert breaker.opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_abandoned_probe_releases_its_slot(clock):
+    breaker = make_breaker(half_open_probes=1)
+    open_breaker(breaker)
+    clock.now += 30.0
+
+    breaker.before_call()
+    assert not breaker.available
+    breaker.on_abandoned(elapsed=1.0)
+    assert breaker.available
+    assert breaker.state is CircuitState.HALF_OPEN
+
+    # 超过 slow_call_duration 的取消按失败处理
+    breaker.before_call()
+    breaker.on_abandoned(elapsed=breaker.config.slow_call_duration)
+    assert breaker.state is CircuitState.OPEN
+
+
+# ---------- AIMD 并发控制 ----------
+
+def test_additive_increase_and_multiplicative_decrease():
+    concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=8, latency_factor=3.0)
+
+    concurrency.on_success()
+    assert concurrency.limit == pytest.approx(4.25)
+
+    concurrency.on_rate_limited()
+    assert concurrency.limit == pytest.approx(2.125)
+
+
+def test_concurrency_is_clamped():
+    concurrency = AdaptiveConcurrency(initial=100, minimum=2, maximum=8, latency_factor=3.0)
+    assert concurrency.limit == 8
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 8
+
+    for _ in range(10):
+        concurrency.on_rate_limited()
+    assert concurrency.limit == 2
+
+
+def test_latency_spike_backs_off():
+    concurrency = AdaptiveConcurrency(initial=10, minimum=1, maximum=64, latency_factor=3.0)
+    for _ in range(11):
+        concurrency.on_success(latency=1.0)
+    before = concurrency.limit
+
+    concurrency.on_success(latency=10.0)
+
+    assert concurrency.limit == pytest.approx(before * 0.9)
+
+
+def test_acquire_respects_limit():
+    async def main():
+        concurrency = AdaptiveConcurrency(initial=2, minimum=1, maximum=8, latency_factor=3.0)
+        await concurrency.acquire()
+        await concurrency.acquire()
+        third = asyncio.ensure_future(concurrency.acquire())
+        await asyncio.sleep(0.01)
+        assert not third.done()
+        await concurrency.release()
+        await asyncio.wait_for(third, 1)
+        assert concurrency.in_flight == 2
+
+    asyncio.run(main())
+
+
+def test_rate_limited_blocks_and_halves(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: 500.0)
+    limiter = RateLimiter("test/model", LimitConfig(initial_concurrency=10))
+
+    assert limiter.on_rate_limited(retry_after=7.0) == 7.0
+    assert limiter.blocked_until == 507.0
+    assert limiter.concurrency_limit == 5
+
+    # 没有 Retry-After 时按连续 429 次数指数退避；暂停时间只延长不缩短
+    assert limiter.on_rate_limited() == 4.0
+    assert limiter.blocked_until == 507.0
+    assert limiter.rate_limited == 2
+
+
+# ---------- 请求合并 ----------
+
+def test_single_flight_coalesces_concurrent_calls():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        assert results == ["result"] * 5
+        assert (flight.executed, flight.coalesced) == (1, 4)
+
+        # 完成后立即移除，之后的调用重新执行
+        assert await flight.do("key", fetch) == "result"
+        assert flight.executed == 2
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+    assert calls == 2
+
+
+def test_single_flight_cancelled_waiter_does_not_cancel_others():
+    started = 0
+
+    async def fetch():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "result"
+        assert first.cancelled()
+
+        # 全部等待者取消后底层任务也被取消
+        only = asyncio.ensure_future(flight.do("other", fetch))
+        await asyncio.sleep(0.01)
+        only.cancel()
+        await asyncio.sleep(0.01)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+    assert started == 2
+
+
+def test_single_flight_stream_shares_one_generation():
+    generations = 0
+
+    async def factory():
+        nonlocal generations
+        generations += 1
+
+        async def source():
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield chunk
+        return source()
+
+    async def collect(stream):
+        return [chunk async for chunk in stream]
+
+    async def main():
+        flight = SingleFlight()
+        first = flight.stream("doc", factory)
+        await asyncio.sleep(0.015)
+        assert flight.streaming("doc")
+        # 后加入的订阅者先回放已经产生的片段
+        second = flight.stream("doc", factory)
+        results = await asyncio.gather(collect(first), collect(second))
+        assert results == [["a", "b", "c"], ["a", "b", "c"]]
+        assert (flight.streams_started, flight.streams_joined) == (1, 1)
+        await asyncio.sleep(0)
+        assert not flight.streaming("doc")
+
+    asyncio.run(main())
+    assert generations == 1
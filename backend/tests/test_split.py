@@ -0,0 +1,104 @@
+import re
+
+import pytest
+import tiktoken
+
+from app.libs.preprocessing.message_table import MessageTable
+from app.libs.preprocessing.parallel import split_by_tokens_parallel
+from app.libs.preprocessing.reader import iter_messages, map_message_table, read_file
+from app.libs.preprocessing.split import split_by_tokens
+
+# 改造前 split_by_tokens 的消息解析方式
+BASELINE_PATTERN = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (.*?)(?=\n\d{4}-\d{2}-\d{2}|\Z)'
+
+
+def baseline_split_by_tokens(chat_text: str, max_tokens: int) -> list:
+    """改造前基于正则和逐条 tiktoken 编码的实现（只保留聊天记录分支），作为等价性的参照"""
+    encoding = tiktoken.get_encoding("cl100k_base")
+    segments = []
+    current_segment = []
+    current_tokens = 0
+    for timestamp, content in re.findall(BASELINE_PATTERN, chat_text, re.DOTALL):
+        message = f"{timestamp} {content}"
+        message_tokens = len(encoding.encode(message))
+        if message_tokens > max_tokens:
+            if current_segment:
+                segments.append('\n'.join(current_segment))
+                current_segment = []
+                current_tokens = 0
+            segments.append(message)
+            continue
+        if current_tokens + message_tokens > max_tokens:
+            segments.append('\n'.join(current_segment))
+            current_segment = []
+            current_tokens = 0
+        current_segment.append(message)
+        current_tokens += message_tokens
+    if current_segment:
+        segments.append('\n'.join(current_segment))
+    return segments
+
+
+def all_paths(path: str, max_tokens: int) -> dict:
+    """同一个文件经由各条读取路径得到的分割结果"""
+    return {
+        "read_file": split_by_tokens(read_file(path), max_tokens),
+        "mmap": split_by_tokens(map_message_table(path), max_tokens),
+        "stream": split_by_tokens(iter_messages(path, block_size=4096), max_tokens),
+        "parallel": split_by_tokens_parallel(path, max_tokens, workers=2),
+    }
+
+
+@pytest.mark.parametrize("max_tokens", [200, 2000])
+def test_split_matches_baseline(make_chat, write_chat, max_tokens):
+    text = make_chat(3000, seed=1)
+    expected = baseline_split_by_tokens(text, max_tokens)
+    for name, segments in all_paths(write_chat(text), max_tokens).items():
+        assert segments == expected, name
+
+
+def test_split_gbk_matches_baseline(make_chat, write_chat):
+    text = make_chat(2000, seed=2)
+    expected = baseline_split_by_tokens(text, 1000)
+    for name, segments in all_paths(write_chat(text, encoding="gbk"), 1000).items():
+        assert segments == expected, name
+
+
+def test_split_crlf_matches_text_mode(make_chat, write_chat):
+    text = make_chat(2000, seed=3)
+    path = write_chat(text, newline="\r\n")
+    # read_file 以文本模式读取，通用换行把 \r\n 换成 \n
+    assert read_file(path) == text
+    expected = baseline_split_by_tokens(text, 1000)
+    for name, segments in all_paths(path, 1000).items():
+        assert segments == expected, name
+
+
+def test_split_skips_leading_bom(make_chat, write_chat):
+    text = make_chat(500, seed=4)
+    path = write_chat(text, bom=True)
+    expected = baseline_split_by_tokens(text, 1000)
+    for name, segments in all_paths(path, 1000).items():
+        assert segments == expected, name
+    assert len(map_message_table(path)) == len(MessageTable.from_text(text))
+
+
+def test_split_tolerates_invalid_dates(make_chat, write_chat):
+    text = make_chat(300, seed=5)
+    text += "2023-02-30 10:00:00 张三 二月没有三十号\n2023-13-01 25:61:00 李四 月份和时间都越界\n"
+    expected = baseline_split_by_tokens(text, 1000)
+    for name, segments in all_paths(write_chat(text), 1000).items():
+        assert segments == expected, name
+
+    table = MessageTable.from_text(text)
+    timestamps = table.timestamp_array()
+    # 越界的字段顺延：2023-02-30 按 2023-03-02 处理
+    assert str(timestamps[-2]) == "2023-03-02T10:00:00"
+    assert str(timestamps[-1]) == "2024-01-02T02:01:00"
+
+
+def test_body_lines_starting_with_a_date_stay_in_the_message():
+    text = "2023-05-11 19:33:39 张三 会议改到\n2023-05-12 开会\n2023-05-11 19:34:00 李四 收到\n"
+    table = MessageTable.from_text(text)
+    assert list(table.messages()) == ["2023-05-11 19:33:39 张三 会议改到\n2023-05-12 开会",
+                                      "2023-05-11 19:34:00 李四 收到\n"]